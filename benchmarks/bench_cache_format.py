@@ -0,0 +1,71 @@
+"""File size, cold-open time and lookup latency of the SqliteDict and compact cache formats.
+
+A cache file is filled with ``--rows`` translations, then compacted into a copy. Each format runs in a fresh
+interpreter, which loads the pair eagerly, opens it lazily, and looks up ``--lookups`` random keys on disk.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_cache_format [--rows 200000]
+"""
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+from os import path
+
+from niutranspy.cache import _SqliteDictStore, compact
+
+_CHILD = '''
+import json, random, sys
+from time import perf_counter
+from niutranspy import cache
+filename, rows, lookups = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+t = perf_counter()
+eager = cache._new_cache(filename, 'zh', 'en', 'eager')
+eager_s = perf_counter() - t
+t = perf_counter()
+lazy = cache._new_cache(filename, 'zh', 'en', 'lazy')
+lazy.get('源文本 0')
+lazy_s = perf_counter() - t
+store = lazy.store
+latencies = []
+for i in random.sample(range(rows), lookups):
+    t = perf_counter()
+    store.get(f'源文本 {i}')
+    latencies.append(perf_counter() - t)
+latencies.sort()
+p50, p99 = latencies[len(latencies) // 2], latencies[len(latencies) * 99 // 100]
+print(json.dumps({'eager_s': eager_s, 'lazy_s': lazy_s, 'p50_us': p50 * 1e6, 'p99_us': p99 * 1e6}))
+'''
+
+
+def _translation(i: int) -> str:
+    return f'Source text number {i}, ' + 'with a sentence repeated as web pages do. ' * (i % 8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--lookups', type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = {'sqlitedict': path.join(tmp, 'sqlitedict.db'), 'compact': path.join(tmp, 'compact.db')}
+        _SqliteDictStore(files['sqlitedict'], 'zh_en').update(
+            (f'源文本 {i}', _translation(i)) for i in range(args.rows))
+        shutil.copy(files['sqlitedict'], files['compact'])
+        compact(files['compact'])
+
+        print(f'{args.rows} rows, {args.lookups} random lookups')
+        for name, filename in files.items():
+            out = subprocess.run([sys.executable, '-c', _CHILD, filename, str(args.rows), str(args.lookups)],
+                                 check=True, capture_output=True, text=True).stdout
+            r = json.loads(out)
+            print(f'{name:>10}: {path.getsize(filename) / 2 ** 20:.1f} MB, eager load {r["eager_s"]:.3f} s, '
+                  f'lazy open {r["lazy_s"] * 1e3:.1f} ms, lookup p50 {r["p50_us"]:.1f} us p99 {r["p99_us"]:.1f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Flush cost of the write-behind translation cache, and its hit rate after a restart.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_cache_persistence [--entries 10000]
+"""
+import argparse
+import random
+import tempfile
+from os import path
+from time import perf_counter
+
+from niutranspy import cache, utils
+
+
+def _restart(filename):
+    """Forgets the in-process caches, as a new worker process would."""
+    utils._caches.pop(filename, None)
+    return utils._load_dict(filename, 'zh', 'en', utils._caches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=10000)
+    args = parser.parse_args()
+    cache.FLUSH_SIZE = args.entries + 1  # measure one explicit flush, not the background ones
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = path.join(tmp, 'cache.db')
+        dic = _restart(filename)
+        texts = [f'源文本 {i} ' + '测试' * random.randint(1, 40) for i in range(args.entries)]
+        for i, s in enumerate(texts):
+            dic[s] = f'source text {i}'
+
+        t = perf_counter()
+        written = cache.flush_caches()
+        elapsed = perf_counter() - t
+        print(f'flush: {written} entries in {elapsed * 1000:.1f} ms '
+              f'({elapsed * 1000 * 10000 / max(written, 1):.1f} ms per 10k entries)')
+
+        t = perf_counter()
+        dic = _restart(filename)
+        print(f'reload: {len(dic)} entries in {(perf_counter() - t) * 1000:.1f} ms')
+
+        hits = sum(1 for s in texts if dic.get(s))
+        print(f'hit rate after restart: {hits / len(texts):.1%} (was 0.0% without write-behind)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""API calls saved by coalescing concurrent cache misses of the same text.
+
+``--threads`` threads translate pages at the same time, all of them with the same header and footer, through the
+local stub server with ``--latency`` seconds per request, with and without coalescing.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_coalescing [--threads 32]
+"""
+import argparse
+import tempfile
+import threading
+from os import makedirs, path
+from time import perf_counter
+
+from niutranspy import Niutrans, Translator, utils
+from tests.stub_server import StubServer
+
+_PAGE = '<div><header>网站标题 {burst}</header><p>第 {i} 篇文章的正文</p><footer>版权所有 {burst}</footer></div>'
+
+
+class _NoCoalescing(object):
+    @staticmethod
+    def do(key, fn):
+        return fn()
+
+
+def _run(coalescing: bool, threads: int, bursts: int, latency: float):
+    with tempfile.TemporaryDirectory() as tmp, StubServer(latency) as server:
+        makedirs(path.join(tmp, 'translation'))
+        open(path.join(tmp, 'translation', 'suggestion.txt'), 'w').close()
+        niutrans = Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url, pool_size=threads)
+        translator = Translator(tmp, niutrans)
+        if not coalescing:
+            translator._flights = _NoCoalescing()
+        t = perf_counter()
+        for burst in range(bursts):
+            barrier = threading.Barrier(threads)
+
+            def translate(i):
+                barrier.wait()
+                translator.translate(_PAGE.format(burst=burst, i=i), 'en', 'zh')
+
+            workers = [threading.Thread(target=translate, args=(i,)) for i in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        elapsed = perf_counter() - t
+        utils._caches.clear()
+        return server.stats['requests'], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--bursts', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.1)
+    args = parser.parse_args()
+
+    print(f'{args.bursts} bursts of {args.threads} pages, {args.latency * 1e3:.0f} ms per request')
+    for coalescing in (False, True):
+        requests, elapsed = _run(coalescing, args.threads, args.bursts, args.latency)
+        print(f'coalescing {"on" if coalescing else "off":>3}: {requests} API calls, {elapsed:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Time to translate a long document block by block, and with concurrent dispatch.
+
+Requests go to a local stub of the NiuTrans API which adds a fixed latency.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_concurrent_dispatch [--latency 0.05] [--blocks 16]
+"""
+import argparse
+from time import perf_counter
+
+from niutranspy import Niutrans
+from tests.stub_server import StubServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--blocks', type=int, default=16)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    line = '这是一个用于测试的句子。' * 40
+    plain = '\n'.join(f'{i} {line}' for i in range(args.blocks * 10))  # ~10 lines per 5000 char block
+    xml = '\n'.join(f'<p>{i} {line}</p>' for i in range(args.blocks * 10))
+
+    with StubServer(latency=args.latency) as server:
+        for kind, text, is_plain_str in (('plain', plain, True), ('xml', xml, False)):
+            for workers in args.workers:
+                niutrans = Niutrans('key', max_workers=workers, api_url=server.api_url,
+                                    xml_api_url=server.xml_api_url)
+                before = server.stats['requests']
+                t = perf_counter()
+                translated, err = niutrans(text, 'zh', 'en', {}, is_plain_str)
+                elapsed = perf_counter() - t
+                assert translated and not err, repr(err)[:200]
+                print(f'{kind:>5}, max_workers={workers}: {server.stats["requests"] - before} requests '
+                      f'in {elapsed:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""End-to-end throughput, latency, API usage and memory of Translator over the fixture corpus.
+
+The documents of ``benchmarks/corpus``, named ``{from_lang}-{name}.{txt|html}``, are made into ``--copies`` distinct
+copies, and translated by ``--threads`` threads through the local stub server, which answers after ``--latency``
+seconds and fails ``--error-rate`` of the requests with a retryable error. A cold phase translates them with an empty
+cache, then a warm phase translates them again.
+
+Results can be written with ``--output``, and compared with those of another version with ``--compare``, which
+exits with status 1 when a metric is worse by more than ``--tolerance``. Run from the repository root::
+
+    python -m benchmarks.bench_end_to_end [--copies 20] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import platform
+import re
+import resource
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from os import listdir, makedirs, path
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+import niutranspy
+from niutranspy import Niutrans, Scheduler, Translator, utils
+from tests.stub_server import StubServer
+
+CORPUS_DIR = path.join(path.dirname(__file__), 'corpus')
+
+# (metric, True if higher is better), the metrics compared by --compare
+_COMPARED = [('docs_per_s', True), ('chars_per_s', True), ('p50_ms', False), ('p90_ms', False), ('p99_ms', False),
+             ('api_calls', False), ('chars_billed', False)]
+_TEXT_LINE = re.compile(r'^(?=.*\S)', re.M)
+_TEXT_NODE = re.compile(r'>(?=[^<]*[^<\s])')
+
+
+def load_corpus(copies: int) -> List[Tuple[str, str, str]]:
+    """Returns ``(text, to_lang, from_lang)`` of ``copies`` distinct copies of every document of the corpus."""
+    docs = []
+    for name in sorted(listdir(CORPUS_DIR)):
+        from_lang, ext = name.split('-', 1)[0], path.splitext(name)[1]
+        with open(path.join(CORPUS_DIR, name), encoding='utf-8') as f:
+            text = f.read()
+        to_lang = 'zh' if from_lang == 'en' else 'en'
+        for i in range(copies):  # numbering every line or text node keeps the copies from hitting the cache
+            copy = _TEXT_NODE.sub(f'>#{i} ', text) if ext == '.html' else _TEXT_LINE.sub(f'#{i} ', text)
+            docs.append((copy, to_lang, from_lang))
+    return docs
+
+
+def _percentile(values: List[float], p: int) -> float:
+    return values[min(len(values) - 1, len(values) * p // 100)]
+
+
+def _run_phase(translator: Translator, server: StubServer, docs, threads: int, detect: bool) -> Dict:
+    before = server.stats
+
+    def translate(doc):
+        text, to_lang, from_lang = doc
+        t = perf_counter()
+        try:
+            translator.translate(text, to_lang, None if detect else from_lang)
+        except Exception:  # given up after the retries
+            return None
+        return perf_counter() - t
+
+    t = perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        latencies = list(executor.map(translate, docs))
+    elapsed = perf_counter() - t
+    after = server.stats
+    done = sorted(x for x in latencies if x is not None)
+    chars = sum(len(doc[0]) for doc, x in zip(docs, latencies) if x is not None)
+    return {
+        'docs': len(docs), 'failed': len(docs) - len(done), 'seconds': elapsed,
+        'docs_per_s': len(done) / elapsed, 'chars_per_s': chars / elapsed,
+        'p50_ms': _percentile(done, 50) * 1e3 if done else None,
+        'p90_ms': _percentile(done, 90) * 1e3 if done else None,
+        'p99_ms': _percentile(done, 99) * 1e3 if done else None,
+        'api_calls': after['requests'] - before['requests'], 'chars_billed': after['chars'] - before['chars'],
+        'api_errors': after['errors'] - before['errors'],
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # peak so far, in kB on Linux
+    }
+
+
+def run(args) -> Dict:
+    docs = load_corpus(args.copies)
+    results = {'niutranspy': niutranspy.__version__, 'python': platform.python_version(), 'args': vars(args),
+               'phases': {}}
+    with tempfile.TemporaryDirectory() as tmp, StubServer(args.latency, args.qps_limit, args.chars_per_second,
+                                                          args.error_rate, seed=args.seed) as server:
+        makedirs(path.join(tmp, 'translation'))
+        open(path.join(tmp, 'translation', 'suggestion.txt'), 'w').close()
+        scheduler = Scheduler(args.qps_limit, args.chars_per_second, base_delay=0.01)
+        niutrans = Niutrans('key', args.max_workers, server.api_url, server.xml_api_url,
+                            pool_size=args.threads * args.max_workers, scheduler=scheduler)
+        translator = Translator(tmp, niutrans, args.cache_mode)
+        for phase in ('cold', 'warm'):
+            results['phases'][phase] = _run_phase(translator, server, docs, args.threads, args.detect)
+        translator.flush()
+        niutrans.close()
+        utils._caches.clear()
+    return results
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Prints the change of every metric against the baseline, and returns the regressions beyond the tolerance."""
+    ignored = {'output', 'compare', 'tolerance'}
+    changed = [k for k, v in results['args'].items() if k not in ignored and baseline['args'].get(k) != v]
+    if changed:
+        print(f'Warning: the workloads differ in {", ".join(changed)}')
+    regressions = []
+    for phase, r in results['phases'].items():
+        b = baseline['phases'].get(phase)
+        if b is None:
+            continue
+        for metric, higher_is_better in _COMPARED:
+            new, old = r.get(metric), b.get(metric)
+            if new is None or not old:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            flag = ' REGRESSION' if worse > tolerance else ''
+            print(f'{phase:>5} {metric:>12}: {old:12.2f} -> {new:12.2f} ({change:+.1%}){flag}')
+            if flag:
+                regressions.append(f'{phase} {metric}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--copies', type=int, default=20, help='Distinct copies of every document')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--max-workers', type=int, default=1, help='max_workers of the backend')
+    parser.add_argument('--cache-mode', default='eager', choices=sorted(Translator.CACHE_MODES))
+    parser.add_argument('--detect', action='store_true', help='Detect the languages of the documents')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds per request of the stub server')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--qps-limit', type=int, help='Limit of the stub server, and of the scheduler')
+    parser.add_argument('--chars-per-second', type=int, help='Limit of the stub server, and of the scheduler')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random errors')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Relative change counted as a regression')
+    args = parser.parse_args()
+
+    results = run(args)
+    print(f'niutranspy {results["niutranspy"]}, Python {results["python"]}, {results["phases"]["cold"]["docs"]} '
+          f'documents, {args.threads} threads, {args.latency * 1e3:.0f} ms per request')
+    for phase, r in results['phases'].items():
+        print(f'{phase:>5}: {r["docs_per_s"]:8.1f} docs/s {r["chars_per_s"]:10.0f} chars/s, latency p50 '
+              f'{r["p50_ms"] or 0:.1f} p90 {r["p90_ms"] or 0:.1f} p99 {r["p99_ms"] or 0:.1f} ms, {r["api_calls"]} API '
+              f'calls, {r["chars_billed"]} chars billed, {r["api_errors"]} errors, {r["failed"]} failed, max RSS '
+              f'{r["max_rss_mb"]:.0f} MB')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f'Regressions: {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Per-call overhead of Translator.translate for cache hits and untranslatable inputs.
+
+Every input is translated once to fill the cache, then timed over ``--number`` calls. The backend translates
+in-process, but isn't called by the timed calls.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_fast_path [--number 20000]
+"""
+import argparse
+import tempfile
+import timeit
+from os import makedirs, path
+
+from niutranspy import Translator, utils
+from tests.stub_server import LocalNiutrans
+
+_CASES = [
+    ('plain hit', '这是一段已经翻译过的文本', 'zh'),
+    ('plain hit, detected', '这是一段已经翻译过的文本', None),
+    ('multi-line plain hit', '第一行文本\n第二行文本\n第三行文本', 'zh'),
+    ('HTML hit', '<p class="intro">这是 <b>粗体</b> 和 <a href="/x">链接</a></p>', 'zh'),
+    ('HTML hit, detected', '<p class="intro">这是 <b>粗体</b> 和 <a href="/x">链接</a></p>', None),
+    ('ASCII from zh', 'Version 2.0 released', 'zh'),
+    ('number', '2020-08-04 12:30', 'zh'),
+    ('punctuation', '（— ※ —）', None),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        makedirs(path.join(tmp, 'translation'))
+        open(path.join(tmp, 'translation', 'suggestion.txt'), 'w').close()
+        translator = Translator(tmp, LocalNiutrans())
+        for name, text, from_lang in _CASES:
+            try:
+                translator.translate(text, 'en', from_lang)
+            except ValueError as e:  # the language of the text can't be detected
+                print(f'{name:>22}: {e!r}')
+                continue
+            seconds = timeit.timeit(lambda: translator.translate(text, 'en', from_lang), number=args.number)
+            print(f'{name:>22}: {seconds / args.number * 1e6:7.2f} us per call')
+        translator.flush()
+        utils._caches.clear()
+
+
+if __name__ == '__main__':
+    main()
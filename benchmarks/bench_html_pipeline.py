@@ -0,0 +1,50 @@
+"""CPU cost of translating HTML documents of several sizes, with a warm and a cold cache.
+
+The backend translates in-process, so that only parsing, chunking and reassembly are measured. Requires
+pytest-benchmark; run from the repository root::
+
+    python -m pytest benchmarks/bench_html_pipeline.py
+"""
+import pytest
+
+from niutranspy import Translator, utils
+from tests.stub_server import LocalNiutrans
+
+pytest.importorskip('pytest_benchmark')
+
+_PARAGRAPH = ('<p class="c{i}">这是第 {i} 段，包含<a href="/page/{i}">一个链接</a>、<b>粗体</b>和'
+              '<span> 一些 <i>嵌套的</i> 内联元素 </span>。</p>\n')
+
+
+def _document(size: int) -> str:
+    paragraphs, i = [], 0
+    while sum(map(len, paragraphs)) < size:
+        paragraphs.append(_PARAGRAPH.format(i=i))
+        i += 1
+    return f'<div><h1>标题</h1>\n{"".join(paragraphs)}</div>'
+
+
+@pytest.fixture
+def translator(tmp_path):
+    (tmp_path / 'translation').mkdir()
+    (tmp_path / 'translation' / 'suggestion.txt').write_text('')
+    yield Translator(str(tmp_path), LocalNiutrans())
+    utils._caches.clear()
+
+
+@pytest.mark.parametrize('size', [1000, 10000, 100000])
+def test_warm_cache(benchmark, translator, size):
+    doc = _document(size)
+    expected = translator.translate(doc, 'en')
+    assert benchmark(translator.translate, doc, 'en') == expected
+
+
+@pytest.mark.parametrize('size', [1000, 10000, 100000])
+def test_cold_cache(benchmark, translator, size):
+    doc = _document(size)
+
+    def translate():
+        utils._caches.clear()
+        return translator.translate(doc, 'en', 'zh')
+
+    assert 'en:' in benchmark(translate)
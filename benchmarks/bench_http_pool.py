@@ -0,0 +1,48 @@
+"""Requests per second sent to the translation API with a new connection per request, and with pooling.
+
+Requests go to a local stub of the NiuTrans API.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_http_pool [--requests 2000] [--threads 1 8]
+"""
+import argparse
+import json
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import requests
+
+from niutranspy import Niutrans
+from tests.stub_server import StubServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+    args = parser.parse_args()
+
+    with StubServer() as server:
+        niutrans = Niutrans('key', api_url=server.api_url, pool_size=max(args.threads))
+
+        def unpooled(i):  # what Niutrans did before
+            data = {'apikey': 'key', 'src_text': f'测试 {i}', 'from': 'zh', 'to': 'en'}
+            return json.loads(requests.post(server.api_url, data=data).text)['tgt_text']
+
+        def pooled(i):
+            return niutrans._translate_base(server.api_url, f'测试 {i}', 'zh', 'en', {})
+
+        for threads in args.threads:
+            for name, func in (('requests.post', unpooled), ('pooled session', pooled)):
+                connections = server.stats['connections']
+                with ThreadPoolExecutor(threads) as executor:
+                    t = perf_counter()
+                    list(executor.map(func, range(args.requests)))
+                    elapsed = perf_counter() - t
+                print(f'{threads} thread(s), {name:>14}: {args.requests / elapsed:7.0f} requests/s, '
+                      f'{server.stats["connections"] - connections} connections')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Language detection time without a cache, and with the detection cache, before and after a restart.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_lang_detection [--segments 20000] [--unique 2000]
+"""
+import argparse
+import random
+import tempfile
+from os import path
+from time import perf_counter
+
+from niutranspy import utils
+
+_WORDS = ['测试', '翻译', '缓存', 'language', 'detection', 'cache', 'テスト', '翻訳', 'キャッシュ', 'données']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--segments', type=int, default=20000)
+    parser.add_argument('--unique', type=int, default=2000)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    unique = [' '.join(rnd.choice(_WORDS[j * 3:j * 3 + 3]) for _ in range(8)) + f' {i}'
+              for i in range(args.unique) for j in [i % 3]]
+    segments = [rnd.choice(unique) for _ in range(args.segments)]
+    print(f'{args.segments} segments, {args.unique} distinct')
+
+    t = perf_counter()
+    expected = [lang if good else None for good, lang in map(utils.get_lang, segments)]
+    uncached = perf_counter() - t
+    print(f'{"no cache":>16}: {uncached:.3f} s')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = path.join(tmp, 'cache.db')
+        for run in ('cold cache', 'after restart'):
+            detector = utils._LangDetector(filename)
+            t = perf_counter()
+            assert detector.detect_many(segments) == expected
+            elapsed = perf_counter() - t
+            stats = detector.stats()
+            print(f'{run:>16}: {elapsed:.3f} s ({uncached - elapsed:.3f} s saved), hit rate {stats["hit_rate"]:.1%}, '
+                  f'{stats["detect_seconds"]:.3f} s detecting')
+            detector._cache.flush()
+
+
+if __name__ == '__main__':
+    main()
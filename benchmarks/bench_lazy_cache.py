@@ -0,0 +1,57 @@
+"""Cold-start time and memory of the eager and lazy translation cache modes.
+
+Each mode runs in a fresh interpreter, which loads a language pair and looks up ``--lookups`` random keys.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_lazy_cache [--rows 1000000]
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from os import path
+
+from niutranspy.cache import _SqliteDictStore
+
+_CHILD = '''
+import json, random, resource, sys
+from time import perf_counter
+from niutranspy import utils
+filename, mode, rows, lookups = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+t = perf_counter()
+cache, old_cache = utils._load_dicts(filename, 'zh', 'en', mode)
+cache.get('源文本 0')
+cold = perf_counter() - t
+keys = [f'源文本 {random.randrange(rows)}' for _ in range(lookups)]
+t = perf_counter()
+hits = sum(1 for k in keys if cache.get(k))
+lookup = (perf_counter() - t) / lookups
+print(json.dumps({'cold_s': cold, 'lookup_us': lookup * 1e6, 'hits': hits,
+                  'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = path.join(tmp, 'cache.db')
+        _SqliteDictStore(filename, 'zh_en').update(
+            (f'源文本 {i}', f'source text {i} ' + 'x' * (i % 200)) for i in range(args.rows))
+
+        print(f'{args.rows} rows, {args.lookups} random lookups')
+        for mode in ('eager', 'lazy'):
+            out = subprocess.run([sys.executable, '-c', _CHILD, filename, mode, str(args.rows), str(args.lookups)],
+                                 check=True, capture_output=True, text=True).stdout
+            r = json.loads(out)
+            print(f'{mode:>5}: cold start {r["cold_s"]:.3f} s, lookup {r["lookup_us"]:.1f} us, '
+                  f'max RSS {r["max_rss_mb"]:.0f} MB, {r["hits"]} hits')
+
+
+if __name__ == '__main__':
+    main()
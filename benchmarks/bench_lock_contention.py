@@ -0,0 +1,72 @@
+"""Throughput and latency of cache hits from many threads, while the caches of other language pairs are loading.
+
+Every language pair has ``--rows`` cached translations. The threads translate cached texts of random pairs, starting
+with every cache unloaded, so that hits of the loaded pairs compete with the loading of the others.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_lock_contention [--threads 32] [--rows 200000]
+"""
+import argparse
+import random
+import tempfile
+import threading
+from os import path, makedirs
+from time import perf_counter
+
+from niutranspy import Translator, utils
+from niutranspy.cache import _SqliteDictStore
+from tests.stub_server import LocalNiutrans
+
+_PAIRS = [('zh', 'en'), ('ja', 'en'), ('ko', 'en'), ('fr', 'en'), ('de', 'zh'), ('es', 'zh'), ('ru', 'zh'),
+          ('en', 'zh')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--calls', type=int, default=2000, help='per thread')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        makedirs(path.join(cache_dir, 'translation'))
+        open(path.join(cache_dir, Translator.SUGGESTION_FILE_NAME), 'w').close()
+        filename = path.join(cache_dir, Translator.CACHE_FILE_NAME)
+        for from_lang, to_lang in _PAIRS:
+            _SqliteDictStore(filename, f'{from_lang}_{to_lang}').update(
+                (f'文本 {i}', f'{to_lang}:文本 {i}') for i in range(args.rows))
+        translator = Translator(cache_dir, LocalNiutrans())
+
+        latencies = []
+        barrier = threading.Barrier(args.threads + 1)
+
+        def work(seed):
+            rnd, local = random.Random(seed), []
+            barrier.wait()
+            for _ in range(args.calls):
+                from_lang, to_lang = rnd.choice(_PAIRS)
+                t = perf_counter()
+                translator.translate(f'文本 {rnd.randrange(args.rows)}', to_lang, from_lang)
+                local.append(perf_counter() - t)
+            latencies.extend(local)
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(args.threads)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        t = perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - t
+        utils._caches.clear()
+
+    latencies.sort()
+    p50, p99 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+    print(f'{args.threads} threads, {len(_PAIRS)} language pairs of {args.rows} rows: '
+          f'{len(latencies) / elapsed:.0f} translations/s, p50 {p50 * 1e3:.3f} ms, p99 {p99 * 1e3:.1f} ms, '
+          f'max {latencies[-1] * 1e3:.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
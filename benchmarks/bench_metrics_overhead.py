@@ -0,0 +1,42 @@
+"""Cost of the metrics on cache hits, with recording disabled and with a Prometheus sink.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_metrics_overhead [--repeat 20000]
+"""
+import argparse
+import tempfile
+from os import path, makedirs
+from time import perf_counter
+
+from niutranspy import Translator, metrics, utils
+from tests.stub_server import LocalNiutrans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20000)
+    args = parser.parse_args()
+
+    texts = [f'<p>第 {i} 段<b>粗体</b></p>' for i in range(100)]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        makedirs(path.join(cache_dir, 'translation'))
+        open(path.join(cache_dir, Translator.SUGGESTION_FILE_NAME), 'w').close()
+        translator = Translator(cache_dir, LocalNiutrans())
+        for text in texts:
+            translator.translate(text, 'en', 'zh')
+
+        for name in ('disabled', 'prometheus'):
+            sink = metrics.add_sink(metrics.PrometheusSink()) if name == 'prometheus' else None
+            t = perf_counter()
+            for i in range(args.repeat):
+                translator.translate(texts[i % len(texts)], 'en', 'zh')
+            elapsed = perf_counter() - t
+            print(f'{name:>10}: {elapsed / args.repeat * 1e6:.1f} us per cached translation')
+            if sink:
+                metrics.remove_sink(sink)
+        utils._caches.clear()
+
+
+if __name__ == '__main__':
+    main()
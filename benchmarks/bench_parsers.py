@@ -0,0 +1,57 @@
+"""Throughput of the HTML parsers selectable with ``niutranspy.set_parser``.
+
+Measures parsing alone, and translating with a warm and a cold cache through an in-process backend.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_parsers [--sizes 1000 10000 100000]
+"""
+import argparse
+import tempfile
+from os import path, makedirs
+from time import perf_counter
+
+from niutranspy import Translator, utils
+from benchmarks.bench_html_pipeline import _document
+from tests.stub_server import LocalNiutrans
+
+
+def _rate(func, size: int, seconds: float = 1.0) -> float:
+    """Returns the throughput of func, in MB/s of HTML."""
+    n, t = 0, perf_counter()
+    while perf_counter() - t < seconds:
+        func()
+        n += 1
+    return n * size / (perf_counter() - t) / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        makedirs(path.join(cache_dir, 'translation'))
+        open(path.join(cache_dir, Translator.SUGGESTION_FILE_NAME), 'w').close()
+        translator = Translator(cache_dir, LocalNiutrans())
+        for size in args.sizes:
+            doc = _document(size)
+            results = {}
+            for name in utils.PARSERS:
+                utils.set_parser(name)
+
+                def cold():
+                    utils._caches.clear()
+                    return translator.translate(doc, 'en', 'zh')
+
+                results[name] = cold()
+                print(f'{size:>7} chars, {name:>11}: parse {_rate(lambda: utils.make_soup(doc), size):5.2f} MB/s, '
+                      f'warm {_rate(lambda: translator.translate(doc, "en", "zh"), size):5.2f} MB/s, '
+                      f'cold {_rate(cold, size):5.2f} MB/s')
+            assert len(set(results.values())) == 1, 'translations differ'
+        utils._caches.clear()
+    utils.set_parser('html.parser')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Characters billed and time to translate successive edited versions of a document, with and without segments.
+
+Every version changes ``--edit-rate`` of the sentences of the previous one, as a re-crawled page would. Requests go
+to a local stub of the NiuTrans API, starting from an empty cache.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_segments [--versions 10] [--edit-rate 0.05]
+"""
+import argparse
+import random
+import tempfile
+from os import path, makedirs
+from time import perf_counter
+
+from niutranspy import Niutrans, Translator, utils
+from tests.stub_server import StubServer
+
+
+def _versions(count: int, paragraphs: int, edit_rate: float):
+    rnd = random.Random(0)
+    doc = [[f'这是第 {p} 段的第 {s} 句话，内容{"很长" * rnd.randrange(1, 10)}。' for s in range(8)]
+           for p in range(paragraphs)]
+    for version in range(count):
+        yield '\n'.join(''.join(sentences) for sentences in doc)
+        for sentences in doc:
+            for s in range(len(sentences)):
+                if rnd.random() < edit_rate:
+                    sentences[s] = f'第 {version} 版修改了这句话，{"内容" * rnd.randrange(1, 10)}。'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--versions', type=int, default=10)
+    parser.add_argument('--paragraphs', type=int, default=40)
+    parser.add_argument('--edit-rate', type=float, default=0.05)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    versions = list(_versions(args.versions, args.paragraphs, args.edit_rate))
+    print(f'{args.versions} versions of {len(versions[0])} chars, {args.edit_rate:.0%} of the sentences edited each')
+    with StubServer(latency=args.latency) as server:
+        for segments in (False, True):
+            with tempfile.TemporaryDirectory() as cache_dir:
+                makedirs(path.join(cache_dir, 'translation'))
+                open(path.join(cache_dir, Translator.SUGGESTION_FILE_NAME), 'w').close()
+                niutrans = Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url)
+                translator = Translator(cache_dir, niutrans, segments=segments)
+                translator.translate(versions[0], 'en', 'zh')
+                before = server.stats
+                t = perf_counter()
+                for version in versions[1:]:
+                    translator.translate(version, 'en', 'zh')
+                elapsed = perf_counter() - t
+                after = server.stats
+                print(f'segments={segments!s:>5}: {after["requests"] - before["requests"]:4} API calls, '
+                      f'{after["chars"] - before["chars"]:7} chars billed, {elapsed:.2f} s for the edited versions')
+                utils._caches.clear()
+
+
+if __name__ == '__main__':
+    main()
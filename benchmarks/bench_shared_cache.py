@@ -0,0 +1,69 @@
+"""Memory per worker process of the eager, lazy and shared cache modes.
+
+``--workers`` processes load the same cache of ``--rows`` translations and look up ``--lookups`` random keys. Once
+they all have, each reports its private memory (USS) and its proportional share of the shared pages (PSS), from
+``/proc/self/smaps_rollup`` (Linux only).
+
+Run from the repository root::
+
+    python -m benchmarks.bench_shared_cache [--rows 500000] [--workers 8]
+"""
+import argparse
+import multiprocessing
+import random
+import tempfile
+from os import path
+
+from niutranspy import cache, utils
+
+
+def _memory_mb():
+    values = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return values['Private_Clean'] + values['Private_Dirty'], values['Pss']
+
+
+def _worker(filename, mode, rows, lookups, barrier, results):
+    dic = utils._load_dicts(filename, 'zh', 'en', mode)[0]
+    hits = sum(1 for i in random.sample(range(rows), lookups) if dic.get(f'源文本 {i}'))
+    barrier.wait()  # the shared pages are mapped by every worker
+    uss, pss = _memory_mb()
+    barrier.wait()
+    results.put((uss, pss, hits))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')  # fresh interpreters, as independent workers
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = path.join(tmp, 'cache.db')
+        cache._prepare_shared(filename)
+        cache._CompactStore(filename, 'zh_en').update(
+            (f'源文本 {i}', f'source text {i} ' + 'x' * (i % 200)) for i in range(args.rows))
+
+        print(f'{args.rows} rows, {args.workers} workers, {args.lookups} random lookups each')
+        for mode in ('eager', 'lazy', 'shared'):
+            barrier, results = ctx.Barrier(args.workers), ctx.Queue()
+            workers = [ctx.Process(target=_worker, args=(filename, mode, args.rows, args.lookups, barrier, results))
+                       for _ in range(args.workers)]
+            for worker in workers:
+                worker.start()
+            r = [results.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+            uss, pss = sum(x[0] for x in r) / len(r), sum(x[1] for x in r) / len(r)
+            print(f'{mode:>6}: USS {uss:.1f} MB, PSS {pss:.1f} MB per worker, {sum(pss for _, pss, _ in r):.0f} MB '
+                  f'in all, {r[0][2]} hits')
+
+
+if __name__ == '__main__':
+    main()
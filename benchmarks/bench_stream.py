@@ -0,0 +1,58 @@
+"""Throughput and peak memory of ``Translator.translate_stream`` for HTML inputs of increasing size.
+
+Each size runs in a fresh interpreter, which generates the input on the fly and discards the output, so that the
+peak memory is that of the translation only. The backend translates in-process.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_stream [--sizes 1 4 16]
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+_CHILD = '''
+import json, os, resource, sys, tempfile
+from time import perf_counter
+from niutranspy import Translator
+from tests.stub_server import LocalNiutrans
+size = int(float(sys.argv[1]) * 2 ** 20)
+cache_dir = tempfile.mkdtemp()
+os.makedirs(os.path.join(cache_dir, 'translation'))
+open(os.path.join(cache_dir, Translator.SUGGESTION_FILE_NAME), 'w').close()
+translator = Translator(cache_dir, LocalNiutrans(), cache_mode='lazy', lru_size=1000)
+
+def source():
+    yield '<html><body>\\n'
+    n, i = 0, 0
+    while n < size:
+        line = f'<p class="c{i % 10}">这是第 {i} 段，包含<b>粗体</b>和<a href="/{i}">链接</a>。</p>\\n'
+        n += len(line)
+        i += 1
+        yield line
+    yield '</body></html>\\n'
+
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+t = perf_counter()
+out = sum(len(piece) for piece in translator.translate_stream(source(), 'en', 'zh'))
+print(json.dumps({'seconds': perf_counter() - t, 'out': out, 'base_rss_mb': rss / 1024,
+                  'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 4, 16], help='MB')
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        out = subprocess.run([sys.executable, '-c', _CHILD, str(size)], check=True, capture_output=True,
+                             text=True).stdout
+        r = json.loads(out)
+        print(f'{size:5g} MB: {size / r["seconds"]:.2f} MB/s, max RSS {r["max_rss_mb"]:.0f} MB '
+              f'({r["base_rss_mb"]:.0f} MB before translating)')
+
+
+if __name__ == '__main__':
+    main()
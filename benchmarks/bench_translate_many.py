@@ -0,0 +1,53 @@
+"""API calls needed to translate a catalog one string at a time, and with ``Translator.translate_many``.
+
+Requests go to a local stub of the NiuTrans API, starting from an empty cache.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_translate_many [--inputs 1000] [--unique 200]
+"""
+import argparse
+import random
+import tempfile
+from os import path, makedirs
+from time import perf_counter
+
+from niutranspy import Niutrans, Translator, utils
+from tests.stub_server import StubServer
+
+
+def _translator(cache_dir, server):
+    makedirs(path.join(cache_dir, 'translation'))
+    open(path.join(cache_dir, Translator.SUGGESTION_FILE_NAME), 'w').close()
+    return Translator(cache_dir, Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--inputs', type=int, default=1000)
+    parser.add_argument('--unique', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.01)
+    args = parser.parse_args()
+
+    catalog = [f'商品名称 {random.randrange(args.unique)}' for _ in range(args.inputs)]
+    with StubServer(latency=args.latency) as server:
+        results = {}
+        for name in ('translate', 'translate_many'):
+            with tempfile.TemporaryDirectory() as cache_dir:
+                translator = _translator(cache_dir, server)
+                before = server.stats
+                t = perf_counter()
+                if name == 'translate':
+                    results[name] = [translator.translate(text, 'en', 'zh') for text in catalog]
+                else:
+                    results[name] = translator.translate_many(catalog, 'en', 'zh')
+                elapsed = perf_counter() - t
+                after = server.stats
+                print(f'{name:>14}: {after["requests"] - before["requests"]:5} API calls, '
+                      f'{after["chars"] - before["chars"]:7} chars billed, {elapsed:.2f} s')
+                utils._caches.clear()
+        assert results['translate'] == results['translate_many']
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 __version__ = "2020.08.04"
 __author__ = "yintrust-dev"
 
-from niutranspy.niutrans import Niutrans
+from niutranspy.niutrans import Niutrans, AsyncNiutrans
 from niutranspy.client import Translator
+from niutranspy.scheduler import Scheduler
+from niutranspy.utils import set_parser
@@ -0,0 +1,264 @@
+"""Pre-translates corpora into the translation cache of a cache directory, e.g. before a launch, so that online
+traffic only hits the cache::
+
+    python -m niutranspy --to en [--from zh] [--checkpoint warmup.json] CACHE_DIR corpus.jsonl pages.csv titles.txt
+
+Inputs are JSON lines (strings, or objects whose ``--field`` is translated), CSV files with a header row (whose
+``--field`` column is translated) or text files (a text per line), by extension unless ``--format`` is given. Texts
+seen before or translated by the cache already are skipped, the others are translated in batches by ``--workers``
+threads within the rate limits, and written to ``translation/cache.db``. With ``--checkpoint``, a run which was
+interrupted resumes after the last batch written. ``--dry-run`` only counts the characters to be translated.
+
+The API key is read from ``--api-key``, or from the ``NIUTRANS_API_KEY`` environment variable.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from os import makedirs, path
+from time import monotonic
+from typing import Iterable, Iterator, List, Set, Tuple
+
+from niutranspy.client import Translator
+from niutranspy.constants import NIUTRANS_API_URL, NIUTRANS_XML_API_URL
+from niutranspy.niutrans import Niutrans
+from niutranspy.scheduler import Scheduler
+
+_log = logging.getLogger(__name__)
+
+INPUT_FORMATS = {'.jsonl': 'jsonl', '.ndjson': 'jsonl', '.csv': 'csv'}  # by extension, text otherwise
+
+
+def read_texts(filename: str, fmt: str = None, field: str = 'text') -> Iterator[str]:
+    """Yields the non-empty texts of an input file, ``'-'`` being stdin.
+
+    :param fmt: ``'jsonl'``, ``'csv'`` or ``'text'``, guessed from the extension by default.
+    :param field: Key of the texts in the JSON objects, or column of the texts in the CSV file.
+    """
+    fmt = fmt or INPUT_FORMATS.get(path.splitext(filename)[1].lower(), 'text')
+    f = sys.stdin if filename == '-' else open(filename, encoding='utf-8', newline='' if fmt == 'csv' else None)
+    try:
+        if fmt == 'jsonl':
+            for line in f:
+                if not line.strip(): continue  # noqa: E701
+                item = json.loads(line)
+                text = item.get(field) if isinstance(item, dict) else item
+                if isinstance(text, str) and text.strip(): yield text  # noqa: E701
+        elif fmt == 'csv':
+            reader = csv.DictReader(f)
+            if field not in (reader.fieldnames or ()):
+                raise ValueError(f'{filename}: no {field!r} column')
+            for row in reader:
+                if row[field] and row[field].strip(): yield row[field]  # noqa: E701
+        else:
+            for line in f:
+                line = line.rstrip('\r\n')
+                if line.strip(): yield line  # noqa: E701
+    finally:
+        if f is not sys.stdin: f.close()  # noqa: E701
+
+
+class _Progress(object):
+    """Counts of the texts and characters, reported to stderr at most every ``interval`` seconds."""
+
+    def __init__(self, interval: float, price: float = None):
+        self.read = self.duplicates = self.cached = self.undetected = 0
+        self.queued = self.translated = self.failed = 0
+        self.chars = self.sent_chars = 0  # characters of the texts queued, and of those sent so far
+        self._interval = interval
+        self._price = price
+        self._start = self._last = monotonic()
+
+    def report(self, final: bool = False) -> None:
+        now = monotonic()
+        if not final and now - self._last < self._interval:
+            return
+        self._last = now
+        elapsed = max(now - self._start, 1e-6)
+        cost = ''
+        if self._price is not None:
+            cost = f', cost ~{self.sent_chars / 1e6 * self._price:.2f} of ~{self.chars / 1e6 * self._price:.2f}'
+        print(f'{self.read} texts read: {self.duplicates} duplicates, {self.cached} cached, {self.undetected} of '
+              f'unknown language, {self.translated + self.failed}/{self.queued} translated ({self.failed} failed); '
+              f'{self.sent_chars}/{self.chars} characters{cost}; {self.translated / elapsed:.1f} texts/s, '
+              f'{self.sent_chars / elapsed:.0f} characters/s', file=sys.stderr)
+
+
+def _batches(translator: Translator, texts: Iterable[str], to_lang: str, from_lang, batch_size: int, skip: int,
+             pending: Set[str], progress: _Progress) -> Iterator[Tuple[int, List[str], List[str]]]:
+    """Yields the batches of texts to be translated, with the number of input texts read up to the end of the batch,
+    and the fragments of the texts missing in the cache.
+
+    :param skip: Number of input texts translated by a previous run.
+    :param pending: Fragments being translated, which the following texts don't need to translate again.
+    """
+    seen = set()
+    batch, fragments = [], []
+    for position, text in enumerate(texts, 1):
+        if position <= skip: continue  # noqa: E701
+        progress.read += 1
+        digest = hashlib.blake2b(text.encode(), digest_size=16).digest()  # keeps memory low on large corpora
+        if digest in seen:
+            progress.duplicates += 1
+            continue
+        seen.add(digest)
+        try:
+            missing = [s for s in dict.fromkeys(translator.uncached(text, to_lang, from_lang)) if s not in pending]
+        except ValueError:
+            progress.undetected += 1
+            continue
+        if not missing:
+            progress.cached += 1
+            continue
+        pending.update(missing)
+        batch.append(text)
+        fragments.extend(missing)
+        progress.queued += 1
+        progress.chars += sum(len(s) for s in missing)
+        if len(batch) >= batch_size:
+            yield position, batch, fragments
+            batch, fragments = [], []
+        progress.report()
+    if batch:
+        yield position, batch, fragments
+
+
+def _translate_batch(translator: Translator, texts: List[str], to_lang: str, from_lang) -> int:
+    """Translates the texts at once, or one by one if that fails, and returns the number of failures."""
+    try:
+        translator.translate_many(texts, to_lang, from_lang)
+        return 0
+    except Exception as e:
+        _log.debug(f'Failed to translate {len(texts)} texts at once: {e!r}')
+    failed = 0
+    for text in texts:
+        try:
+            translator.translate(text, to_lang, from_lang)
+        except Exception as e:
+            _log.warning(f'Failed to translate {text[:50]!r}: {e!r}')
+            failed += 1
+    return failed
+
+
+def _load_checkpoint(filename: str, state: dict) -> int:
+    """Returns the number of input texts translated by the run which saved the checkpoint, if any."""
+    if not filename or not path.exists(filename):
+        return 0
+    with open(filename) as f:
+        checkpoint = json.load(f)
+    if {k: checkpoint.get(k) for k in state} != state:
+        raise ValueError(f'{filename} is the checkpoint of other inputs or languages')
+    return checkpoint['position']
+
+
+def _save_checkpoint(filename: str, state: dict, position: int) -> None:
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(dict(state, position=position), f)
+    os.replace(filename + '.tmp', filename)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m niutranspy', description=__doc__.splitlines()[0])
+    parser.add_argument('cache_dir', help='Directory holding translation/cache.db')
+    parser.add_argument('inputs', nargs='+', help="Files of texts to translate, '-' for stdin")
+    parser.add_argument('--to', dest='to_lang', required=True, choices=sorted(Translator.LANGUAGES))
+    parser.add_argument('--from', dest='from_lang', choices=sorted(Translator.LANGUAGES),
+                        help='Language of the texts, detected by default')
+    parser.add_argument('--format', choices=('jsonl', 'csv', 'text'), help='Format of the inputs')
+    parser.add_argument('--field', default='text', help='Key or column of the texts in JSON lines and CSV inputs')
+    parser.add_argument('--api-key', default=os.environ.get('NIUTRANS_API_KEY'), help='NiuTrans API key')
+    parser.add_argument('--api-url', default=NIUTRANS_API_URL)
+    parser.add_argument('--xml-api-url', default=NIUTRANS_XML_API_URL)
+    parser.add_argument('--workers', type=int, default=4, help='Batches translated at the same time')
+    parser.add_argument('--batch-size', type=int, default=100, help='Texts per batch')
+    parser.add_argument('--qps', type=float, help='Maximum number of requests per second')
+    parser.add_argument('--chars-per-second', type=float, help='Maximum number of characters sent per second')
+    parser.add_argument('--cache-mode', default='lazy', choices=sorted(Translator.CACHE_MODES))
+    parser.add_argument('--checkpoint', help='File recording the progress, from which an interrupted run resumes')
+    parser.add_argument('--checkpoint-interval', type=float, default=30.0, help='Seconds between two checkpoints')
+    parser.add_argument('--price', type=float, help='Price per million characters, to estimate the cost')
+    parser.add_argument('--progress-interval', type=float, default=5.0, help='Seconds between two progress reports')
+    parser.add_argument('--dry-run', action='store_true', help='Count the characters to translate, and stop')
+    args = parser.parse_args(argv)
+    if not args.api_key and not args.dry_run:
+        parser.error('an API key is required: --api-key or NIUTRANS_API_KEY')
+
+    state = {'inputs': args.inputs, 'to_lang': args.to_lang, 'from_lang': args.from_lang}
+    try:
+        skip = 0 if args.dry_run else _load_checkpoint(args.checkpoint, state)
+    except ValueError as e:
+        parser.error(str(e))
+    if skip:
+        print(f'Resuming after {skip} texts', file=sys.stderr)
+    suggestion_file = path.join(args.cache_dir, Translator.SUGGESTION_FILE_NAME)
+    if not path.exists(suggestion_file):
+        makedirs(path.dirname(suggestion_file), exist_ok=True)
+        open(suggestion_file, 'w').close()
+    niutrans = Niutrans(args.api_key or 'dry-run', api_url=args.api_url, xml_api_url=args.xml_api_url,
+                        pool_size=args.workers, scheduler=Scheduler(args.qps, args.chars_per_second))
+    translator = Translator(args.cache_dir, niutrans, args.cache_mode)
+    texts = (text for filename in args.inputs for text in read_texts(filename, args.format, args.field))
+    progress, pending = _Progress(args.progress_interval, args.price), set()
+    batches = _batches(translator, texts, args.to_lang, args.from_lang, args.batch_size, skip, pending, progress)
+
+    if args.dry_run:
+        for _ in batches:
+            pass
+        progress.report(final=True)
+        return 0
+
+    # batches complete in order, so that the checkpoint is the end of the last batch written without failures
+    in_flight = deque()
+    position, last_checkpoint, failures, finished = skip, monotonic(), False, False
+
+    def complete_oldest():
+        nonlocal position, last_checkpoint, failures
+        end, future, texts, fragments = in_flight.popleft()
+        while not wait([future], args.progress_interval).done:
+            progress.report()
+        failed = future.result()
+        progress.translated += len(texts) - failed
+        progress.failed += failed
+        progress.sent_chars += sum(len(s) for s in fragments)
+        pending.difference_update(fragments)
+        failures = failures or failed > 0
+        if not failures:
+            position = end
+        if args.checkpoint and monotonic() - last_checkpoint >= args.checkpoint_interval:
+            translator.flush()
+            _save_checkpoint(args.checkpoint, state, position)
+            last_checkpoint = monotonic()
+        progress.report()
+
+    executor = ThreadPoolExecutor(args.workers, thread_name_prefix='niutranspy-warmup')
+    try:
+        for end, texts, fragments in batches:
+            in_flight.append((end, executor.submit(_translate_batch, translator, texts, args.to_lang,
+                                                   args.from_lang), texts, fragments))
+            if len(in_flight) > args.workers:  # bounds the texts read ahead
+                complete_oldest()
+        while in_flight:
+            complete_oldest()
+        finished = True
+    finally:
+        for _, future, _, _ in in_flight:
+            future.cancel()
+        executor.shutdown()
+        translator.flush()
+        niutrans.close()
+        if args.checkpoint:
+            if finished and not failures:
+                if path.exists(args.checkpoint): os.remove(args.checkpoint)  # noqa: E701
+            else:
+                _save_checkpoint(args.checkpoint, state, position)
+        progress.report(final=True)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,55 +1,197 @@
-from typing import Dict, Union, Tuple
+import asyncio
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, TypeVar, Union, Tuple
 
 from bs4 import BeautifulSoup
-from bs4.element import Tag
+from bs4.element import PageElement, Tag
 
-from niutranspy.utils import strip_soup_text
+from niutranspy import metrics
+from niutranspy.utils import make_soup, strip_soup_text
+
+T = TypeVar('T')
+R = TypeVar('R')
+_worker_state = threading.local()
+
+
+def _run_in_worker(func: Callable[[T], R], item: T) -> R:
+    _worker_state.active = True
+    try:
+        return func(item)
+    finally:
+        _worker_state.active = False
+
+
+@lru_cache(maxsize=None)
+def _takes_src_pieces(pre_check: Callable) -> bool:
+    """Whether a ``_pre_check()`` accepts ``src_pieces``, which those written before it was added don't."""
+    params = inspect.signature(pre_check).parameters.values()
+    return any(p.name == 'src_pieces' or p.kind is p.VAR_KEYWORD for p in params)
+
+
+def _stripped(xml_text: str) -> str:
+    translated = make_soup(xml_text)
+    strip_soup_text(translated)
+    return str(translated)
+
+
+def _stripped_piece(xml_text: str) -> str:
+    translated = make_soup(f'<div>{xml_text}</div>').div
+    strip_soup_text(translated)
+    return str(translated)[5:-6]
+
+
+async def _gather_in_order(aws: Iterable[Awaitable[R]]) -> List[R]:
+    """Runs the awaitables concurrently and returns their results in order.
+
+    At the first exception, the awaitables still running are cancelled.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return [await task for task in tasks]
+    finally:
+        for task in tasks:
+            task.cancel()
 
 
 class _TranslationBackend(object):
+    """Base class of translation backends.
+
+    Independent blocks of plain text and fragments of XML text are sent concurrently by up to ``max_workers``
+    threads.
+    """
+    max_workers = 1
+
+    def __init__(self, max_workers: int = 1):
+        assert max_workers > 0
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
     def __call__(self, src_text: str, from_lang: str, to_lang: str, cache: Dict[str, str],
-                 is_plain_str: bool) -> Tuple[str, Union[BaseException, None]]:
-        if self.is_disabled():
-            return '', ValueError('Disabled')
-        err = self._pre_check(src_text, from_lang, to_lang, is_plain_str)
+                 is_plain_str: bool, src_soup: Tag = None) -> Tuple[str, Union[BaseException, None]]:
+        """Translates src_text, returning the translation or the error.
+
+        :param src_soup: Parsed src_text, if it's a single XML element already parsed by the caller.
+        """
+        src_pieces = None if is_plain_str else self._xml_pieces(src_text, src_soup)
+        err = self._check(src_text, from_lang, to_lang, is_plain_str, src_pieces)
         if err:
             return '', err
 
-        block_size = self.max_translation_block_size()
-        if any(len(piece) > block_size - 2 for piece in src_text.split('\n')):
-            return '', ValueError(f'Length exceeds {block_size} chars: {src_text}')
-
         if is_plain_str:
             translated = []
-            pieces, cnt = [], 0
-            for piece in src_text.split('\n'):
-                piece = piece.strip()  # in case of '\r\n'
-                extra_cnt = len(piece) + 1
-                if cnt + extra_cnt > block_size:
-                    target_str, e = self._translate_plain_text('\n'.join(pieces), from_lang, to_lang, cache)
-                    if e: return '', e  # noqa: E701
-                    translated.append(target_str)
-                    pieces.clear()
-                    cnt = 0
-                cnt += extra_cnt
-                pieces.append(piece)
-
-            # last pieces
-            target_str, e = self._translate_plain_text('\n'.join(pieces), from_lang, to_lang, cache)
-            if e: return '', e  # noqa: E701
-            translated.append(target_str)
-            # _stats()
+            for target_str, e in self.map_in_order(
+                    lambda block: self._translate_plain_text(block, from_lang, to_lang, cache),
+                    self._plain_blocks(src_text)):
+                if e: return '', e  # noqa: E701
+                translated.append(target_str)
+            metrics.count('translations_total', kind='plain')
             return '\n'.join(translated), None
 
         # else: it's XML text
-        src_soup = BeautifulSoup(f'<div>{src_text}</div>', 'html.parser').div
         try:
-            src_text = ''.join(self._tran(piece, from_lang, to_lang, cache) for piece in src_soup.children)
-            # _stats()
+            src_text = ''.join(self.map_in_order(lambda piece: self._tran(piece, from_lang, to_lang, cache),
+                                                 src_pieces))
+            metrics.count('translations_total', kind='xml')
             return src_text, None
         except ValueError as e:
             return '', e
 
+    async def call_async(self, src_text: str, from_lang: str, to_lang: str, cache: Dict[str, str],
+                         is_plain_str: bool, src_soup: Tag = None) -> Tuple[str, Union[BaseException, None]]:
+        """Same as ``__call__()``, sending the blocks or fragments through the ``*_async`` hooks concurrently.
+
+        Backends without ``*_async`` hooks are called in the event loop's default executor.
+        """
+        if type(self)._translate_xml_async is _TranslationBackend._translate_xml_async:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self, src_text, from_lang, to_lang, cache, is_plain_str, src_soup)
+        src_pieces = None if is_plain_str else self._xml_pieces(src_text, src_soup)
+        err = self._check(src_text, from_lang, to_lang, is_plain_str, src_pieces)
+        if err:
+            return '', err
+
+        if is_plain_str:
+            async def translate_block(block):
+                target_str, e = await self._translate_plain_text_async(block, from_lang, to_lang, cache)
+                if e: raise e  # noqa: E701
+                return target_str
+            aws = (translate_block(block) for block in self._plain_blocks(src_text))
+            separator = '\n'
+        else:
+            aws = (self._tran_async(piece, from_lang, to_lang, cache) for piece in src_pieces)
+            separator = ''
+        try:
+            target_text = separator.join(await _gather_in_order(aws))
+            metrics.count('translations_total', kind='plain' if is_plain_str else 'xml')
+            return target_text, None
+        except ValueError as e:
+            return '', e
+
+    @staticmethod
+    def _xml_pieces(src_text: str, src_soup: Union[Tag, None]) -> List[PageElement]:
+        if src_soup is not None:
+            return [src_soup]
+        return list(make_soup(f'<div>{src_text}</div>').div.children)
+
+    def _check(self, src_text: str, from_lang: str, to_lang: str, is_plain_str: bool,
+               src_pieces: Union[List[PageElement], None]) -> Union[BaseException, None]:
+        if self.is_disabled():
+            return ValueError('Disabled')
+        if _takes_src_pieces(type(self)._pre_check):
+            err = self._pre_check(src_text, from_lang, to_lang, is_plain_str, src_pieces=src_pieces)
+        else:
+            err = self._pre_check(src_text, from_lang, to_lang, is_plain_str)
+        if err:
+            return err
+
+        block_size = self.max_translation_block_size()
+        if any(len(piece) > block_size - 2 for piece in src_text.split('\n')):
+            return ValueError(f'Length exceeds {block_size} chars: {src_text}')
+        return None
+
+    def _plain_blocks(self, src_text: str) -> List[str]:
+        """Packs the lines of src_text into newline-joined blocks of at most ``max_translation_block_size()``."""
+        block_size = self.max_translation_block_size()
+        blocks, pieces, cnt = [], [], 0
+        for piece in src_text.split('\n'):
+            piece = piece.strip()  # in case of '\r\n'
+            extra_cnt = len(piece) + 1
+            if cnt + extra_cnt > block_size:
+                blocks.append('\n'.join(pieces))
+                pieces.clear()
+                cnt = 0
+            cnt += extra_cnt
+            pieces.append(piece)
+        blocks.append('\n'.join(pieces))  # last pieces
+        return blocks
+
+    def map_in_order(self, func: Callable[[T], R], items: Iterable[T]) -> Iterator[R]:
+        """Yields ``func(item)`` for every item, in order.
+
+        With ``max_workers > 1`` the items are processed concurrently in the backend's worker pool. Once the
+        caller stops consuming the results, e.g. at the first error, the items not started yet are dropped.
+        Calls made from a worker thread run sequentially, so nested fragments can't starve the pool.
+        """
+        items = list(items)
+        if self.max_workers <= 1 or len(items) <= 1 or getattr(_worker_state, 'active', False):
+            yield from map(func, items)
+            return
+
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='niutranspy-backend')
+        futures = [self._executor.submit(_run_in_worker, func, item) for item in items]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
     def _tran(self, src_soup: BeautifulSoup, from_lang: str, to_lang: str, cache: Dict[str, str]) -> str:
         src_text = str(src_soup)
         if src_text not in cache:
@@ -57,21 +199,31 @@ class _TranslationBackend(object):
                 if not src_soup.contents:
                     cache[src_text] = src_text
                 elif len(src_text) <= self.max_translation_block_size():
-                    translated = BeautifulSoup(self._translate_xml(src_text, from_lang, to_lang, cache), 'html.parser')
-                    strip_soup_text(translated)
-                    cache[src_text] = str(translated)
+                    cache[src_text] = _stripped(self._translate_xml(src_text, from_lang, to_lang, cache))
                 else:
-                    arr = []
-                    for piece in src_soup.children:
-                        translated = BeautifulSoup(f'<div>{self._tran(piece, from_lang, to_lang, cache)}</div>',
-                                                   'html.parser').div
-                        strip_soup_text(translated)
-                        arr.append(str(translated)[5:-6])
-                    cache[src_text] = ''.join(arr)
+                    cache[src_text] = ''.join(_stripped_piece(piece) for piece in self.map_in_order(
+                        lambda sub: self._tran(sub, from_lang, to_lang, cache), src_soup.children))
             else:
                 cache[src_text] = self._translate_xml(src_text, from_lang, to_lang, cache)
         return cache[src_text]
 
+    async def _tran_async(self, src_soup: BeautifulSoup, from_lang: str, to_lang: str,
+                          cache: Dict[str, str]) -> str:
+        src_text = str(src_soup)
+        if src_text not in cache:
+            if isinstance(src_soup, Tag):
+                if not src_soup.contents:
+                    cache[src_text] = src_text
+                elif len(src_text) <= self.max_translation_block_size():
+                    cache[src_text] = _stripped(await self._translate_xml_async(src_text, from_lang, to_lang, cache))
+                else:
+                    pieces = await _gather_in_order(self._tran_async(sub, from_lang, to_lang, cache)
+                                                    for sub in src_soup.children)
+                    cache[src_text] = ''.join(_stripped_piece(piece) for piece in pieces)
+            else:
+                cache[src_text] = await self._translate_xml_async(src_text, from_lang, to_lang, cache)
+        return cache[src_text]
+
     def is_disabled(self) -> bool:
         raise NotImplementedError()
 
@@ -82,7 +234,19 @@ class _TranslationBackend(object):
     def _translate_xml(self, src_text, from_lang, to_lang, cache) -> str:
         raise NotImplementedError()
 
-    def _pre_check(self, src_text: str, from_lang: str, to_lang: str, is_plain_str: bool) -> Union[BaseException, None]:
+    async def _translate_plain_text_async(self, src_text: str, from_lang: str, to_lang: str,
+                                          cache) -> Tuple[str, Union[BaseException, None]]:
+        raise NotImplementedError()
+
+    async def _translate_xml_async(self, src_text, from_lang, to_lang, cache) -> str:
+        raise NotImplementedError()
+
+    def _pre_check(self, src_text: str, from_lang: str, to_lang: str, is_plain_str: bool,
+                   src_pieces: Union[List[PageElement], None] = None) -> Union[BaseException, None]:
+        """Returns the reason why src_text can't be translated, if any.
+
+        :param src_pieces: Top level nodes of src_text if it's XML text, None otherwise. Optional in overrides.
+        """
         raise NotImplementedError()
 
     @staticmethod
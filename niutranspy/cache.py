@@ -0,0 +1,525 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import weakref
+import zlib
+from collections import OrderedDict
+from time import monotonic
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+_log = logging.getLogger(__name__)
+
+FLUSH_SIZE = 1000  # dirty entries per cache that trigger a background flush
+FLUSH_INTERVAL = 30.0  # seconds between two background flushes
+PUBLISH_INTERVAL = 1.0  # seconds within which the new entries of shared caches are written, for other processes
+FORMATS = ('sqlitedict', 'compact')
+_COMPACT_APPLICATION_ID = 0x4E54504B  # 'NTPK', in the header of compact cache files
+_COMPRESS_MIN_SIZE = 128  # bytes, below which texts are stored uncompressed in compact cache files
+_MMAP_SIZE = 268435456  # bytes of a cache file read memory-mapped
+
+
+class _SqliteDictStore(object):
+    """One ``{from}_{to}`` table of a cache file, in the layout of ``SqliteDict``: text keys, JSON values.
+
+    :param shared: Whether processes share the file, which is then read memory-mapped, as compact files are.
+    """
+
+    def __init__(self, filename: str, tablename: str, shared: bool = False):
+        self.filename = filename
+        self.tablename = tablename
+        self._shared = shared
+        self._reader = None
+        self._reader_pid = None
+        self._reader_lock = threading.Lock()
+
+    def _connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.filename, check_same_thread=check_same_thread)
+        if self._shared:  # in WAL mode, see _prepare_shared()
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute(f'PRAGMA mmap_size = {_MMAP_SIZE}')
+        conn.execute(f'CREATE TABLE IF NOT EXISTS "{self.tablename}" (key TEXT PRIMARY KEY, value BLOB)')
+        return conn
+
+    def get(self, key: str) -> Union[str, None]:
+        """Looks a single key up through the primary key index."""
+        with self._reader_lock:
+            if self._reader_pid != os.getpid():  # connections must not be used across fork()
+                self._reader = self._connect(check_same_thread=False)
+                self._reader_pid = os.getpid()
+            row = self._reader.execute(f'SELECT value FROM "{self.tablename}" WHERE key = ?', (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        conn = self._connect()
+        try:
+            for k, v in conn.execute(f'SELECT key, value FROM "{self.tablename}" ORDER BY rowid'):
+                yield k, json.loads(v)
+        finally:
+            conn.close()
+
+    def update(self, items: Iterable[Tuple[str, str]]) -> None:
+        """Writes all the items in a single transaction."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(f'REPLACE INTO "{self.tablename}" (key, value) VALUES (?, ?)',
+                                 ((k, json.dumps(v)) for k, v in items))
+        finally:
+            conn.close()
+
+
+class _CompactStore(object):
+    """One ``{from}_{to}`` table of a compact cache file.
+
+    Rows are keyed by a 64-bit hash of the source text, which is an alias of the rowid: there is no separate index
+    of the keys. The source text is stored as well, to tell hash collisions apart. Long texts are stored as
+    zlib-compressed blobs, short ones as text. The file is in WAL mode, so that readers don't wait for the writer.
+    """
+
+    def __init__(self, filename: str, tablename: str):
+        self.filename = filename
+        self.tablename = tablename
+        self._reader = None
+        self._reader_pid = None
+        self._reader_lock = threading.Lock()
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little', signed=True)
+
+    @staticmethod
+    def _encode(text: str) -> Union[str, bytes]:
+        data = text.encode()
+        if len(data) >= _COMPRESS_MIN_SIZE:
+            compressed = zlib.compress(data)
+            if len(compressed) < len(data):
+                return compressed
+        return text
+
+    @staticmethod
+    def _decode(data: Union[str, bytes]) -> str:
+        return zlib.decompress(data).decode() if type(data) is bytes else data
+
+    def _connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        conn = _connect_compact(self.filename, check_same_thread)
+        conn.execute(f'CREATE TABLE IF NOT EXISTS "{self.tablename}" (key INTEGER PRIMARY KEY, source, value)')
+        return conn
+
+    def get(self, key: str) -> Union[str, None]:
+        with self._reader_lock:
+            if self._reader_pid != os.getpid():  # connections must not be used across fork()
+                self._reader = self._connect(check_same_thread=False)
+                self._reader_pid = os.getpid()
+            row = self._reader.execute(f'SELECT source, value FROM "{self.tablename}" WHERE key = ?',
+                                       (self._hash(key),)).fetchone()
+        if row is None or self._decode(row[0]) != key:
+            return None
+        return self._decode(row[1])
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        conn = self._connect()
+        try:
+            decode = self._decode
+            for k, v in conn.execute(f'SELECT source, value FROM "{self.tablename}" ORDER BY rowid'):
+                yield decode(k), decode(v)
+        finally:
+            conn.close()
+
+    def update(self, items: Iterable[Tuple[str, str]]) -> None:
+        """Writes all the items in a single transaction. A colliding key replaces the other one."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(f'REPLACE INTO "{self.tablename}" (key, source, value) VALUES (?, ?, ?)',
+                                 ((self._hash(k), self._encode(k), self._encode(v)) for k, v in items))
+        finally:
+            conn.close()
+
+
+def _connect_compact(filename: str, check_same_thread: bool = True) -> sqlite3.Connection:
+    conn = sqlite3.connect(filename, check_same_thread=check_same_thread)
+    if conn.execute('PRAGMA application_id').fetchone()[0] != _COMPACT_APPLICATION_ID:
+        conn.execute(f'PRAGMA application_id = {_COMPACT_APPLICATION_ID}')
+        conn.execute('PRAGMA journal_mode = WAL')  # persistent
+    conn.execute('PRAGMA synchronous = NORMAL')  # durable enough in WAL mode: a crash loses the last flushes only
+    conn.execute('PRAGMA cache_size = -16384')  # KiB
+    conn.execute(f'PRAGMA mmap_size = {_MMAP_SIZE}')
+    return conn
+
+
+def file_format(filename: str) -> Union[str, None]:
+    """Returns the format of a cache file, one of ``FORMATS``, or None if it doesn't exist."""
+    if not os.path.exists(filename):
+        return None
+    conn = sqlite3.connect(filename)
+    try:
+        application_id = conn.execute('PRAGMA application_id').fetchone()[0]
+    finally:
+        conn.close()
+    return 'compact' if application_id == _COMPACT_APPLICATION_ID else 'sqlitedict'
+
+
+def _open_store(filename: str, tablename: str, shared: bool = False) -> Union[_SqliteDictStore, _CompactStore]:
+    """Opens a table of a cache file in the format of the file. New files are in the ``SqliteDict`` layout.
+
+    :param shared: Whether processes share the file, see ``_prepare_shared()``.
+    """
+    if file_format(filename) == 'compact':
+        return _CompactStore(filename, tablename)
+    return _SqliteDictStore(filename, tablename, shared)
+
+
+def tables(filename: str) -> List[str]:
+    """Returns the names of the tables of a cache file."""
+    conn = sqlite3.connect(filename)
+    try:
+        return [name for name, in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+    finally:
+        conn.close()
+
+
+def export_items(filename: str) -> Iterator[Tuple[str, str, str]]:
+    """Yields the ``(table, key, value)`` items of every table of a cache file, in either format."""
+    for tablename in tables(filename):
+        for k, v in _open_store(filename, tablename).items():
+            yield tablename, k, v
+
+
+def import_items(filename: str, items: Iterable[Tuple[str, str, str]], batch_size: int = 10000) -> int:
+    """Writes ``(table, key, value)`` items to a cache file, in batches, and returns how many were written."""
+    stores, batches, cnt = {}, {}, 0
+    for tablename, k, v in items:
+        batch = batches.setdefault(tablename, [])
+        batch.append((k, v))
+        if len(batch) >= batch_size:
+            stores.setdefault(tablename, _open_store(filename, tablename)).update(batch)
+            cnt += len(batch)
+            batch.clear()
+    for tablename, batch in batches.items():
+        if batch:
+            stores.setdefault(tablename, _open_store(filename, tablename)).update(batch)
+            cnt += len(batch)
+    return cnt
+
+
+def compact(filename: str, merge_bak: bool = False) -> Dict[str, int]:
+    """Rewrites a cache file in the compact format, as a whole, while no translator uses it.
+
+    :param merge_bak: Adds the entries of the ``.bak`` file missing from the cache file, which are the only ones
+        ever read from it, and removes the ``.bak`` file.
+    :return: Numbers of ``entries``, of entries ``merged`` from the ``.bak`` file, and sizes in bytes ``before``
+        (the ``.bak`` file included if merged) and ``after``.
+    """
+    bak = filename + '.bak'
+    merge_bak = merge_bak and os.path.exists(bak)
+    files = [f for f in (filename, bak if merge_bak else None) if f and os.path.exists(f)]
+    before = sum(os.path.getsize(f) for f in files)
+    tmp = filename + '.compacting'
+    if os.path.exists(tmp): os.remove(tmp)  # noqa: E701
+    _connect_compact(tmp).close()
+    if merge_bak:
+        import_items(tmp, export_items(bak))
+    entries = import_items(tmp, export_items(filename)) if os.path.exists(filename) else 0  # replacing the .bak's
+    conn = _connect_compact(tmp)
+    try:
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(filename + suffix): os.remove(filename + suffix)  # noqa: E701
+    os.replace(tmp, filename)
+    if merge_bak:
+        os.remove(bak)
+    conn = sqlite3.connect(filename)
+    try:
+        total = sum(conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0] for t in tables(filename))
+    finally:
+        conn.close()
+    _log.info(f'Compacted {filename}: {total} entries, {total - entries} merged from {bak}')
+    return {'entries': total, 'merged': total - entries, 'before': before, 'after': os.path.getsize(filename)}
+
+
+class _Pending(object):
+    """The entries of a table not written to its store yet, shared by the caches of the table in a process, e.g. of
+    translators in other modes, which see the entries assigned to any of them."""
+
+    def __init__(self):
+        self.entries = {}
+        self.caches = []
+        self.reset_locks()
+
+    def reset_locks(self) -> None:
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+
+class _WriteBehind(object):
+    """Records the entries assigned to a cache and writes them back to its store in batches.
+
+    ``flush()`` is triggered by the background writer when ``FLUSH_SIZE`` entries are pending or every
+    ``FLUSH_INTERVAL`` seconds, and at interpreter exit.
+
+    :param sibling: A cache of the same table, whose pending entries this one shares.
+    """
+
+    flush_delay = None  # seconds within which pending entries are written, FLUSH_INTERVAL if None
+
+    def __init__(self, store: Union[_SqliteDictStore, _CompactStore], sibling: '_WriteBehind' = None):
+        self.store = store
+        self._pending = _Pending() if sibling is None else sibling._pending
+        self._dirty = self._pending.entries
+        self._pending.caches.append(self)
+
+    def _put(self, key: str, value: str) -> None:
+        """Sets an entry in memory, without marking it dirty."""
+        raise NotImplementedError
+
+    def __setitem__(self, key: str, value: str):
+        for cache in self._pending.caches:
+            cache._put(key, value)
+        self._mark_dirty(key, value)
+
+    def _mark_dirty(self, key: str, value: str) -> None:
+        with self._pending.lock:
+            self._dirty[key] = value
+            pending = len(self._dirty)
+        if pending == 1:
+            _writer.register(self)
+            if self.flush_delay is not None:
+                _writer.wake_in(self.flush_delay)
+        elif pending >= FLUSH_SIZE:
+            _writer.wake()
+
+    def dirty_count(self) -> int:
+        return len(self._dirty)
+
+    def flush(self) -> int:
+        """Writes the pending entries to the store and returns how many were written."""
+        with self._pending.flush_lock:
+            with self._pending.lock:
+                dirty = dict(self._dirty)
+                self._dirty.clear()
+            if not dirty:
+                return 0
+            try:
+                self.store.update(dirty.items())
+            except Exception:
+                with self._pending.lock:
+                    dirty.update(self._dirty)
+                    self._dirty.update(dirty)
+                raise
+            _log.debug(f'Flushed {len(dirty)} items to {self.store.filename}[{self.store.tablename}]')
+            return len(dirty)
+
+
+class _WriteBehindDict(_WriteBehind, dict):
+    """A dict holding a whole table of the store in memory."""
+
+    def __init__(self, store: Union[_SqliteDictStore, _CompactStore], sibling: _WriteBehind = None):
+        dict.__init__(self)
+        _WriteBehind.__init__(self, store, sibling)
+
+    _put = dict.__setitem__
+
+    def load(self) -> None:
+        """Fills the dict with every row of the store, and the entries pending in its siblings, without marking
+        them dirty."""
+        for k, v in self.store.items():
+            dict.__setitem__(self, k, v)
+        with self._pending.lock:
+            self.update(self._dirty)
+
+
+_MISSING = object()
+
+
+class _LazyDict(_WriteBehind):
+    """A read-through view of a table of the store, keeping the ``maxsize`` most recently used entries in memory.
+
+    Misses are remembered as well, so that repeated lookups of untranslated text don't reach the disk.
+    """
+
+    remember_misses = True
+
+    def __init__(self, store: Union[_SqliteDictStore, _CompactStore], maxsize: int, sibling: _WriteBehind = None):
+        super().__init__(store, sibling)
+        self.maxsize = maxsize
+        self._lru = OrderedDict()
+        self._lru_lock = threading.Lock()
+
+    def _put(self, key: str, value) -> None:
+        with self._lru_lock:
+            self._lru[key] = value
+            self._lru.move_to_end(key)
+            if len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+
+    def get(self, key: str, default=None):
+        with self._lru_lock:
+            value = self._lru.get(key)
+            if value is not None:
+                self._lru.move_to_end(key)
+        if value is None:
+            value = self._dirty.get(key)  # evicted before being flushed
+            if value is None:
+                value = self.store.get(key)
+            if value is not None:
+                self._put(key, value)
+            elif self.remember_misses:
+                self._put(key, _MISSING)
+        return default if value is None or value is _MISSING else value
+
+    def __getitem__(self, key: str) -> str:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+
+class _SharedDict(_LazyDict):
+    """A ``_LazyDict`` over a cache file shared by the processes of a host.
+
+    Every process keeps its most recently used entries only: the file is memory-mapped, and its pages are shared
+    by the processes through the OS page cache. New entries are written within ``PUBLISH_INTERVAL`` seconds, in a
+    single transaction, and SQLite lets one process write at a time while the others keep reading. Misses are not
+    remembered, since other processes may fill them, but entries in memory aren't refreshed when others change them.
+    """
+
+    remember_misses = False
+    flush_delay = PUBLISH_INTERVAL
+
+
+class _CacheWriter(object):
+    """Background thread flushing every registered ``_WriteBehind`` cache."""
+
+    def __init__(self):
+        self._caches = weakref.WeakValueDictionary()  # id -> cache, since dicts are unhashable
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._soon = None  # time of the next flush requested by wake_in()
+
+    def register(self, cache: _WriteBehind) -> None:
+        with self._lock:
+            self._caches[id(cache)] = cache
+            if self._thread is None:
+                self._start()
+
+    def _start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='niutranspy-cache-writer', daemon=True)
+        self._thread.start()
+
+    def _after_fork(self) -> None:
+        """Restarts the writer in a child process, where only the thread calling fork() survives."""
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = self._soon = None
+        for cache in self._caches.values():
+            cache._pending.reset_locks()
+        if any(cache.dirty_count() for cache in self._caches.values()):
+            self._start()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def wake_in(self, delay: float) -> None:
+        """Flushes every cache within ``delay`` seconds."""
+        with self._lock:
+            soon = monotonic() + delay
+            if self._soon is None or soon < self._soon:
+                self._soon = soon
+                self._wakeup.set()
+
+    def flush(self, min_dirty: int = 1) -> int:
+        """Flushes the caches holding at least ``min_dirty`` pending entries."""
+        with self._lock:
+            caches = list(self._caches.values())
+        cnt = 0
+        for cache in caches:
+            if cache.dirty_count() < min_dirty:
+                continue
+            try:
+                cnt += cache.flush()
+            except Exception as e:
+                _log.error(f'Failed to flush {cache.store.filename}[{cache.store.tablename}]: {e!r}')
+        return cnt
+
+    def _run(self) -> None:
+        deadline = monotonic() + FLUSH_INTERVAL
+        while True:
+            soon = self._soon
+            self._wakeup.wait(max(0.0, (deadline if soon is None else min(deadline, soon)) - monotonic()))
+            self._wakeup.clear()
+            now = monotonic()
+            due = now >= deadline
+            with self._lock:
+                if self._soon is not None and now >= self._soon:
+                    self._soon = None
+                    due = True
+            self.flush(1 if due else FLUSH_SIZE)
+            if now >= deadline:
+                deadline = monotonic() + FLUSH_INTERVAL
+
+
+_writer = _CacheWriter()
+
+
+def flush_caches() -> int:
+    """Writes every pending cache entry of this process to disk.
+
+    :return: Number of entries written.
+    """
+    return _writer.flush()
+
+
+atexit.register(flush_caches)
+os.register_at_fork(after_in_child=_writer._after_fork)
+
+
+def _prepare_shared(filename: str) -> None:
+    """Prepares a cache file for processes sharing it: a missing file is created in the compact format, and a file
+    in the ``SqliteDict`` layout is switched to WAL mode, as compact files are, which lets processes read while one
+    writes.
+    """
+    fmt = file_format(filename)
+    if fmt is None:
+        _connect_compact(filename).close()
+    elif fmt == 'sqlitedict':
+        conn = sqlite3.connect(filename)
+        try:
+            conn.execute('PRAGMA journal_mode = WAL')  # persistent
+        finally:
+            conn.close()
+        _log.info(f'{filename} is in the SqliteDict layout: `python -m niutranspy.cachetool compact` makes it '
+                  f'smaller and faster to look up')
+
+
+def _new_cache(filename: str, from_lang: str, to_lang: str, mode: str = 'eager', lru_size: int = 100000,
+               sibling: _WriteBehind = None):
+    """Creates the cache of a language pair.
+
+    :param mode: ``'eager'`` loads the whole table into a dict, ``'lazy'`` looks entries up on demand, and
+        ``'shared'`` as well, for processes sharing the file.
+    :param lru_size: Number of entries kept in memory in ``'lazy'`` and ``'shared'`` modes.
+    :param sibling: A cache of the pair in another mode, which sees the entries assigned to this one and vice versa.
+    """
+    if mode == 'shared':
+        _prepare_shared(filename)
+    store = _open_store(filename, f'{from_lang}_{to_lang}', mode == 'shared')
+    if mode == 'lazy':
+        return _LazyDict(store, lru_size, sibling)
+    if mode == 'shared':
+        return _SharedDict(store, lru_size, sibling)
+    dic = _WriteBehindDict(store, sibling)
+    dic.load()
+    _log.info(f'Loaded {len(dic)} items')
+    return dic
@@ -0,0 +1,74 @@
+"""Maintenance of the translation cache of a cache directory, while no translator uses it::
+
+    python -m niutranspy.cachetool info CACHE_DIR
+    python -m niutranspy.cachetool compact [--merge-bak] CACHE_DIR
+    python -m niutranspy.cachetool export CACHE_DIR > cache.jsonl
+    python -m niutranspy.cachetool import CACHE_DIR cache.jsonl
+
+``compact`` rewrites ``cache.db`` in the compact format, which translators detect. ``export`` and ``import`` use JSON
+lines of ``{"table": ..., "key": ..., "value": ...}``, tables being language pairs such as ``zh_en``, or ``lang``.
+"""
+import argparse
+import json
+import sqlite3
+import sys
+from os import path
+from typing import List
+
+from niutranspy import cache
+from niutranspy.client import Translator
+
+
+def _info(filename: str) -> None:
+    bak = filename + '.bak'
+    for f in (filename, bak):
+        if not path.exists(f):
+            continue
+        print(f'{f}: {cache.file_format(f)} format, {path.getsize(f)} bytes')
+        conn = sqlite3.connect(f)
+        try:
+            for tablename in cache.tables(f):
+                cnt = conn.execute(f'SELECT COUNT(*) FROM "{tablename}"').fetchone()[0]
+                print(f'  {tablename}: {cnt} entries')
+        finally:
+            conn.close()
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m niutranspy.cachetool', description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('info', help='Show the format, tables and sizes of the cache files')
+    compact = commands.add_parser('compact', help='Rewrite cache.db in the compact format')
+    compact.add_argument('--merge-bak', action='store_true', help='Merge cache.db.bak into cache.db and remove it')
+    commands.add_parser('export', help='Write every cache entry to stdout, as JSON lines')
+    import_ = commands.add_parser('import', help='Add the entries of a JSON lines file to the cache')
+    for command in commands.choices.values():
+        command.add_argument('cache_dir', help='Directory holding translation/cache.db')
+    import_.add_argument('input', help="JSON lines file, '-' for stdin")
+    args = parser.parse_args(argv)
+
+    filename = path.join(args.cache_dir, Translator.CACHE_FILE_NAME)
+    if args.command == 'info':
+        _info(filename)
+    elif args.command == 'compact':
+        r = cache.compact(filename, args.merge_bak)
+        print(f'{r["entries"]} entries ({r["merged"]} merged from the .bak file), '
+              f'{r["before"]} -> {r["after"]} bytes', file=sys.stderr)
+    elif args.command == 'export':
+        if not path.exists(filename):
+            parser.error(f'{filename} does not exist')
+        for tablename, k, v in cache.export_items(filename):
+            print(json.dumps({'table': tablename, 'key': k, 'value': v}, ensure_ascii=False))
+    else:
+        f = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+        try:
+            items = (json.loads(line) for line in f if line.strip())
+            cnt = cache.import_items(filename, ((item['table'], item['key'], item['value']) for item in items))
+        finally:
+            if f is not sys.stdin: f.close()  # noqa: E701
+        print(f'{cnt} entries imported', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
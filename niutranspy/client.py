@@ -1,28 +1,92 @@
+import asyncio
 import logging
-import threading
+import re
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from os import path, makedirs
-from typing import Union
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Union
 
 from opencc import OpenCC
-from bs4 import BeautifulSoup
-from bs4.element import Tag, NavigableString
+from bs4.dammit import EntitySubstitution
+from bs4.element import CData, PageElement, Tag, NavigableString
 
-from niutranspy.utils import html_to_text, _load_dicts, get_lang
+from niutranspy import metrics
+from niutranspy.cache import _prepare_shared, flush_caches
+from niutranspy.stream import RAW, html_chunks, plain_chunks
+from niutranspy.utils import get_text_contents, html_to_text, make_soup, _dicts_loaded, _load_detector, _load_dicts, \
+    _SingleFlight
 
 _log = logging.getLogger(__name__)
-_lock = threading.RLock()
+# head and tail of the enclosing tag (if any), and the (text, attributes, is_plain_str, node) of its children
+_Plan = namedtuple('_Plan', 'head fragments tail')
+# cache is None when target_text is the final translation, otherwise src_text has to be translated by the backend
+_Lookup = namedtuple('_Lookup', 'target_text src_text from_lang cache')
+# sentences of every line of a text, and head and tail of the element holding it (if any), in segments mode
+_Segmented = namedtuple('_Segmented', 'head lines tail')
+_SENTENCE_END = re.compile(r'[。！？；]+[”’」』）)]*\s*|[.!?;]+["\')]*(?:\s+|$)')
+_ASCII_TEXT = re.compile(r'[\x00-\x7e\s]*')  # same as all(ord(c) < 127 for c in text if not c.isspace())
+_LETTER = re.compile(r'[^\W\d_]')
+_MARKUP = re.compile('[<&\r\x00\ufeff]')  # text without them is parsed into a single, unchanged string
+
+
+def _untranslatable(text: str) -> bool:
+    """Whether a plain text holds no letters, only digits, punctuation, symbols or whitespace."""
+    return _LETTER.search(text) is None
+
+
+def _sentences(line: str) -> List[str]:
+    """Splits a line into its sentences, with whitespace normalized."""
+    sentences, start = [], 0
+    for m in _SENTENCE_END.finditer(line):
+        sentences.append(line[start:m.end()])
+        start = m.end()
+    sentences.append(line[start:])
+    return [s for s in (' '.join(s.split()) for s in sentences) if s]
+
+
+@lru_cache(maxsize=10000)
+def _with_attrs(target_str: str, attrs: Tuple[Tuple[str, Union[str, Tuple[str, ...]]], ...]) -> str:
+    """Restores the attributes of a translated element. Memoized, since cache hits repeat the same elements."""
+    target_tag = make_soup(target_str).contents[0]
+    target_tag.attrs = {k: list(v) if isinstance(v, tuple) else v for k, v in attrs}
+    return str(target_tag)
 
 
 class Translator(object):
     CACHE_FILE_NAME = 'translation/cache.db'
     SUGGESTION_FILE_NAME = 'translation/suggestion.txt'
     LANGUAGES = {'ar', 'zh', 'en', 'ko', 'pt', 'es', 'de', 'da', 'fr', 'fi', 'sv', 'he', 'nl', 'ru', 'th', 'ja'}
+    CACHE_MODES = {'eager', 'lazy', 'shared'}
 
-    def __init__(self, cache_dir: str, niutrans):
+    def __init__(self, cache_dir: str, niutrans, cache_mode: str = 'eager', lru_size: int = 100000,
+                 segments: bool = False):
+        """
+        :param cache_dir: Directory holding ``translation/cache.db`` and ``translation/suggestion.txt``.
+        :param niutrans: Translation backend.
+        :param cache_mode: ``'eager'`` loads the cache of a language pair into memory when the pair is first used,
+            ``'lazy'`` looks translations up in ``cache.db`` on demand, keeping the ``lru_size`` most recently
+            used ones in memory. ``'shared'`` is ``'lazy'`` for processes sharing ``cache.db``, such as prefork
+            workers: they read it memory-mapped, in WAL mode, and see the translations of the others within a
+            second. A missing ``cache.db`` is created in the compact format of ``niutranspy.cachetool``.
+        :param lru_size: Number of translations kept in memory per language pair in ``'lazy'`` and ``'shared'``
+            modes.
+        :param segments: Translation memory mode: plain texts, and elements holding plain text only, are translated
+            and cached sentence by sentence, so that only the new sentences of an edited text are sent to the
+            backend. Translations may differ from those of whole texts, since sentences are translated out of
+            their context.
+        """
+        assert cache_mode in self.CACHE_MODES, f'Invalid cache mode: {cache_mode!r}'
         self._filename = path.join(cache_dir, self.CACHE_FILE_NAME)
+        if cache_mode == 'shared':
+            _prepare_shared(self._filename)
+        self._cache_mode = cache_mode
+        self._lru_size = lru_size
+        self._segments = segments
         self._zh_hant_to_zh_hans = OpenCC('t2s').convert
         self._dummy = niutrans.is_disabled()
         self._niutrans = niutrans
+        self._flights = _SingleFlight()
         dic = {}
         valid_languages = {'X', '='} | Translator.LANGUAGES
         with open(path.join(cache_dir, self.SUGGESTION_FILE_NAME)) as f:
@@ -32,123 +96,532 @@ class Translator(object):
                 dic[s.strip()[1:-1]] = lang
         self._lang_suggestion = dic
         _log.info(f'{len(dic)} items in the language suggestion dictionary')
+        self._detector = _load_detector(self._filename, lru_size)
+        for s, lang in dic.items():
+            if lang in self.LANGUAGES:
+                self._detector.suggest(html_to_text(s), lang)
 
     def _get_cache(self, from_lang, to_lang):
         assert len({from_lang, to_lang} & self.LANGUAGES) == 2, f'Invalid {from_lang!r} -> {to_lang!r}'
-        return _load_dicts(self._filename, from_lang, to_lang)
+        return _load_dicts(self._filename, from_lang, to_lang, self._cache_mode, self._lru_size)
+
+    def _cached(self, src_text: str, from_lang: str, to_lang: str,
+                count_miss: bool = True) -> Tuple[dict, Union[str, None]]:
+        """Returns the cache of the language pair and the cached translation of src_text, if any.
+
+        The caches are thread-safe, so that cache hits don't wait for other threads. Concurrent threads may copy
+        the same translation from the old cache, which is harmless.
+
+        :param count_miss: Whether a miss is counted in the metrics, False for a probe followed by other lookups.
+        """
+        cache, old_cache = self._get_cache(from_lang, to_lang)
+        target_text = cache.get(src_text)
+        if target_text:
+            metrics.count('cache_lookups_total', result='hit')
+        elif src_text in old_cache:
+            cache[src_text] = target_text = old_cache[src_text]
+            metrics.count('cache_lookups_total', result='bak_hit')
+        elif count_miss:
+            metrics.count('cache_lookups_total', result='miss')
+        return cache, target_text
 
     def suggest(self, from_lang: str, to_lang: str, src_text: str, target_text: str):
         """Update the translator's cache so that "src_text" will be translated as "target_text" in the future."""
         _log.debug(f'Suggest {src_text!r} ({from_lang}) as {target_text!r} ({to_lang})')
-        with _lock:
-            cache, old_cache = self._get_cache(from_lang, to_lang)
-            old_target_text = cache.get(src_text)
-            if old_target_text and old_target_text != target_text:
-                _log.debug(f'Translation of [{from_lang}_{to_lang}]{src_text!r} changed: {old_target_text!r} -> {target_text!r}')  # noqa: E501
-            cache[src_text] = target_text
+        cache, old_cache = self._get_cache(from_lang, to_lang)
+        old_target_text = cache.get(src_text)
+        if old_target_text and old_target_text != target_text:
+            _log.debug(f'Translation of [{from_lang}_{to_lang}]{src_text!r} changed: {old_target_text!r} -> {target_text!r}')  # noqa: E501
+        cache[src_text] = target_text
+
+    @staticmethod
+    def flush() -> int:
+        """Writes the translations cached since the last flush to disk, and returns how many were written.
+
+        This happens periodically in the background and at interpreter exit as well.
+        """
+        return flush_caches()
+
+    def detect_many(self, texts: Iterable[str]) -> List[Union[str, None]]:
+        """Detects the language of every text (HTML or plain text), or returns None for the texts whose language
+        can't be reliably detected.
+
+        Detection results are cached in memory and in ``cache.db``, so that a text is detected only once.
+        """
+        return self._detector.detect_many([html_to_text(text) for text in texts])
+
+    def detection_stats(self) -> Dict[str, float]:
+        """Language detection cache statistics of this process: ``hits``, ``misses``, ``hit_rate``, and
+        ``detect_seconds`` spent detecting, and an estimate of the ``saved_seconds`` by the hits."""
+        return self._detector.stats()
+
+    def uncached(self, src_text: str, to_lang: str, from_lang=None) -> List[str]:
+        """Returns the fragments of src_text missing in the cache, normalized as they would be sent to the backend by
+        ``translate()``. src_text is translated without calling the backend when there are none.
+
+        :raise ValueError: The language of a fragment can't be detected.
+        """
+        plan = self._plan(src_text, to_lang, from_lang)
+        if isinstance(plan, str): return []  # noqa: E701
+        lookups = (self._lookup(text, from_lang, to_lang, node) for text, _, _, node in plan.fragments)
+        return [lookup.src_text for lookup in lookups if lookup.cache is not None]
 
     def translate(self, src_text: str, to_lang: str, from_lang=None) -> str:
         """Translates src_text to `to_lang`.
 
         It `from_lang` is not valid, auto-detection is performed to find it.
         """
+        plan = self._plan(src_text, to_lang, from_lang)
+        if isinstance(plan, str): return plan  # noqa: E701
+        return self._assemble(plan, [self._do_translation(text, from_lang, to_lang, is_plain_str, node)
+                                     for text, _, is_plain_str, node in plan.fragments])
+
+    def translate_many(self, texts: Iterable[str], to_lang: str, from_lang=None) -> List[str]:
+        """Translates every text, and returns the translations in the same order.
+
+        Plain text fragments missing in the cache are deduplicated, grouped by language and sent to the backend
+        packed together, which takes far fewer API calls than translating the texts one by one. The texts which can't
+        be looked up, e.g. whose language can't be detected, are returned as they are, instead of failing the batch.
+        """
+        texts = list(texts)
+        plans = {text: self._plan(text, to_lang, from_lang) for text in dict.fromkeys(texts)}
+        lookups, misses, segmentations = {}, {}, {}
+        for text, plan in plans.items():
+            if isinstance(plan, str): continue  # noqa: E701
+            try:  # before sending anything, so that a text which fails fails alone
+                text_lookups = [self._lookup(fragment, from_lang, to_lang, node)
+                                for fragment, _, _, node in plan.fragments]
+            except ValueError as e:
+                _log.warning(f'Failed to look {text[:50]!r} up, left untranslated: {e!r}')
+                plans[text] = text
+                continue
+            for i, ((_, _, is_plain_str, _), lookup) in enumerate(zip(plan.fragments, text_lookups)):
+                lookups[(text, i)] = lookup
+                if not is_plain_str or lookup.cache is None: continue  # noqa: E701
+                segmented = self._segmented(lookup, True, None)
+                if segmented is None:
+                    misses.setdefault(lookup.from_lang, {}).setdefault(lookup.src_text, lookup)
+                    continue
+                segment_lookups = self._segment_lookups(lookup, segmented)
+                segmentations[(text, i)] = segmented, segment_lookups
+                for segment_lookup in segment_lookups:
+                    if segment_lookup.cache is not None:
+                        misses.setdefault(lookup.from_lang, {}).setdefault(segment_lookup.src_text, segment_lookup)
+
+        translated = {}
+        for lang, lang_misses in misses.items():
+            translated[lang] = self._translate_packed(list(lang_misses.values()), to_lang)
+
+        targets = {}
+        for text, plan in plans.items():
+            if isinstance(plan, str):
+                targets[text] = plan
+                continue
+            fragment_targets = []
+            for i, (fragment, _, is_plain_str, node) in enumerate(plan.fragments):
+                lookup = lookups[(text, i)]
+                if not is_plain_str:
+                    fragment_targets.append(self._do_translation(fragment, from_lang, to_lang, is_plain_str, node,
+                                                                 lookup))
+                elif lookup.cache is None:
+                    fragment_targets.append(lookup.target_text)
+                elif (text, i) in segmentations:
+                    segmented, segment_lookups = segmentations[(text, i)]
+                    segment_targets = {s.src_text: translated[s.from_lang][s.src_text] if s.cache is not None
+                                       else s.target_text for s in segment_lookups}
+                    fragment_targets.append(self._store(lookup, self._join_segments(segmented, segment_targets,
+                                                                                    to_lang), None))
+                else:
+                    fragment_targets.append(translated[lookup.from_lang][lookup.src_text])
+            targets[text] = self._assemble(plan, fragment_targets)
+        return [targets[text] for text in texts]
+
+    def translate_stream(self, source: Iterable[str], to_lang: str, from_lang=None, html: bool = True,
+                         lookahead: int = 8, max_workers: int = 4) -> Iterator[str]:
+        """Translates a large text read piece by piece, e.g. from a file, and yields its translation piece by piece.
+
+        The text is split into chunks of about ``max_translation_block_size()`` of the backend: plain text at line
+        boundaries, and longer lines at sentence ends, HTML between sibling elements. The start and end tags of the
+        elements too long to be a chunk are output as they are, and their content is split in turn. Chunks are
+        translated as by ``translate()``, so the whitespace between their elements is not kept, except at their
+        edges.
+
+        :param source: Pieces of the text (the lines of a file, or any strings), or the text itself.
+        :param html: Whether the text is HTML, or plain text.
+        :param lookahead: Maximum number of chunks read ahead of the one being output, which bounds memory use.
+        :param max_workers: Number of chunks translated at the same time.
+        :return: Translations of the chunks, in order.
+        """
+        assert lookahead >= max_workers > 0
+        size = self._niutrans.max_translation_block_size()
+        chunks = html_chunks(source, size) if html else plain_chunks(source, size)
+
+        def translate(chunk):
+            text = chunk.strip()
+            if html:
+                target_text = self.translate(text, to_lang, from_lang)
+            elif self._dummy:
+                target_text = text
+            else:
+                target_text = self._do_translation(text, from_lang, to_lang, True)
+            return chunk[:chunk.find(text)] + target_text + chunk[len(chunk.rstrip()):]
+
+        pending = deque()
+        with ThreadPoolExecutor(max_workers, thread_name_prefix='niutranspy-stream') as executor:
+            try:
+                for kind, chunk in chunks:
+                    pending.append(chunk if kind == RAW else executor.submit(translate, chunk))
+                    while len(pending) > lookahead:
+                        item = pending.popleft()
+                        yield item if isinstance(item, str) else item.result()
+                while pending:
+                    item = pending.popleft()
+                    yield item if isinstance(item, str) else item.result()
+            finally:
+                for item in pending:
+                    if not isinstance(item, str):
+                        item.cancel()
+
+    def _packs(self, lookups: List[_Lookup]) -> List[List[_Lookup]]:
+        """Groups the lookups into the blocks of lines the backend sends at once, as ``_plain_blocks()`` packs them,
+        without splitting a text across blocks."""
+        block_size = self._niutrans.max_translation_block_size()
+        packs, pack, cnt = [], [], 0
+        for lookup in lookups:
+            extra_cnt = sum(len(line.strip()) + 1 for line in lookup.src_text.split('\n'))
+            if pack and cnt + extra_cnt > block_size:
+                packs.append(pack)
+                pack, cnt = [], 0
+            cnt += extra_cnt
+            pack.append(lookup)
+        packs.append(pack)
+        return packs
+
+    def _translate_packed(self, lookups: List[_Lookup], to_lang: str) -> Dict[str, str]:
+        """Translates the plain texts of the lookups, which share the same language, in as few blocks as possible.
+
+        The texts of a block whose translation fails, or whose lines mismatch, are translated one by one.
+
+        :return: Translation of every ``lookup.src_text``.
+        """
+        from_lang, cache = lookups[0].from_lang, lookups[0].cache
+        packs = self._packs(lookups)
+        results = self._niutrans.map_in_order(
+            lambda pack: self._niutrans('\n'.join(lookup.src_text for lookup in pack), from_lang, to_lang, cache, True),
+            packs)
+        targets = {}
+        for pack, result in zip(packs, results):
+            pack_targets = self._unpack(pack, *result)
+            if pack_targets is None:
+                pack_targets = {lookup.src_text: self._store(lookup, *self._niutrans(lookup.src_text, from_lang,
+                                                                                     to_lang, cache, True))
+                                for lookup in pack}
+            targets.update(pack_targets)
+        return targets
+
+    async def _translate_packed_async(self, lookups: List[_Lookup], to_lang: str) -> Dict[str, str]:
+        from_lang, cache = lookups[0].from_lang, lookups[0].cache
+        packs = self._packs(lookups)
+        results = await asyncio.gather(*(self._niutrans.call_async('\n'.join(lookup.src_text for lookup in pack),
+                                                                   from_lang, to_lang, cache, True) for pack in packs))
+        targets = {}
+        for pack, result in zip(packs, results):
+            pack_targets = self._unpack(pack, *result)
+            if pack_targets is None:
+                singles = await asyncio.gather(*(self._niutrans.call_async(lookup.src_text, from_lang, to_lang, cache,
+                                                                           True) for lookup in pack))
+                pack_targets = {lookup.src_text: self._store(lookup, *single) for lookup, single in zip(pack, singles)}
+            targets.update(pack_targets)
+        return targets
+
+    def _unpack(self, lookups: List[_Lookup], target_text: str,
+                err: Union[BaseException, None]) -> Union[Dict[str, str], None]:
+        """Splits the translation of the packed texts of the lookups and stores them, unless the lines mismatch."""
+        lines = target_text.split('\n') if target_text else []
+        line_counts = [lookup.src_text.count('\n') + 1 for lookup in lookups]
+        if not err and len(lines) == sum(line_counts):
+            targets, i = [], 0
+            for n in line_counts:
+                targets.append('\n'.join(lines[i:i + n]).strip())
+                i += n
+            if all(targets):
+                return {lookup.src_text: self._store(lookup, target, None) for lookup, target in zip(lookups, targets)}
+
+        # the lines could not be matched: the texts have to be translated one by one
+        _log.debug(f'Failed to translate {len(lookups)} texts at once: {err or "lines mismatch"}')
+        return None
+
+    async def translate_async(self, src_text: str, to_lang: str, from_lang=None) -> str:
+        """Same as ``translate()``, without blocking the event loop on the translation backend.
+
+        The fragments of `src_text` are translated concurrently. Use ``AsyncNiutrans`` as the backend, other
+        backends are called in the loop's default executor. So are the cache lookups which may read ``cache.db``, and
+        language detection.
+        """
+        plan = await self._off_loop(bool(from_lang) and self._lookups_block(from_lang, to_lang),
+                                    self._plan, src_text, to_lang, from_lang)
+        if isinstance(plan, str): return plan  # noqa: E701
+        targets = await asyncio.gather(*(self._do_translation_async(text, from_lang, to_lang, is_plain_str, node)
+                                         for text, _, is_plain_str, node in plan.fragments))
+        return self._assemble(plan, targets)
+
+    async def translate_many_async(self, texts: Iterable[str], to_lang: str, from_lang=None) -> List[str]:
+        """Translates every text concurrently, and returns the translations in the same order.
+
+        Duplicated texts are translated once.
+        """
+        texts = list(texts)
+        unique_texts = list(dict.fromkeys(texts))
+        targets = await asyncio.gather(*(self.translate_async(text, to_lang, from_lang) for text in unique_texts))
+        translated = dict(zip(unique_texts, targets))
+        return [translated[text] for text in texts]
+
+    def _lookups_block(self, from_lang, to_lang: str) -> bool:
+        """Whether looking texts up may block on the disk or on language detection: unless the language is given
+        and the eager caches of the pair are loaded."""
+        return (self._cache_mode != 'eager' or from_lang not in self.LANGUAGES
+                or not _dicts_loaded(self._filename, from_lang, to_lang))
+
+    @staticmethod
+    async def _off_loop(blocks: bool, fn: Callable, *args):
+        """Calls fn(*args), in the event loop's default executor if it blocks."""
+        if not blocks: return fn(*args)  # noqa: E701
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    def _plan(self, src_text: str, to_lang: str, from_lang) -> Union[str, _Plan]:
+        """Splits src_text into the fragments to be translated, unless the translation is known already."""
         if self._dummy: return src_text  # noqa: E701
-        if from_lang in {'ja', 'zh'} and all(ord(c) < 127 for c in src_text if not c.isspace()):
+        if from_lang in {'ja', 'zh'} and _ASCII_TEXT.fullmatch(src_text):
+            return src_text
+        is_plain_str = _MARKUP.search(src_text) is None
+        if is_plain_str and _untranslatable(src_text) and self._suggestion(src_text.strip(), from_lang) is None:
             return src_text
-        src_soup = BeautifulSoup(src_text, 'html.parser')
+
+        if from_lang:  # before parsing, the fragments are looked up on a miss
+            target_text = self._cached(src_text, from_lang, to_lang, count_miss=False)[1]
+            if target_text: return target_text  # noqa: E701
+
+        if is_plain_str:  # no need to parse it
+            return _Plan('', [(src_text, {}, True, NavigableString(src_text))], '')
+        src_soup = make_soup(src_text)
         if not src_soup.get_text().strip():
             return src_text  # self-closed tag that without content
 
-        if from_lang:
-            with _lock:
-                cache, old_cache = self._get_cache(from_lang, to_lang)
-                target_text = cache.get(src_text)
-                if not target_text and (src_text in old_cache):
-                    cache[src_text] = target_text = old_cache[src_text]
-                if target_text: return target_text  # noqa: E701
-
         if len(src_soup.contents) == 1 and isinstance(src_soup.contents[0], Tag):
             src_children = src_soup.contents[0].children
-            full_target_str = src_text[:src_text.find('>', 1) + 1]  # attributes are included
-            target_tail_str = f'</{src_soup.contents[0].name}>'
+            head = src_text[:src_text.find('>', 1) + 1]  # attributes are included
+            tail = f'</{src_soup.contents[0].name}>'
         else:
             src_children = src_soup.children
-            full_target_str = target_tail_str = ''
+            head = tail = ''
 
+        fragments = []
         for src_tag in src_children:
             attrs = {}
             if isinstance(src_tag, Tag):
                 attrs = src_tag.attrs
                 src_tag.attrs = {}
-            target_str = self._do_translation(str(src_tag), from_lang, to_lang,
-                                              isinstance(src_tag, NavigableString))
+            fragments.append((str(src_tag), attrs, isinstance(src_tag, NavigableString), src_tag))
+        return _Plan(head, fragments, tail)
+
+    @staticmethod
+    def _assemble(plan: _Plan, targets: List[str]) -> str:
+        full_target_str = plan.head
+        for (_, attrs, _, _), target_str in zip(plan.fragments, targets):
             if not target_str: continue  # noqa: E701
             if attrs:
-                target_tag = BeautifulSoup(target_str, 'html.parser').contents[0]
-                target_tag.attrs = attrs
-                target_str = str(target_tag)
+                target_str = _with_attrs(target_str, tuple((k, tuple(v) if isinstance(v, list) else v)
+                                                           for k, v in attrs.items()))
             full_target_str += target_str
 
-        full_target_str += target_tail_str
+        full_target_str += plan.tail
         return full_target_str
 
-    def _do_translation(self, src_text: str, from_lang: Union[None, str], to_lang: str, is_plain_str: bool):
+    def _do_translation(self, src_text: str, from_lang: Union[None, str], to_lang: str, is_plain_str: bool,
+                        src_soup: PageElement = None, lookup: _Lookup = None):
+        """Translates a fragment.
+
+        :param src_soup: The fragment as parsed already, which spares parsing src_text again.
+        :param lookup: The fragment as looked up already.
+        """
+        lookup = lookup or self._lookup(src_text, from_lang, to_lang, src_soup)
+        if lookup.cache is None:
+            return lookup.target_text
+        # concurrent misses of the same text wait for a single translation
+        return self._flights.do((lookup.from_lang, to_lang, lookup.src_text, is_plain_str),
+                                lambda: self._translate_miss(lookup, src_text, to_lang, is_plain_str, src_soup))
+
+    def _translate_miss(self, lookup: _Lookup, src_text: str, to_lang: str, is_plain_str: bool,
+                        src_soup: Union[PageElement, None]) -> str:
+        target_text = lookup.cache.get(lookup.src_text)
+        if target_text:  # translated by another thread since the lookup
+            return target_text
+
+        src_soup = self._unchanged_soup(lookup, src_text, src_soup)
+        segmented = self._segmented(lookup, is_plain_str, src_soup)
+        if segmented is not None:
+            segment_targets, misses = self._segment_targets(lookup, segmented)
+            if misses:
+                segment_targets.update(self._translate_packed(misses, to_lang))
+            return self._store(lookup, self._join_segments(segmented, segment_targets, to_lang), None)
+
+        # Otherwise, hit the translation
+        target_text, err = '', None
+        # if is_plain_str:
+        #     target_text, err = _tmt(src_text, from_lang, to_lang, cache, is_plain_str)
+        #     if err: _log.info(err)  # noqa: E701
+        if not target_text:
+            target_text, err = self._niutrans(lookup.src_text, lookup.from_lang, to_lang, lookup.cache, is_plain_str,
+                                              src_soup)
+        return self._store(lookup, target_text, err)
+
+    async def _do_translation_async(self, src_text: str, from_lang: Union[None, str], to_lang: str,
+                                    is_plain_str: bool, src_soup: PageElement = None):
+        lookup = await self._off_loop(self._lookups_block(from_lang, to_lang), self._lookup, src_text, from_lang,
+                                      to_lang, src_soup)
+        if lookup.cache is None:
+            return lookup.target_text
+        return await self._flights.do_async((lookup.from_lang, to_lang, lookup.src_text, is_plain_str),
+                                            lambda: self._translate_miss_async(lookup, src_text, to_lang,
+                                                                               is_plain_str, src_soup))
+
+    async def _translate_miss_async(self, lookup: _Lookup, src_text: str, to_lang: str, is_plain_str: bool,
+                                    src_soup: Union[PageElement, None]) -> str:
+        lazy = self._cache_mode != 'eager'
+        target_text = await self._off_loop(lazy, lookup.cache.get, lookup.src_text)
+        if target_text:
+            return target_text
+
+        src_soup = self._unchanged_soup(lookup, src_text, src_soup)
+        segmented = self._segmented(lookup, is_plain_str, src_soup)
+        if segmented is not None:
+            segment_targets, misses = await self._off_loop(lazy, self._segment_targets, lookup, segmented)
+            if misses:
+                segment_targets.update(await self._translate_packed_async(misses, to_lang))
+            return self._store(lookup, self._join_segments(segmented, segment_targets, to_lang), None)
+
+        target_text, err = await self._niutrans.call_async(lookup.src_text, lookup.from_lang, to_lang, lookup.cache,
+                                                           is_plain_str, src_soup)
+        return self._store(lookup, target_text, err)
+
+    def _segmented(self, lookup: _Lookup, is_plain_str: bool, src_soup: Union[Tag, None]) -> Union[_Segmented, None]:
+        """Splits the text to be translated into sentences in segments mode, if it's plain text or an element
+        holding plain text only."""
+        if not self._segments:
+            return None
+        if is_plain_str:
+            return _Segmented('', [_sentences(line) for line in lookup.src_text.split('\n')], '')
+        if src_soup is not None and len(src_soup.contents) == 1 and type(src_soup.contents[0]) is NavigableString:
+            text = str(src_soup.contents[0])
+            if lookup.from_lang == 'zh':  # as lookup.src_text is
+                with metrics.timer('opencc_seconds'):
+                    text = self._zh_hant_to_zh_hans(text)
+            return _Segmented(lookup.src_text[:lookup.src_text.find('>') + 1], [_sentences(text)],
+                              f'</{src_soup.name}>')
+        return None
+
+    @staticmethod
+    def _segment_lookups(lookup: _Lookup, segmented: _Segmented) -> List[_Lookup]:
+        """Looks every distinct sentence up in the cache of the text. Sentences without anything to translate, as
+        ``_lookup()`` finds them, are their own translations."""
+        lookups = []
+        for segment in dict.fromkeys(segment for line in segmented.lines for segment in line):
+            if ((len(segment) == 1 and ord(segment) < 127) or _untranslatable(segment)
+                    or (lookup.from_lang in {'ja', 'zh'} and _ASCII_TEXT.fullmatch(segment))):
+                lookups.append(_Lookup(segment, segment, lookup.from_lang, None))
+                continue
+            target_text = lookup.cache.get(segment)
+            lookups.append(_Lookup(target_text or '', segment, lookup.from_lang, None if target_text else lookup.cache))
+        return lookups
+
+    def _segment_targets(self, lookup: _Lookup, segmented: _Segmented) -> Tuple[Dict[str, str], List[_Lookup]]:
+        """Returns the cached translations of the sentences, and the lookups of the sentences to be translated."""
+        lookups = self._segment_lookups(lookup, segmented)
+        return ({s.src_text: s.target_text for s in lookups if s.cache is None},
+                [s for s in lookups if s.cache is not None])
+
+    @staticmethod
+    def _join_segments(segmented: _Segmented, targets: Dict[str, str], to_lang: str) -> str:
+        separator = '' if to_lang in {'zh', 'ja'} else ' '
+        target_text = '\n'.join(separator.join(targets[segment] for segment in line) for line in segmented.lines)
+        if segmented.head:
+            target_text = segmented.head + EntitySubstitution.substitute_xml(target_text) + segmented.tail
+        return target_text
+
+    @staticmethod
+    def _unchanged_soup(lookup: _Lookup, src_text: str, src_soup: Union[PageElement, None]) -> Union[Tag, None]:
+        """Returns src_soup if it's an element the backend can use instead of parsing the normalized src_text."""
+        return src_soup if isinstance(src_soup, Tag) and lookup.src_text == src_text else None
+
+    def _suggestion(self, src_text: str, from_lang: Union[None, str]) -> Union[None, str]:
+        """Returns the language of src_text in the suggestion file, 'X' to drop it or '=' to keep it, if it's listed
+        there and from_lang is not given."""
+        return None if from_lang in self.LANGUAGES else self._lang_suggestion.get(src_text)
+
+    def _lookup(self, src_text: str, from_lang: Union[None, str], to_lang: str,
+                src_soup: PageElement = None) -> _Lookup:
+        """Normalizes src_text, detects its language if necessary and looks it up in the cache.
+
+        The returned cache is None when the translation is known without calling the backend.
+        """
         assert to_lang in self.LANGUAGES, f'{to_lang} is not enabled in Translator.LANGUAGES yet'
         src_text = src_text.strip()
+        suggestion = self._suggestion(src_text, from_lang)
+        if suggestion == 'X': return _Lookup('', src_text, suggestion, None)  # noqa: E701
+        if suggestion == '=': return _Lookup(src_text, src_text, suggestion, None)  # noqa: E701
         if len(src_text) <= 1:
-            if not src_text: return ''  # noqa: E701
-            if ord(src_text) < 127: return src_text  # noqa: E701
+            if not src_text: return _Lookup('', src_text, from_lang, None)  # noqa: E701
+            if ord(src_text) < 127: return _Lookup(src_text, src_text, from_lang, None)  # noqa: E701
+        if '<' not in src_text and _untranslatable(src_text):
+            return _Lookup(src_text, src_text, from_lang, None)
         if from_lang not in self.LANGUAGES:
-            if src_text in self._lang_suggestion:
-                from_lang = self._lang_suggestion[src_text]
-                if from_lang == 'X': return ''  # noqa: E701
-                if from_lang == '=': return src_text  # noqa: E701
+            if suggestion:
+                from_lang = suggestion
                 _log.debug(f'Recognise {src_text!r} as {from_lang}')
                 assert from_lang in self.LANGUAGES, from_lang
             else:
-                tmp_src_text = html_to_text(src_text).strip().lower()
+                if src_soup is None:
+                    tmp_src_text = html_to_text(src_text).strip().lower()
+                elif isinstance(src_soup, Tag):  # without the content of <script> or <style>, as html_to_text()
+                    tmp_src_text = get_text_contents(src_soup.get_text(types=(NavigableString, CData))).strip().lower()
+                else:
+                    tmp_src_text = get_text_contents(src_soup).strip().lower()
                 if not tmp_src_text:
-                    return ''  # it's a self closed html tag without text content
-                good, from_lang = get_lang(tmp_src_text)
-                if not good:
+                    # it's a self closed html tag without text content
+                    return _Lookup('', src_text, from_lang, None)
+                if _untranslatable(tmp_src_text):
+                    return _Lookup(src_text, src_text, from_lang, None)
+                from_lang = self._detector.detect(tmp_src_text)
+                if from_lang is None:
                     raise ValueError(f'= {src_text!r}')
             if from_lang not in self.LANGUAGES:
                 raise ValueError(f'{from_lang} {repr(src_text)}')
         assert to_lang in {'en', 'zh'}
-        if from_lang in {'ja', 'zh'} and all(ord(c) < 127 for c in src_text if not c.isspace()):
-            return src_text
+        if from_lang in {'ja', 'zh'} and _ASCII_TEXT.fullmatch(src_text):
+            return _Lookup(src_text, src_text, from_lang, None)
         if from_lang == 'zh':
             # it might be traditional Chinese. we need simplified Chinese
-            src_text = self._zh_hant_to_zh_hans(src_text)
+            with metrics.timer('opencc_seconds'):
+                src_text = self._zh_hant_to_zh_hans(src_text)
         if from_lang == to_lang:
-            return src_text
+            return _Lookup(src_text, src_text, from_lang, None)
 
-        with _lock:
-            cache, old_cache = self._get_cache(from_lang, to_lang)
-            target_text = cache.get(src_text)
-            if not target_text and (src_text in old_cache):
-                cache[src_text] = target_text = old_cache[src_text]
+        cache, target_text = self._cached(src_text, from_lang, to_lang)
 
         # If the source hits the cache, return the target immediately
         if target_text:
-            return target_text
+            return _Lookup(target_text, src_text, from_lang, None)
+        if isinstance(src_soup, Tag) and _untranslatable(src_soup.get_text()):
+            return _Lookup(src_text, src_text, from_lang, None)
+        return _Lookup('', src_text, from_lang, cache)
 
-        # Otherwise, hit the translation
-        target_text, err = '', None
-        # if is_plain_str:
-        #     target_text, err = _tmt(src_text, from_lang, to_lang, cache, is_plain_str)
-        #     if err: _log.info(err)  # noqa: E701
-        if not target_text:
-            target_text, err = self._niutrans(src_text, from_lang, to_lang, cache, is_plain_str)
-            if err: _log.debug(err)  # noqa: E701
+    @staticmethod
+    def _store(lookup: _Lookup, target_text: str, err: Union[BaseException, None]) -> str:
+        if err: _log.debug(err)  # noqa: E701
         if not target_text:
             raise err or ValueError('All translator backends are disabled')
 
-        # Increment count
-        # _stats()
-
         # Write result to cache in RAM and return the target
-        with _lock:
-            cache[src_text] = target_text
+        lookup.cache[lookup.src_text] = target_text
 
         return target_text
@@ -6,3 +6,6 @@ _INLINE_ELEMENTS = {
     'q', 'samp', 'script', 'select', 'small', 'span', 'strong',
     'sub', 'sup', 'textarea', 'tt', 'var'
 }
+# error_code values of the NiuTrans API: requests sent too fast, and other transient errors (timeout)
+NIUTRANS_THROTTLE_ERROR_CODES = {'10001'}
+NIUTRANS_RETRYABLE_ERROR_CODES = {'13008'}
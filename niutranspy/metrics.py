@@ -0,0 +1,196 @@
+"""Counters and latency histograms of the translation stages, reported to pluggable sinks.
+
+Recording is disabled until a sink is added with ``add_sink()``: ``count()`` and ``timer()`` then return at once.
+
+Metrics recorded:
+
+- ``cache_lookups_total{result}``: translation cache lookups, ``result`` being ``hit`` (primary cache), ``bak_hit``
+  (``.bak`` cache) or ``miss``.
+- ``lang_detection_total{result}``: language detections, ``hit`` or ``miss`` in the detection cache.
+- ``lang_detection_seconds``, ``opencc_seconds``, ``html_parse_seconds``: time spent in cld3, OpenCC and parsing.
+- ``api_request_seconds{api}``: NiuTrans HTTP requests, ``api`` being ``plain`` or ``xml``, retried ones included.
+- ``api_errors_total{api, error}``: failed requests, by NiuTrans error code or exception class.
+- ``api_retries_total{reason}``: requests retried by the scheduler, ``reason`` being ``throttled`` or ``retryable``.
+- ``api_rejected_total``: requests rejected by the scheduler's circuit breaker.
+- ``translations_total{kind}``: texts translated by the backend, ``kind`` being ``plain`` or ``xml``.
+- ``coalesced_total``: translations of a text waiting for the same one in progress, instead of calling the backend.
+"""
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import nullcontext
+from time import monotonic, perf_counter
+from typing import Callable, Dict, List, Tuple
+
+_log = logging.getLogger(__name__)
+
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)  # seconds
+Labels = Tuple[Tuple[str, str], ...]
+
+_sinks = []
+_NULL_TIMER = nullcontext()
+enabled = False
+
+
+class Sink(object):
+    """Receives every recorded value."""
+
+    def record(self, kind: str, name: str, value: float, labels: Labels) -> None:
+        """
+        :param kind: ``'counter'`` (``value`` is an increment) or ``'histogram'`` (``value`` is in seconds).
+        :param name: Metric name.
+        :param labels: Sorted ``(label, value)`` pairs.
+        """
+        raise NotImplementedError
+
+
+class CallbackSink(Sink):
+    """Calls ``callback(kind, name, value, labels)`` for every recorded value, in the recording thread."""
+
+    def __init__(self, callback: Callable[[str, str, float, Labels], None]):
+        self._callback = callback
+
+    def record(self, kind: str, name: str, value: float, labels: Labels) -> None:
+        self._callback(kind, name, value, labels)
+
+
+class AggregatingSink(Sink):
+    """Sums the counters and counts the histogram values into ``BUCKETS``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> total
+        self.histograms = {}  # (name, labels) -> [count per bucket (the last one is +Inf), sum]
+
+    def record(self, kind: str, name: str, value: float, labels: Labels) -> None:
+        with self._lock:
+            if kind == 'counter':
+                self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+            else:
+                histogram = self.histograms.get((name, labels))
+                if histogram is None:
+                    histogram = self.histograms[(name, labels)] = [[0] * (len(BUCKETS) + 1), 0.0]
+                histogram[0][bisect_left(BUCKETS, value)] += 1
+                histogram[1] += value
+
+    def snapshot(self) -> Tuple[Dict[Tuple[str, Labels], float], Dict[Tuple[str, Labels], Tuple[List[int], float]]]:
+        """Returns copies of the counters and of the histograms."""
+        with self._lock:
+            return dict(self.counters), {k: (list(buckets), total) for k, (buckets, total) in self.histograms.items()}
+
+
+def _format_labels(labels: Labels, extra: str = '') -> str:
+    pairs = [f'{k}="{v}"' for k, v in labels]
+    if extra: pairs.append(extra)  # noqa: E701
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class PrometheusSink(AggregatingSink):
+    """Aggregates the metrics, to be exposed in the Prometheus text format by ``render()``."""
+
+    def __init__(self, prefix: str = 'niutranspy_'):
+        super().__init__()
+        self.prefix = prefix
+
+    def render(self) -> str:
+        counters, histograms = self.snapshot()
+        lines, typed = [], set()
+        for (name, labels), total in sorted(counters.items()):
+            name = self.prefix + name
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{_format_labels(labels)} {total:g}')
+        for (name, labels), (buckets, total) in sorted(histograms.items()):
+            name = self.prefix + name
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            cumulated = 0
+            for le, cnt in zip(BUCKETS + ('+Inf',), buckets):
+                cumulated += cnt
+                le_label = f'le="{le}"'
+                lines.append(f'{name}_bucket{_format_labels(labels, le_label)} {cumulated}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total:g}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulated}')
+        return '\n'.join(lines) + '\n'
+
+
+class LoggingSink(AggregatingSink):
+    """Aggregates the metrics and logs them every ``interval`` seconds, when values are recorded."""
+
+    def __init__(self, logger: logging.Logger = _log, level: int = logging.INFO, interval: float = 60.0):
+        super().__init__()
+        self._logger = logger
+        self._level = level
+        self._interval = interval
+        self._deadline = monotonic() + interval
+
+    def record(self, kind: str, name: str, value: float, labels: Labels) -> None:
+        super().record(kind, name, value, labels)
+        if monotonic() >= self._deadline:
+            self._deadline = monotonic() + self._interval
+            self.log()
+
+    def log(self) -> None:
+        counters, histograms = self.snapshot()
+        items = [f'{name}{_format_labels(labels)}={total:g}' for (name, labels), total in sorted(counters.items())]
+        for (name, labels), (buckets, total) in sorted(histograms.items()):
+            cnt = sum(buckets)
+            items.append(f'{name}{_format_labels(labels)}: {cnt} in {total:.3f} s (avg {total / cnt * 1e3:.3f} ms)')
+        self._logger.log(self._level, 'niutranspy metrics: ' + ', '.join(items))
+
+
+def add_sink(sink: Sink) -> Sink:
+    """Starts reporting the metrics to the sink, and returns it."""
+    global enabled
+    _sinks.append(sink)
+    enabled = True
+    return sink
+
+
+def remove_sink(sink: Sink) -> None:
+    global enabled
+    _sinks.remove(sink)
+    enabled = bool(_sinks)
+
+
+def _record(kind: str, name: str, value: float, labels: Dict[str, str]) -> None:
+    labels = tuple(sorted(labels.items()))
+    for sink in list(_sinks):
+        try:
+            sink.record(kind, name, value, labels)
+        except Exception as e:
+            _log.error(f'Failed to record {name} to {sink!r}: {e!r}')
+
+
+def count(name: str, value: float = 1, **labels: str) -> None:
+    """Increments a counter."""
+    if enabled:
+        _record('counter', name, value, labels)
+
+
+def observe(name: str, seconds: float, **labels: str) -> None:
+    """Records a duration into a histogram."""
+    if enabled:
+        _record('histogram', name, seconds, labels)
+
+
+class _Timer(object):
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name: str, labels: Dict[str, str]):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _record('histogram', self.name, perf_counter() - self.start, self.labels)
+
+
+def timer(name: str, **labels: str):
+    """Returns a context manager recording its duration into a histogram."""
+    return _Timer(name, labels) if enabled else _NULL_TIMER
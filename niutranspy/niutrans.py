@@ -1,28 +1,64 @@
+import asyncio
 import json
 import logging
-from typing import Union, Tuple
+from typing import Dict, List, Union, Tuple
 
 import requests
-import threading
-from bs4 import BeautifulSoup
-from bs4.element import NavigableString
+from bs4.element import NavigableString, PageElement
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+try:
+    import aiohttp
+except ImportError:  # optional, for AsyncNiutrans only
+    aiohttp = None
+
+from niutranspy import metrics
 from niutranspy.backend import _TranslationBackend
-from niutranspy.utils import _try_despite_of_errors
+from niutranspy.scheduler import Scheduler
+from niutranspy.utils import serialized_len
 from niutranspy.constants import NIUTRANS_API_URL, NIUTRANS_XML_API_URL
 
-_lock = threading.RLock()
 _caches = {}
 _old_caches = {}
 _log = logging.getLogger(__name__)
-# _niutrans_stats = LocalStatsLogger(_log.info, 400, 'Niutrans translated {} items')
 
 
 class Niutrans(_TranslationBackend):
-    def __init__(self, api_key):
+    def __init__(self, api_key, max_workers: int = 1, api_url: str = NIUTRANS_API_URL,
+                 xml_api_url: str = NIUTRANS_XML_API_URL, pool_size: int = 10,
+                 timeout: Tuple[float, float] = (10, 60), max_retries: Union[int, Retry] = 0,
+                 scheduler: Scheduler = None):
+        """
+        :param api_key: NiuTrans API key. The translator is disabled when it is empty.
+        :param max_workers: Number of blocks or fragments of a text that are sent to the API at the same time.
+        :param api_url: URL of the plain text translation API.
+        :param xml_api_url: URL of the XML translation API.
+        :param pool_size: Number of keep-alive connections kept to the API server. Should be at least the number of
+            threads translating at the same time.
+        :param timeout: Connect and read timeouts of a request, in seconds.
+        :param max_retries: Retry policy of a request, passed to ``requests.adapters.HTTPAdapter``. Failed requests
+            are retried by the scheduler as well.
+        :param scheduler: Rate limits, retries and admits the requests. Pass the same scheduler to the backends
+            sharing an API key. By default, requests are not rate limited, and are retried with exponential backoff.
+        """
+        super().__init__(max_workers)
         if not api_key:
             _log.warning('apikey being empty, dummy translator is used.')
         self._data = {'apikey': api_key}  # "from" and "to" are also necessary
+        self._api_url = api_url
+        self._xml_api_url = xml_api_url
+        self._timeout = timeout
+        self._scheduler = scheduler or Scheduler()
+        # A session is safe to share between threads as long as its settings (headers, cookies...) are left alone.
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=max_retries)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    def close(self) -> None:
+        """Closes the connections to the API server."""
+        self._session.close()
 
     def is_disabled(self) -> bool:
         return not self._data['apikey']
@@ -31,18 +67,25 @@ class Niutrans(_TranslationBackend):
     def max_translation_block_size() -> int:
         return 5000
 
-    def _can_translate(self, soup):
-        if not soup.content or len(str(soup)) <= self.max_translation_block_size():
-            return True
+    def _can_translate(self, soup, lengths: Dict[int, int]) -> bool:
+        """Tells whether every piece of the soup which is sent to the API by ``_tran()`` fits in a block."""
         if isinstance(soup, NavigableString):
-            return False
-        return all(self._can_translate(sub) for sub in soup)
+            return len(soup) <= self.max_translation_block_size()
+        if not soup.contents or serialized_len(soup, lengths) <= self.max_translation_block_size():
+            return True
+        return all(self._can_translate(sub, lengths) for sub in soup.children)
 
-    def _pre_check(self, src_text: str, from_lang: str, to_lang: str, is_plain_str: bool) -> Union[BaseException, None]:
+    def _pre_check(self, src_text: str, from_lang: str, to_lang: str, is_plain_str: bool,
+                   src_pieces: Union[List[PageElement], None] = None) -> Union[BaseException, None]:
         # if from_lang in {'ja'} and is_plain_str and to_lang != 'en':
         #     # TMT does not support translating Japanese to English. The task has to be done by Niutrans
         #     return ValueError(f"Niutrans: disabled from translating {from_lang} text to {to_lang}")
-        if self._can_translate(BeautifulSoup(f'<div>{src_text}</div>', 'html.parser').div):
+        if is_plain_str:
+            return None  # split into blocks by lines
+        if src_pieces is None:
+            src_pieces = self._xml_pieces(src_text, None)
+        lengths = {}
+        if all(self._can_translate(piece, lengths) for piece in src_pieces):
             return None
         else:
             return ValueError(f'Niutrans: Length exceeds 5000 chars: {src_text!r}')
@@ -55,27 +98,128 @@ class Niutrans(_TranslationBackend):
         data_post = {'src_text': src_text, 'from': from_lang, 'to': to_lang}
         data_post.update(self._data)
 
-        exceptions = (requests.exceptions.ConnectionError,)
+        api = self._api_name(api_url)
+
+        def post():
+            with metrics.timer('api_request_seconds', api=api):
+                return json.loads(self._session.post(api_url, data=data_post, timeout=self._timeout).text)
+
+        exceptions = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
         try:
-            data = _try_despite_of_errors(lambda: json.loads(requests.post(api_url, data=data_post).text), exceptions)
+            data = self._scheduler.call(post, len(src_text), exceptions)
         except exceptions as e:
+            metrics.count('api_errors_total', api=api, error=type(e).__name__)
             raise e
+        return self._target_text(src_text, data, api)
+
+    def _api_name(self, api_url: str) -> str:
+        return 'xml' if api_url == self._xml_api_url else 'plain'
 
+    @staticmethod
+    def _target_text(src_text: str, data: dict, api: str) -> str:
+        """Extracts the translation from the API's response."""
         if 'error_code' in data:
+            metrics.count('api_errors_total', api=api, error=str(data.get('error_code')))
             raise ValueError(f"{data.get('error_code')}: {data.get('error_msg')} - {src_text}")
 
         tgt_text = data.get('tgt_text', '').strip()
         if not tgt_text:
             raise ValueError(f'{src_text!r} was translated to empty target text: {data!r}')
-        # _niutrans_stats()
         return tgt_text
 
     def _translate_plain_text(self, src_text: str, from_lang: str, to_lang: str,
                               cache) -> Tuple[str, Union[BaseException, None]]:
         try:
-            return self._translate_base(NIUTRANS_API_URL, src_text, from_lang, to_lang, cache), None
+            return self._translate_base(self._api_url, src_text, from_lang, to_lang, cache), None
         except ValueError as e:
             return '', e
 
     def _translate_xml(self, src_text: str, from_lang: str, to_lang: str, cache) -> str:
-        return self._translate_base(NIUTRANS_XML_API_URL, src_text, from_lang, to_lang, cache)
+        return self._translate_base(self._xml_api_url, src_text, from_lang, to_lang, cache)
+
+
+class AsyncNiutrans(Niutrans):
+    """Niutrans with non-blocking ``call_async()``, as used by ``Translator.translate_async()``. Requires aiohttp.
+
+    Calling it synchronously works as with ``Niutrans``.
+    """
+
+    def __init__(self, api_key, max_in_flight: int = 10, **kwargs):
+        """
+        :param api_key: NiuTrans API key. The translator is disabled when it is empty.
+        :param max_in_flight: Maximum number of requests sent to the API at the same time by ``call_async()``.
+        :param kwargs: See ``Niutrans``.
+        """
+        if aiohttp is None:
+            raise ImportError('AsyncNiutrans requires aiohttp: pip install aiohttp')
+        super().__init__(api_key, **kwargs)
+        self._max_in_flight = max_in_flight
+        self._aio = {}  # event loop -> (aiohttp session, semaphore, closer of the session)
+
+    async def _aio_session(self) -> Tuple['aiohttp.ClientSession', asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        aio = self._aio.get(loop)
+        if aio is None:
+            connector = aiohttp.TCPConnector(limit=self._max_in_flight)
+            timeout = aiohttp.ClientTimeout(sock_connect=self._timeout[0], sock_read=self._timeout[1])
+            session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            closer = self._close_at_shutdown(loop, session)
+            aio = self._aio[loop] = (session, asyncio.Semaphore(self._max_in_flight), closer)
+            await closer.asend(None)
+            # loops closed without shutdown_asyncgens(), whose connections can only be released by the GC now
+            for closed in [other for other in self._aio if other.is_closed()]:
+                await self._aio[closed][2].aclose()
+        return aio[0], aio[1]
+
+    async def _close_at_shutdown(self, loop: asyncio.AbstractEventLoop, session: 'aiohttp.ClientSession'):
+        """Closes the session of the loop when finalized by ``loop.shutdown_asyncgens()``, which ``asyncio.run()``
+        calls before closing the loop, so that its connections are closed in the loop they belong to."""
+        try:
+            yield
+        finally:
+            self._aio.pop(loop, None)
+            await session.close()
+
+    async def aclose(self) -> None:
+        """Closes the connections opened by ``call_async()`` in the running event loop.
+
+        They are closed as well when ``asyncio.run()`` completes.
+        """
+        aio = self._aio.get(asyncio.get_running_loop())
+        if aio is not None:
+            await aio[2].aclose()
+
+    async def _translate_base_async(self, api_url: str, src_text: str, from_lang: str, to_lang: str, cache) -> str:
+        src_text = src_text.strip()
+        if not src_text: return ''  # noqa: E701
+        tgt_text = cache.get(src_text)
+        if tgt_text: return tgt_text  # noqa: E701
+        data_post = {'src_text': src_text, 'from': from_lang, 'to': to_lang}
+        data_post.update(self._data)
+
+        session, semaphore = await self._aio_session()
+        api = self._api_name(api_url)
+
+        async def post():
+            async with semaphore:
+                with metrics.timer('api_request_seconds', api=api):
+                    async with session.post(api_url, data=data_post) as resp:
+                        return json.loads(await resp.text())
+
+        exceptions = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+        try:
+            data = await self._scheduler.call_async(post, len(src_text), exceptions)
+        except exceptions as e:
+            metrics.count('api_errors_total', api=api, error=type(e).__name__)
+            raise
+        return self._target_text(src_text, data, api)
+
+    async def _translate_plain_text_async(self, src_text: str, from_lang: str, to_lang: str,
+                                          cache) -> Tuple[str, Union[BaseException, None]]:
+        try:
+            return await self._translate_base_async(self._api_url, src_text, from_lang, to_lang, cache), None
+        except ValueError as e:
+            return '', e
+
+    async def _translate_xml_async(self, src_text: str, from_lang: str, to_lang: str, cache) -> str:
+        return await self._translate_base_async(self._xml_api_url, src_text, from_lang, to_lang, cache)
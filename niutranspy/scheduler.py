@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import random
+import threading
+from itertools import count
+from time import monotonic, sleep
+from typing import Awaitable, Callable, Iterable, Tuple, Type, Union
+
+from niutranspy import metrics
+from niutranspy.constants import NIUTRANS_RETRYABLE_ERROR_CODES, NIUTRANS_THROTTLE_ERROR_CODES
+
+_log = logging.getLogger(__name__)
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of sending a request while the API is considered down."""
+
+
+class _TokenBucket(object):
+    """Lets ``rate`` tokens per second through, up to ``capacity`` at once.
+
+    The rate is halved whenever the API throttles, and recovers step by step with every successful request.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.max_rate = self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, n: float) -> float:
+        """Takes ``n`` tokens, in advance if necessary, and returns how long to wait until they are available."""
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= n
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def slow_down(self) -> None:
+        with self._lock:
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+
+    def speed_up(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 16)
+
+
+class _CircuitBreaker(object):
+    """Opens after ``threshold`` consecutive failures, rejecting requests for ``reset_timeout`` seconds.
+
+    Then a single trial request is let through: the circuit closes if it succeeds, and opens again otherwise.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if not self._trial and monotonic() - self._opened_at >= self.reset_timeout:
+                self._trial = True
+                return True
+            return False
+
+    def success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def abort(self) -> None:
+        """Ends a request whose outcome is unknown, such as an unexpected exception: if it was the trial request,
+        the next request is a trial again."""
+        with self._lock:
+            self._trial = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.threshold and (self._trial or self._failures >= self.threshold):
+                if self._opened_at is None or self._trial:
+                    _log.warning(f'{self._failures} consecutive failures, the API is not called for '
+                                 f'{self.reset_timeout} s')
+                self._opened_at = monotonic()
+                self._trial = False
+
+
+class Scheduler(object):
+    """Paces, retries and admits the requests of the NiuTrans backends sharing it, e.g. those of an API key."""
+
+    def __init__(self, qps: float = None, chars_per_second: float = None, burst_seconds: float = 1.0,
+                 max_in_flight: int = None, max_attempts: int = 5, base_delay: float = 1.0, max_delay: float = 60.0,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 throttle_error_codes: Iterable[str] = NIUTRANS_THROTTLE_ERROR_CODES,
+                 retryable_error_codes: Iterable[str] = NIUTRANS_RETRYABLE_ERROR_CODES):
+        """
+        :param qps: Maximum number of requests per second, unlimited if None. Lowered temporarily when the API
+            throttles.
+        :param chars_per_second: Maximum number of characters sent per second, unlimited if None.
+        :param burst_seconds: Requests and characters that may be sent at once, in seconds of their rates.
+        :param max_in_flight: Maximum number of requests sent at the same time by threads, which wait for their
+            turn beyond it. Unlimited if None.
+        :param max_attempts: Attempts of a request before giving up, on connection errors or retryable error codes.
+        :param base_delay: Delay before the first retry, in seconds. Doubled at every retry, with jitter.
+        :param max_delay: Maximum delay before a retry, in seconds.
+        :param failure_threshold: Consecutive connection errors or retryable errors after which requests fail with
+            ``CircuitOpenError`` for ``reset_timeout`` seconds. 0 disables the circuit breaker.
+        :param throttle_error_codes: ``error_code`` values meaning that requests are sent too fast.
+        :param retryable_error_codes: Other ``error_code`` values worth retrying. The other codes are fatal.
+        """
+        assert max_attempts > 0
+        self._buckets = []
+        if qps:
+            self._buckets.append((_TokenBucket(qps, max(1.0, qps * burst_seconds)), lambda chars: 1))
+        if chars_per_second:
+            self._buckets.append((_TokenBucket(chars_per_second, chars_per_second * burst_seconds),
+                                  lambda chars: chars))
+        self._slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._breaker = _CircuitBreaker(failure_threshold, reset_timeout)
+        self.throttle_error_codes = {str(c) for c in throttle_error_codes}
+        self.retryable_error_codes = {str(c) for c in retryable_error_codes}
+
+    def classify(self, data: dict) -> Union[str, None]:
+        """Returns None if the API's response is a success, ``'throttled'``, ``'retryable'`` or ``'fatal'``."""
+        if 'error_code' not in data:
+            return None
+        code = str(data['error_code'])
+        if code in self.throttle_error_codes:
+            return 'throttled'
+        return 'retryable' if code in self.retryable_error_codes else 'fatal'
+
+    def _admit(self, chars: int) -> float:
+        """Checks the circuit breaker, and returns how long to wait before sending a request of ``chars``."""
+        if not self._breaker.allow():
+            metrics.count('api_rejected_total')
+            raise CircuitOpenError('Too many failed requests to the translation server, retry later')
+        return max([bucket.reserve(n(chars)) for bucket, n in self._buckets], default=0.0)
+
+    def _retry_delay(self, attempt: int, outcome: Union[str, None]) -> Union[float, None]:
+        """Records the outcome of an attempt, and returns the delay before the next one, or None to stop."""
+        if outcome == 'retryable':
+            self._breaker.failure()
+        else:  # the API is up
+            self._breaker.success()
+        for bucket, _ in self._buckets:
+            if outcome is None:
+                bucket.speed_up()
+            elif outcome == 'throttled':
+                bucket.slow_down()
+        if outcome is None or outcome == 'fatal' or attempt >= self.max_attempts:
+            return None
+        metrics.count('api_retries_total', reason=outcome)
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def call(self, request: Callable[[], dict], chars: int,
+             exception_classes: Tuple[Type[BaseException], ...]) -> dict:
+        """Sends ``request()``, once admitted, retrying it on retryable errors.
+
+        :param request: Sends the request, and returns the API's response.
+        :param chars: Number of characters sent.
+        :param exception_classes: Exceptions of ``request()`` worth retrying, such as connection errors.
+        :return: The last response, which is an error if it isn't retryable or the attempts are exhausted.
+        """
+        for attempt in count(1):
+            wait = self._admit(chars)
+            try:
+                if wait: sleep(wait)  # noqa: E701
+                if self._slots is None:
+                    data = request()
+                else:
+                    with self._slots:
+                        data = request()
+            except exception_classes as e:
+                delay = self._retry_delay(attempt, 'retryable')
+                if delay is None:
+                    _log.error(f'Max attempts failed to reach the translation server: {str(e)}')
+                    raise
+                _log.debug(f'Retrying in {delay:.1f} s after: {e!r}')
+            except BaseException:  # e.g. an invalid response, or cancelled
+                self._breaker.abort()
+                raise
+            else:
+                delay = self._retry_delay(attempt, self.classify(data))
+                if delay is None:
+                    return data
+                _log.debug(f'Retrying in {delay:.1f} s after: {data!r}')
+            sleep(delay)
+
+    async def call_async(self, request: Callable[[], Awaitable[dict]], chars: int,
+                         exception_classes: Tuple[Type[BaseException], ...]) -> dict:
+        """Same as ``call()``, for a coroutine function, without blocking the event loop.
+
+        ``max_in_flight`` does not apply, see ``AsyncNiutrans``'s own ``max_in_flight``.
+        """
+        for attempt in count(1):
+            wait = self._admit(chars)
+            try:
+                if wait: await asyncio.sleep(wait)  # noqa: E701
+                data = await request()
+            except exception_classes as e:
+                delay = self._retry_delay(attempt, 'retryable')
+                if delay is None:
+                    _log.error(f'Max attempts failed to reach the translation server: {str(e)}')
+                    raise
+                _log.debug(f'Retrying in {delay:.1f} s after: {e!r}')
+            except BaseException:  # e.g. an invalid response, or cancelled
+                self._breaker.abort()
+                raise
+            else:
+                delay = self._retry_delay(attempt, self.classify(data))
+                if delay is None:
+                    return data
+                _log.debug(f'Retrying in {delay:.1f} s after: {data!r}')
+            await asyncio.sleep(delay)
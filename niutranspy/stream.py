@@ -0,0 +1,205 @@
+"""Incremental splitting of large plain text or HTML inputs into chunks of about the size of a translation block."""
+import re
+from itertools import chain
+from typing import Iterable, Iterator, List, Tuple
+
+# kinds of chunks: text to be translated, and markup to be output as it is
+TEXT, RAW = 'text', 'raw'
+_VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+                  'track', 'wbr'}
+_RAW_TEXT_ELEMENTS = {'script', 'style', 'textarea', 'title'}
+_RAW_TEXT_ENDS = {name: re.compile(f'</{name}', re.I) for name in _RAW_TEXT_ELEMENTS}
+_COMMENT_END = re.compile('-->')
+_TAG = re.compile(r'''<(/?)([a-zA-Z][^\s/>]*)(?:\s*[^\s/>"'=]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s>]*))?)*\s*(/?)>''')
+_MAX_TAG_LEN = 65536  # beyond it, an unterminated '<' is text
+_BREAK = re.compile(r'([。！？；]+[”’」』）)]*\s*|[.!?;]+["\')]*\s+)|\s+')  # where long lines are cut, sentence ends first
+
+
+def _pieces(source) -> Iterator[str]:
+    return iter([source]) if isinstance(source, str) else iter(source)
+
+
+def _split_line(line: str, size: int) -> Iterator[str]:
+    """Cuts a line into pieces of at most ``size`` characters, after the end of a sentence, or else at a whitespace,
+    where possible."""
+    pos = 0
+    while len(line) - pos > size:
+        end = sentence_end = 0
+        for m in _BREAK.finditer(line, pos, pos + size):
+            end = m.end()
+            if m.group(1): sentence_end = end  # noqa: E701
+        end = sentence_end or end or pos + size
+        yield line[pos:end]
+        pos = end
+    yield line[pos:]
+
+
+def plain_chunks(source: Iterable[str], size: int) -> Iterator[Tuple[str, str]]:
+    """Packs the lines of the text into chunks of at most ``size`` characters. Longer lines are cut as they are read,
+    by ``_split_line()``.
+
+    :param source: Pieces of the text, e.g. the lines of a file.
+    :return: ``(TEXT, chunk)`` items.
+    """
+    parts, cnt, rest = [], 0, ''
+    for piece in chain(_pieces(source), [None]):
+        if piece is None:
+            lines, rest = [rest] if rest else [], ''
+        else:
+            *lines, rest = (rest + piece).split('\n')
+            lines = [line + '\n' for line in lines]
+        cut = []
+        if len(rest) > size:  # the start of a long line
+            *cut, rest = _split_line(rest, size)
+        for part in chain((part for line in lines for part in _split_line(line, size)), cut):
+            if parts and cnt + len(part) > size:
+                yield TEXT, ''.join(parts)
+                parts, cnt = [], 0
+            parts.append(part)
+            cnt += len(part)
+    if parts:
+        yield TEXT, ''.join(parts)
+
+
+def _html_tokens(source: Iterable[str], size: int) -> Iterator[Tuple[str, str, str]]:
+    """Yields the ``(kind, text, tag name)`` tokens of the HTML, kind being ``'start'``, ``'end'``, ``'void'``,
+    ``'text'``, ``'raw_text'`` (content of ``<script>``, ``<style>``...) or ``'other'`` (comments, doctype).
+    Long texts are yielded in pieces of about ``size``."""
+    buf = ''
+    raw_end, raw_kind, search_from = None, None, 0  # end of the raw text or comment being read, if any
+    pieces = _pieces(source)
+    eof = False
+    while not eof:
+        piece = next(pieces, None)
+        if piece is None:
+            eof = True
+        else:
+            buf += piece
+        pos = 0
+        while pos < len(buf):
+            if raw_end is not None:  # inside <script>, <style>... or a comment, yielded in pieces of about size
+                m = raw_end.search(buf, max(pos, search_from))
+                if m:
+                    end = m.end() if raw_kind == 'other' else m.start()  # the end tag is a token of its own
+                    raw_end = None
+                elif eof:
+                    end, raw_end = len(buf), None
+                else:  # all of it but what may be the start of its end, once long enough
+                    end = search_from = max(pos, len(buf) - len(raw_end.pattern) + 1)
+                    if end - pos < size:
+                        break
+                if end > pos: yield raw_kind, buf[pos:end], ''  # noqa: E701
+                pos = end
+                continue
+            if buf.startswith('<!--', pos):
+                raw_end, raw_kind, search_from = _COMMENT_END, 'other', pos + 4
+                continue
+            if buf.startswith('<!', pos) or buf.startswith('<?', pos):
+                end = buf.find('>', pos)
+                if end < 0 and not eof:
+                    break
+                end = len(buf) if end < 0 else end + 1
+                yield 'other', buf[pos:end], ''
+                pos = end
+                continue
+            m = _TAG.match(buf, pos) if buf[pos] == '<' else None
+            if m:
+                name = m.group(2).lower()
+                if m.group(1):
+                    yield 'end', m.group(), name
+                elif m.group(3) or name in _VOID_ELEMENTS:
+                    yield 'void', m.group(), name
+                else:
+                    yield 'start', m.group(), name
+                    if name in _RAW_TEXT_ELEMENTS:
+                        raw_end, raw_kind, search_from = _RAW_TEXT_ENDS[name], 'raw_text', m.end()
+                pos = m.end()
+            else:
+                if buf[pos] == '<' and not eof and len(buf) - pos < _MAX_TAG_LEN and '>' not in buf[pos:]:
+                    break  # might be an incomplete tag
+                end = buf.find('<', pos + 1)
+                if end < 0:
+                    if not eof and len(buf) - pos < size:
+                        break  # wait for the end of the text
+                    end = len(buf)
+                    if not eof:  # preferably cut at the end of a line
+                        end = buf.rfind('\n', pos, end) + 1 or end
+                yield 'text', buf[pos:end], ''
+                pos = end
+        buf, search_from = buf[pos:], max(0, search_from - pos)
+
+
+def html_chunks(source: Iterable[str], size: int) -> Iterator[Tuple[str, str]]:
+    """Splits the HTML into chunks of sibling nodes of about ``size`` characters.
+
+    An element longer than ``size`` is not a chunk by itself: its start and end tags are yielded as ``RAW`` chunks,
+    and its content is split in turn.
+
+    :param source: Pieces of the HTML, e.g. the lines of a file.
+    :return: ``(TEXT, chunk)`` and ``(RAW, markup)`` items.
+    """
+    chunker = _HtmlChunker(size)
+    for token in _html_tokens(source, size):
+        yield from chunker.feed(token)
+    yield from chunker.close()
+
+
+class _HtmlChunker(object):
+    def __init__(self, size: int):
+        self.size = size
+        self.tokens = []  # of the current chunk
+        self.length = 0
+        self.open = []  # names of the elements opened in the chunk and not closed yet
+        self.first_open = 0  # index in self.tokens of the outermost one
+        self.before_open = 0  # length of the tokens before it
+        self.outer = []  # names of the elements whose tags are output as RAW chunks
+
+    def _flush(self, end: int = None) -> List[Tuple[str, str]]:
+        tokens, self.tokens = self.tokens[:end], self.tokens[len(self.tokens) if end is None else end:]
+        self.length = sum(len(text) for _, text, _ in self.tokens)
+        text = ''.join(text for _, text, _ in tokens)
+        if not text:
+            return []
+        return [(TEXT if text.strip() else RAW, text)]
+
+    def feed(self, token: Tuple[str, str, str]) -> List[Tuple[str, str]]:
+        kind, text, name = token
+        if not self.open:
+            if kind == 'end' and name in self.outer:
+                while self.outer.pop() != name:
+                    pass
+                return self._flush() + [(RAW, text)]
+            if kind in ('end', 'raw_text', 'other'):  # stray end tag, or not to be translated
+                return self._flush() + [(RAW, text)]
+            if kind == 'start':
+                self.first_open, self.before_open = len(self.tokens), self.length
+                self.open.append(name)
+            return self._append(token)
+
+        if kind == 'start':
+            self.open.append(name)
+        elif kind == 'end' and name in self.open:
+            while self.open.pop() != name:
+                pass
+        chunks = self._append(token)
+        if self.open and self.length - self.before_open > self.size:
+            # the element being read is too long: output its start tag, and split its content
+            start_kind, start_text, start_name = self.tokens[self.first_open]
+            chunks += self._flush(self.first_open)
+            content, self.tokens, self.length = self.tokens[1:], [], 0
+            self.open = []
+            self.outer.append(start_name)
+            chunks.append((RAW, start_text))
+            for token in content:
+                chunks += self.feed(token)
+        return chunks
+
+    def _append(self, token: Tuple[str, str, str]) -> List[Tuple[str, str]]:
+        self.tokens.append(token)
+        self.length += len(token[1])
+        if not self.open and self.length >= self.size:
+            return self._flush()
+        return []
+
+    def close(self) -> List[Tuple[str, str]]:
+        return self._flush()
@@ -1,21 +1,99 @@
-import json
+import asyncio
 import logging
+import re
 import threading
-from itertools import count
-from time import sleep
-from typing import Tuple
+from concurrent.futures import Future
+from os import path
+from time import perf_counter
+from types import MappingProxyType
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, List, Tuple, TypeVar, Union
 
 import cld3
 from bs4 import BeautifulSoup
-from bs4.element import NavigableString, Tag
-from sqlitedict import SqliteDict
+from bs4.element import Doctype, NavigableString, Tag
 
+from niutranspy import metrics
+from niutranspy.cache import _LazyDict, _new_cache, _open_store
 from niutranspy.constants import _INLINE_ELEMENTS
 
 _caches = {}
 _old_caches = {}
+_detectors = {}
+_load_locks = {}  # (filename, from_lang, to_lang, mode, lru_size) -> lock held while loading the cache of the pair
 _log = logging.getLogger(__name__)
 _lock = threading.RLock()
+_NO_CACHE = MappingProxyType({})
+T = TypeVar('T')
+PARSERS = ('html.parser', 'lxml')
+_DOCUMENT_TAG = re.compile(r'<(html|head|body)[\s/>]', re.I)
+_DOCTYPE = re.compile(r'\s*<!doctype[^>]*>(\s+)', re.I)
+_SKIPPED = re.compile(r'<!--.*?-->|<(script|style)[\s>].*?</\1\s*>', re.I | re.S)  # where tags are text
+_parser = 'html.parser'
+
+
+def set_parser(name: str) -> None:
+    """Selects the parser of all the HTML handled by niutranspy, before translating anything.
+
+    ``'html.parser'`` (the default) is Python's pure-Python parser. ``'lxml'`` parses faster, and gives the
+    same translations for well-formed HTML, but repairs malformed HTML the way browsers do (e.g. ``<p>a<p>b``
+    becomes two paragraphs) and normalizes ``\\r\\n`` line endings. It falls back to ``'html.parser'`` when lxml
+    is not installed.
+
+    :param name: One of ``PARSERS``.
+    """
+    global _parser
+    assert name in PARSERS, f'Invalid parser: {name!r}'
+    if name == 'lxml':
+        try:
+            import lxml  # noqa: F401
+        except ImportError:
+            _log.warning('lxml is not installed, html.parser is used instead.')
+            name = 'html.parser'
+    _parser = name
+
+
+def get_parser() -> str:
+    """Returns the name of the parser selected by ``set_parser()``."""
+    return _parser
+
+
+def make_soup(markup: str) -> BeautifulSoup:
+    """Parses an HTML fragment with the selected parser.
+
+    :param markup: HTML string.
+    :return: BeautifulSoup object whose contents are the top level nodes of the fragment.
+    """
+    with metrics.timer('html_parse_seconds'):
+        return _make_soup(markup)
+
+
+def _make_soup(markup: str) -> BeautifulSoup:
+    if _parser == 'html.parser':
+        return BeautifulSoup(markup, 'html.parser')
+    soup = BeautifulSoup(markup, _parser)
+    # lxml wraps the fragment in <html><head>...</head><body>...</body></html>, and drops leading whitespace.
+    # The wrappers which are in the markup are kept.
+    html = soup.find('html', recursive=False)
+    if html is not None:
+        in_markup = {m.group(1).lower() for m in _DOCUMENT_TAG.finditer(_SKIPPED.sub('', markup))}
+        for part in html.find_all(['head', 'body'], recursive=False):
+            if part.name not in in_markup:
+                part.unwrap()
+        if 'html' not in in_markup:
+            html.unwrap()
+    doctype = _DOCTYPE.match(markup)
+    if doctype and soup.contents and isinstance(soup.contents[0], Doctype):
+        if type(soup.contents[0].next_sibling) is not NavigableString:
+            soup.contents[0].insert_after(doctype.group(1))  # dropped by lxml as well
+    lead = markup[:len(markup) - len(markup.lstrip())]
+    if lead:
+        first = soup.contents[0] if soup.contents else None
+        if type(first) is NavigableString:
+            if not first.startswith(lead):
+                first.replace_with(lead + first.lstrip())
+        else:
+            soup.insert(0, lead)
+    return soup
 
 
 def get_text_contents(soup) -> str:
@@ -35,23 +113,71 @@ def html_to_text(html_str: str) -> str:
     :param html_str: HTML string.
     :return: Text string.
     """
-    return get_text_contents(BeautifulSoup(html_str, 'html.parser'))
+    return get_text_contents(make_soup(html_str))
 
 
-def _load_dict(filename, from_lang, to_lang, cache_name):
-    dic = cache_name.setdefault(filename, {}).setdefault((from_lang, to_lang), {})
-    if not dic:
-        for k, v in SqliteDict(filename=filename, tablename='{}_{}'.format(from_lang, to_lang), autocommit=False,
-                               encode=json.dumps, decode=json.loads).items():
-            dic[k] = v
-        _log.info(f'Loaded {len(dic)} items')
-    return dic
+def serialized_len(node, lengths: Dict[int, int] = None) -> int:
+    """Returns ``len(str(node))`` for a Tag, or the length of a string as serialized in its Tag, in linear time.
+
+    :param node: BeautifulSoup node.
+    :param lengths: Lengths computed so far, by ``id()`` of the nodes.
+    :return: Length.
+    """
+    if lengths is None:
+        lengths = {}
+    length = lengths.get(id(node))
+    if length is None:
+        if not isinstance(node, Tag):
+            length = len(node.output_ready())
+        elif not node.contents:
+            length = len(str(node))
+        else:
+            length = len(str(Tag(name=node.name, attrs=node.attrs, prefix=node.prefix)))  # start and end tags
+            length += sum(serialized_len(sub, lengths) for sub in node.contents)
+        lengths[id(node)] = length
+    return length
+
+
+def _dict_key(from_lang, to_lang, mode, lru_size):
+    return from_lang, to_lang, mode, None if mode == 'eager' else lru_size
 
 
-def _load_dicts(filename, from_lang, to_lang):
+def _load_dict(filename, from_lang, to_lang, cache_name, mode='eager', lru_size=100000):
+    """Returns the cache of a language pair, loading it on first use.
+
+    Loaded caches are returned without locking. Loading a cache only holds the lock of its file and pair, so that
+    the other pairs can be used, or loaded, in the meantime. Translators using the same file with other settings
+    get caches of their own, which see the entries assigned to each other.
+    """
+    key = _dict_key(from_lang, to_lang, mode, lru_size)
+    dic = cache_name.get(filename, {}).get(key)
+    if dic is not None:
+        return dic
     with _lock:
-        return _load_dict(filename, from_lang, to_lang, _caches), _load_dict(filename + '.bak', from_lang, to_lang,
-                                                                             _old_caches)
+        load_lock = _load_locks.setdefault((filename,) + key, threading.Lock())
+    with load_lock:
+        dic = cache_name.get(filename, {}).get(key)
+        if dic is None:
+            with _lock:
+                sibling = next((c for k, c in cache_name.get(filename, {}).items() if k[:2] == key[:2]), None)
+            dic = _new_cache(filename, from_lang, to_lang, mode, lru_size, sibling)
+            with _lock:
+                cache_name.setdefault(filename, {})[key] = dic
+    return dic
+
+
+def _load_dicts(filename, from_lang, to_lang, mode='eager', lru_size=100000):
+    """Returns the cache of a language pair, and its old cache in the ``.bak`` file, empty if there is none."""
+    bak = filename + '.bak'
+    return (_load_dict(filename, from_lang, to_lang, _caches, mode, lru_size),
+            _load_dict(bak, from_lang, to_lang, _old_caches, mode, lru_size) if path.exists(bak) else _NO_CACHE)
+
+
+def _dicts_loaded(filename, from_lang, to_lang, mode='eager', lru_size=100000) -> bool:
+    """Whether ``_load_dicts()`` would return caches which are loaded already."""
+    key = _dict_key(from_lang, to_lang, mode, lru_size)
+    bak = filename + '.bak'
+    return key in _caches.get(filename, {}) and (key in _old_caches.get(bak, {}) or not path.exists(bak))
 
 
 def get_lang(s: str, proportion: float = 0.8) -> Tuple[bool, str]:
@@ -66,22 +192,149 @@ def get_lang(s: str, proportion: float = 0.8) -> Tuple[bool, str]:
     return r.is_reliable and r.proportion > proportion, r.language
 
 
-def _try_despite_of_errors(req_func, exception_classes, times: int = 4):
-    """Returns the req_func() despite of at most ``times`` requests connection errors.
-    :param req_func: Requests function.
-    :param exception_classes: Exception classes.
-    :param times: Maximum number of times.
-    :return: ``req_func``
+class _LangDetector(object):
+    """Memoizes ``get_lang()`` by normalized text, keeping the ``lru_size`` most recently used results in memory
+    and all of them in the ``lang`` table of a cache file.
+
+    Languages suggested for a text take precedence over detection, without being written to the cache file.
     """
-    assert times > 0
-    for i in count(1):
+
+    TABLE_NAME = 'lang'
+
+    def __init__(self, filename: str, lru_size: int = 100000, sibling: '_LangDetector' = None):
+        """
+        :param sibling: A detector of the same file, which sees the languages cached by this one and vice versa.
+        """
+        self._cache = _LazyDict(_open_store(filename, self.TABLE_NAME), lru_size, sibling and sibling._cache)
+        self._suggestions = {}
+        self._stats_lock = threading.Lock()
+        self.hits = self.misses = 0
+        self.detect_seconds = 0.0  # spent in cld3
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return ' '.join(text.split()).lower()
+
+    def suggest(self, text: str, lang: str) -> None:
+        self._suggestions[self.normalize(text)] = lang
+
+    def detect(self, text: str) -> Union[str, None]:
+        """Returns the language of a plain text, or None if it can't be reliably detected."""
+        return self.detect_many([text])[0]
+
+    def detect_many(self, texts: Iterable[str]) -> List[Union[str, None]]:
+        """Same as ``detect()`` for every text, detecting each distinct text at most once."""
+        keys = [self.normalize(text) for text in texts]
+        found, hits, elapsed = {}, 0, 0.0
+        for key in keys:
+            if key in found:
+                hits += 1
+                continue
+            lang = self._suggestions.get(key)
+            if lang is None:
+                lang = self._cache.get(key)
+            if lang is None:
+                t = perf_counter()
+                good, lang = get_lang(key)
+                t = perf_counter() - t
+                metrics.observe('lang_detection_seconds', t)
+                elapsed += t
+                if not good: lang = ''  # noqa: E701
+                self._cache[key] = lang
+            else:
+                hits += 1
+            found[key] = lang
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+            self.detect_seconds += elapsed
+        metrics.count('lang_detection_total', hits, result='hit')
+        metrics.count('lang_detection_total', len(keys) - hits, result='miss')
+        return [found[key] or None for key in keys]
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the hits and misses so far, the hit rate, the time spent detecting and an estimate of the time
+        saved by the hits, based on the average detection time."""
+        with self._stats_lock:
+            hits, misses, detect_seconds = self.hits, self.misses, self.detect_seconds
+        lookups = hits + misses
+        return {'hits': hits, 'misses': misses, 'hit_rate': hits / lookups if lookups else 0.0,
+                'detect_seconds': detect_seconds, 'saved_seconds': hits * detect_seconds / misses if misses else 0.0}
+
+
+def _load_detector(filename: str, lru_size: int = 100000) -> _LangDetector:
+    with _lock:
+        detector = _detectors.get((filename, lru_size))
+        if detector is None:
+            sibling = next((d for (f, _), d in _detectors.items() if f == filename), None)
+            detector = _detectors[(filename, lru_size)] = _LangDetector(filename, lru_size, sibling)
+        return detector
+
+
+class _SingleFlight(object):
+    """Runs one call at a time per key: the callers arriving while it runs wait for its result, or its error,
+    instead of making the same call."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> concurrent Future, or (event loop, key) -> asyncio Future
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            future = self._calls.get(key)
+            if future is None:
+                future = self._calls[key] = Future()
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            metrics.count('coalesced_total')
+            return future.result()
         try:
-            return req_func()
-        except exception_classes as e:
-            if i > times:
-                _log.fatal(f'Max attempts failed to reach the translation server: {str(e)}')
-                raise
-            sleep(10 * i)
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Same as ``do()``, for a coroutine function. Only the callers of the same event loop wait for each
+        other, and they make the call themselves if the caller making it is cancelled."""
+        loop_key = (asyncio.get_running_loop(), key)
+        with self._lock:
+            future = self._calls.get(loop_key)
+            if future is None:
+                future = self._calls[loop_key] = asyncio.get_running_loop().create_future()
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            metrics.count('coalesced_total')
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled(): raise  # noqa: E701
+            return await self.do_async(key, fn)
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # retrieved, in case no caller waits for it
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[loop_key]
 
 
 def _inline_sibling(n: Tag) -> bool:
@@ -0,0 +1,9 @@
+import pytest
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    """A cache directory holding an empty language suggestion file, as ``Translator`` requires."""
+    (tmp_path / 'translation').mkdir()
+    (tmp_path / 'translation' / 'suggestion.txt').write_text('')
+    return str(tmp_path)
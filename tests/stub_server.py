@@ -0,0 +1,164 @@
+"""A local stand-in of the NiuTrans ``translation`` and ``translationXML`` APIs.
+
+"Translating" prefixes every line of plain text, or every text node of XML text, with the target language,
+e.g. ``测试`` -> ``en:测试``. Requests beyond the QPS or characters per second limits, if any, get the ``10001``
+error code as NiuTrans does.
+
+It can be run on its own, e.g. to point a deployment at it::
+
+    python -m tests.stub_server --port 8000 --latency 0.05
+"""
+import argparse
+import json
+import random
+import re
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+from typing import Sequence
+from urllib.parse import parse_qs
+
+from niutranspy import Niutrans
+
+_TEXT_NODE = re.compile(r'(^|>)([^<]*[^<\s][^<]*)')
+
+
+def fake_translate(src_text: str, to_lang: str, is_xml: bool = False) -> str:
+    if is_xml:
+        return _TEXT_NODE.sub(lambda m: f'{m.group(1)}{to_lang}:{m.group(2)}', src_text)
+    return '\n'.join(f'{to_lang}:{line}' if line.strip() else line for line in src_text.split('\n'))
+
+
+class LocalNiutrans(Niutrans):
+    """Niutrans translating with ``fake_translate()`` in-process, without any HTTP request."""
+
+    def __init__(self, api_key='key', **kwargs):
+        super().__init__(api_key, **kwargs)
+
+    def _translate_base(self, api_url: str, src_text: str, from_lang: str, to_lang: str, cache) -> str:
+        return fake_translate(src_text.strip(), to_lang, api_url == self._xml_api_url)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.stats['connections'] += 1
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        src_text, to_lang = form['src_text'][0], form['to'][0]
+        server, stats = self.server, self.server.stats
+        with server.stats_lock:
+            stats['requests'] += 1
+            stats['chars'] += len(src_text)
+            stats['in_flight'] += 1
+            stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+            now, recent = monotonic(), server.recent
+            while recent and recent[0][0] <= now - 1:
+                recent.popleft()
+            recent.append((now, len(src_text)))
+            error_code = server.error_codes.popleft() if server.error_codes else None
+            if error_code is None and server.qps_limit and len(recent) > server.qps_limit:
+                error_code = '10001'
+            if error_code is None and server.chars_per_second and sum(n for _, n in recent) > server.chars_per_second:
+                error_code = '10001'
+            if error_code is None and server.error_rate and server.random.random() < server.error_rate:
+                error_code = server.random.choice(server.random_error_codes)
+            if error_code:
+                stats['errors'] += 1
+        sleep(server.latency)
+        with server.stats_lock:
+            stats['in_flight'] -= 1
+        if error_code:
+            data = {'error_code': error_code, 'error_msg': 'simulated error'}
+        else:
+            data = {'from': form['from'][0], 'to': to_lang,
+                    'tgt_text': fake_translate(src_text, to_lang, self.path.endswith('XML'))}
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # bursts of concurrent connections
+
+
+class StubServer(object):
+    """Serves the stand-in APIs on a local port, in a background thread.
+
+    :param latency: Seconds added to every request.
+    :param qps_limit: Maximum number of requests per second, beyond which the ``10001`` error code is returned.
+    :param chars_per_second: Maximum number of characters per second, beyond which ``10001`` is returned.
+    :param error_rate: Proportion of the requests answered with one of the ``error_codes``, drawn at random.
+    :param seed: Seed of the random errors.
+    :param port: Port to listen on, any free one by default.
+    """
+
+    def __init__(self, latency: float = 0.0, qps_limit: int = None, chars_per_second: int = None,
+                 error_rate: float = 0.0, error_codes: Sequence[str] = ('13008',), seed: int = 0, port: int = 0):
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.latency = latency
+        self._server.qps_limit = qps_limit
+        self._server.chars_per_second = chars_per_second
+        self._server.error_rate = error_rate
+        self._server.random_error_codes = list(error_codes)
+        self._server.random = random.Random(seed)
+        self._server.recent = deque()  # arrival times and lengths of the requests of the last second
+        self._server.error_codes = deque()
+        self._server.stats_lock = threading.Lock()
+        self._server.stats = {'connections': 0, 'requests': 0, 'chars': 0, 'errors': 0, 'in_flight': 0,
+                              'max_in_flight': 0}
+        self.url = f'http://127.0.0.1:{self._server.server_port}/NiuTransServer'
+        self.api_url = f'{self.url}/translation'
+        self.xml_api_url = f'{self.url}/translationXML'
+
+    def fail_next(self, *error_codes: str) -> None:
+        """Answers the next requests with these error codes, one each."""
+        with self._server.stats_lock:
+            self._server.error_codes.extend(error_codes)
+
+    @property
+    def stats(self) -> dict:
+        """Numbers of connections, requests, characters and errors so far, and of concurrent requests."""
+        with self._server.stats_lock:
+            return dict(self._server.stats)
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serves a local stand-in of the NiuTrans APIs.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--qps-limit', type=int)
+    parser.add_argument('--chars-per-second', type=int)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    with StubServer(args.latency, args.qps_limit, args.chars_per_second, args.error_rate, port=args.port) as server:
+        print(f'Serving {server.api_url} and {server.xml_api_url}, Ctrl+C to stop')
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
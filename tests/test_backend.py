@@ -0,0 +1,70 @@
+import threading
+from time import sleep
+
+import pytest
+
+from niutranspy.backend import _TranslationBackend
+
+
+class _UpperBackend(_TranslationBackend):
+    """Translates by upper-casing, failing on texts containing "fail"."""
+
+    def __init__(self, max_workers=1, delay=0.0):
+        super().__init__(max_workers)
+        self.delay = delay
+        self.calls = []
+        self.threads = set()
+
+    def is_disabled(self):
+        return False
+
+    @staticmethod
+    def max_translation_block_size():
+        return 20
+
+    def _pre_check(self, src_text, from_lang, to_lang, is_plain_str):
+        return None
+
+    def _translate(self, src_text):
+        self.calls.append(src_text)
+        self.threads.add(threading.current_thread().name)
+        sleep(self.delay)
+        if 'fail' in src_text:
+            raise ValueError(src_text)
+        return src_text.upper()
+
+    def _translate_plain_text(self, src_text, from_lang, to_lang, cache):
+        try:
+            return self._translate(src_text), None
+        except ValueError as e:
+            return '', e
+
+    def _translate_xml(self, src_text, from_lang, to_lang, cache):
+        return self._translate(src_text)
+
+
+_PLAIN = '\n'.join(f'line {i:02d} of text' for i in range(12))
+_XML = '\n'.join(f'<p>para {i}</p>' for i in range(12))
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_blocks_are_reassembled_in_order(max_workers):
+    backend = _UpperBackend(max_workers, delay=0.01)
+    assert backend(_PLAIN, 'en', 'zh', {}, True) == (_PLAIN.upper(), None)
+    assert backend(_XML, 'en', 'zh', {}, False) == (_XML.replace('para', 'PARA'), None)
+    assert len([c for c in backend.calls if c.strip()]) == 24
+
+
+def test_blocks_are_sent_concurrently():
+    backend = _UpperBackend(4, delay=0.05)
+    backend(_PLAIN, 'en', 'zh', {}, True)
+    assert len(backend.threads) > 1
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_first_error_is_returned(max_workers):
+    backend = _UpperBackend(max_workers)
+    text, err = backend(_PLAIN.replace('line 03', 'fail 03'), 'en', 'zh', {}, True)
+    assert text == '' and 'fail 03' in str(err)
+    text, err = backend(_XML.replace('para 3', 'fail 3'), 'en', 'zh', {}, False)
+    assert text == '' and 'fail 3' in str(err)
@@ -0,0 +1,195 @@
+import multiprocessing
+import sqlite3
+import threading
+from os import path
+from time import sleep
+
+import pytest
+
+from niutranspy import cache, cachetool, utils
+
+
+def _reload(filename, from_lang='zh', to_lang='en'):
+    utils._caches.pop(filename, None)
+    return utils._load_dict(filename, from_lang, to_lang, utils._caches)
+
+
+def test_flush_persists_new_entries(cache_dir):
+    filename = path.join(cache_dir, 'translation', 'cache.db')
+    dic = _reload(filename)
+    dic['测试'] = 'test'
+    dic['你好'] = 'hello'
+    assert dic.dirty_count() == 2
+    assert cache.flush_caches() >= 2
+    assert dic.dirty_count() == 0
+    assert dict(_reload(filename)) == {'测试': 'test', '你好': 'hello'}
+
+
+def test_loaded_entries_are_not_dirty(cache_dir):
+    filename = path.join(cache_dir, 'translation', 'cache.db')
+    _reload(filename)['测试'] = 'test'
+    cache.flush_caches()
+    dic = _reload(filename)
+    assert dic['测试'] == 'test'
+    assert dic.dirty_count() == 0
+
+
+def test_size_threshold_triggers_background_flush(cache_dir, monkeypatch):
+    monkeypatch.setattr(cache, 'FLUSH_SIZE', 10)
+    filename = path.join(cache_dir, 'translation', 'cache.db')
+    dic = _reload(filename)
+    for i in range(10):
+        dic[f'k{i}'] = f'v{i}'
+    expected = {f'k{i}': f'v{i}' for i in range(10)}
+    for _ in range(100):
+        if dict(dic.store.items()) == expected:
+            break
+        sleep(0.05)
+    assert dict(dic.store.items()) == expected
+
+
+def test_lazy_cache_reads_and_writes_through(cache_dir):
+    filename = path.join(cache_dir, 'translation', 'cache.db')
+    _reload(filename)['测试'] = 'test'
+    cache.flush_caches()
+
+    utils._caches.pop(filename, None)
+    dic = utils._load_dict(filename, 'zh', 'en', utils._caches, mode='lazy', lru_size=2)
+    assert dic.get('测试') == 'test'
+    assert '你好' not in dic
+    dic['你好'] = 'hello'
+    assert dic['你好'] == 'hello'
+    dic.get('a'), dic.get('b')  # evicts the unflushed entry from the LRU
+    assert dic.get('你好') == 'hello'
+    cache.flush_caches()
+    assert dict(dic.store.items()) == {'测试': 'test', '你好': 'hello'}
+
+
+def test_caches_of_other_settings_are_not_shared(cache_dir):
+    filename = path.join(cache_dir, 'translation', 'cache.db')
+    eager = _reload(filename)
+    lazy = utils._load_dict(filename, 'zh', 'en', utils._caches, mode='lazy', lru_size=2)
+    assert type(eager) is cache._WriteBehindDict and type(lazy) is cache._LazyDict and lazy.maxsize == 2
+    assert utils._load_dict(filename, 'zh', 'en', utils._caches, mode='lazy', lru_size=10).maxsize == 10
+    assert utils._load_dict(filename, 'zh', 'en', utils._caches, lru_size=10) is eager
+    assert utils._load_detector(filename, 2) is not utils._load_detector(filename, 10)
+
+
+def test_caches_of_other_modes_see_each_other(cache_dir):
+    filename = path.join(cache_dir, 'translation', 'cache.db')
+    eager = _reload(filename)
+    lazy = utils._load_dict(filename, 'zh', 'en', utils._caches, mode='lazy', lru_size=2)
+    assert lazy.get('你好') is None  # remembered as a miss
+    lazy['你好'] = 'hello'
+    eager['测试'] = 'test'
+    assert eager['你好'] == 'hello' and lazy['测试'] == 'test'
+    shared = utils._load_dict(filename, 'zh', 'en', utils._caches, mode='shared')
+    assert shared['你好'] == 'hello'  # pending, not flushed yet
+    assert cache.flush_caches() == 2
+    assert dict(eager.store.items()) == {'你好': 'hello', '测试': 'test'}
+    assert utils._load_detector(filename, 2)._cache._pending is utils._load_detector(filename, 10)._cache._pending
+
+
+def test_loading_a_pair_does_not_block_the_others(cache_dir, monkeypatch):
+    filename = path.join(cache_dir, 'translation', 'cache.db')
+    loaded = _reload(filename)
+    started, release = threading.Event(), threading.Event()
+    new_cache = utils._new_cache
+
+    def slow_new_cache(filename, from_lang, to_lang, *args):
+        if from_lang == 'ja':
+            started.set()
+            release.wait(5)
+        return new_cache(filename, from_lang, to_lang, *args)
+
+    monkeypatch.setattr(utils, '_new_cache', slow_new_cache)
+    loader = threading.Thread(target=utils._load_dicts, args=(filename, 'ja', 'en'))
+    loader.start()
+    assert started.wait(5)
+    assert utils._load_dicts(filename, 'zh', 'en')[0] is loaded
+    assert utils._load_dicts(filename, 'ko', 'en')[0] is not None
+    assert loader.is_alive()
+    release.set()
+    loader.join()
+    assert utils._load_dicts(filename, 'ja', 'en')[0] is not None
+
+
+def test_compact_merges_bak_and_keeps_translations(cache_dir):
+    filename = path.join(cache_dir, 'translation', 'cache.db')
+    cache._SqliteDictStore(filename, 'zh_en').update([('测试', 'test'), ('长文本', '很长的译文 ' * 100)])
+    cache._SqliteDictStore(filename + '.bak', 'zh_en').update([('测试', 'stale'), ('你好', 'hello')])
+    r = cache.compact(filename, merge_bak=True)
+    assert (r['entries'], r['merged']) == (3, 1)
+    assert cache.file_format(filename) == 'compact' and not path.exists(filename + '.bak')
+
+    expected = {'测试': 'test', '长文本': '很长的译文 ' * 100, '你好': 'hello'}
+    assert dict(_reload(filename)) == expected
+    utils._caches.pop(filename, None)
+    dic = utils._load_dict(filename, 'zh', 'en', utils._caches, mode='lazy')
+    assert dic.get('长文本') == expected['长文本'] and dic.get('再见') is None
+    dic['再见'] = 'bye'
+    cache.flush_caches()
+    assert dict(_reload(filename)) == dict(expected, 再见='bye')
+
+
+def test_compact_store_tells_hash_collisions_apart(cache_dir, monkeypatch):
+    monkeypatch.setattr(cache._CompactStore, '_hash', staticmethod(lambda key: 42))
+    store = cache._CompactStore(path.join(cache_dir, 'translation', 'cache.db'), 'zh_en')
+    store.update([('测试', 'test')])
+    assert store.get('测试') == 'test'
+    assert store.get('你好') is None
+
+
+def test_cachetool_export_and_import(cache_dir, tmp_path, capsys):
+    filename = path.join(cache_dir, 'translation', 'cache.db')
+    cache._SqliteDictStore(filename, 'zh_en').update([('测试', 'test')])
+    cache._SqliteDictStore(filename, 'lang').update([('测试', 'zh')])
+    assert cachetool.main(['export', cache_dir]) == 0
+    exported = tmp_path / 'cache.jsonl'
+    exported.write_text(capsys.readouterr().out, encoding='utf-8')
+
+    other_dir = tmp_path / 'other'
+    (other_dir / 'translation').mkdir(parents=True)
+    assert cachetool.main(['import', str(other_dir), str(exported)]) == 0
+    assert sorted(cache.export_items(str(other_dir / 'translation' / 'cache.db'))) == [
+        ('lang', '测试', 'zh'), ('zh_en', '测试', 'test')]
+
+
+def _write_shared(filename, keys):
+    dic = utils._load_dict(filename, 'zh', 'en', utils._caches, mode='shared')
+    for k in keys:
+        dic[k] = f'{k}:en'
+    for _ in range(100):  # written in the background within PUBLISH_INTERVAL
+        if not dic.dirty_count():
+            break
+        sleep(0.05)
+    assert dic.flush() == 0  # waits for the background flush, since multiprocessing skips atexit
+
+
+@pytest.mark.parametrize('fmt', [None, 'sqlitedict'])
+def test_shared_cache_sees_the_entries_of_other_processes(cache_dir, fmt):
+    filename = path.join(cache_dir, 'translation', 'cache.db')
+    utils._caches.pop(filename, None)
+    if fmt == 'sqlitedict':  # an existing cache file, which isn't compacted
+        cache._SqliteDictStore(filename, 'zh_en').update([('旧的', 'old')])
+    dic = utils._load_dict(filename, 'zh', 'en', utils._caches, mode='shared')
+    dic['测试'] = 'test'
+    assert dic.get('你好') is None
+    cache.flush_caches()
+
+    ctx = multiprocessing.get_context('fork')  # as prefork servers do, with the cache loaded in the parent
+    workers = [ctx.Process(target=_write_shared, args=(filename, [f'{i}-{j}' for j in range(100)] + ['你好']))
+               for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(10)
+        assert worker.exitcode == 0
+
+    assert cache.file_format(filename) == (fmt or 'compact')
+    conn = sqlite3.connect(filename)
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    conn.close()
+    assert dic.get('你好') == '你好:en' and dic.get('旧的') == ('old' if fmt else None)
+    assert all(dic.get(f'{i}-{j}') == f'{i}-{j}:en' for i in range(4) for j in range(100))
+    assert dic.dirty_count() == 0
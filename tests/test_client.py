@@ -0,0 +1,305 @@
+import asyncio
+import threading
+
+import pytest
+
+from niutranspy import AsyncNiutrans, Niutrans, Translator, client, utils
+from niutranspy.niutrans import aiohttp
+from stub_server import StubServer
+
+requires_aiohttp = pytest.mark.skipif(aiohttp is None, reason='AsyncNiutrans requires aiohttp')
+
+
+@pytest.fixture
+def server():
+    with StubServer() as server:
+        yield server
+
+
+def test_translate(cache_dir, server):
+    translator = Translator(cache_dir, Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url))
+    assert translator.translate('测试', 'en', 'zh') == 'en:测试'
+    assert translator.translate('<p class="x">测试 <b>你好</b></p>', 'en', 'zh') == '<p class="x">en:测试<b>en:你好</b></p>'
+    assert translator.translate('测试', 'en', 'zh') == 'en:测试'
+    assert server.stats['requests'] == 2  # '测试' is cached
+
+
+@requires_aiohttp
+def test_translate_async(cache_dir, server):
+    niutrans = AsyncNiutrans('key', max_in_flight=2, api_url=server.api_url, xml_api_url=server.xml_api_url)
+    translator = Translator(cache_dir, niutrans)
+    server._server.latency = 0.05
+    texts = [f'<div><p>段落 {i}</p><p>测试 {i}</p></div>' for i in range(5)]
+
+    async def run():
+        try:
+            assert await translator.translate_async('测试', 'en', 'zh') == 'en:测试'
+            return await translator.translate_many_async(texts + texts, 'en', 'zh')
+        finally:
+            await niutrans.aclose()
+
+    expected = [f'<div><p>en:段落 {i}</p><p>en:测试 {i}</p></div>' for i in range(5)]
+    assert asyncio.run(run()) == expected + expected
+    assert server.stats['requests'] == 11
+    assert server.stats['max_in_flight'] == 2
+    # the cache is shared with the synchronous API
+    assert translator.translate('<p>测试 3</p>', 'en', 'zh') == '<p>en:测试 3</p>'
+    assert server.stats['requests'] == 11
+
+
+@requires_aiohttp
+def test_async_sessions_are_closed_with_their_loop(cache_dir, server):
+    niutrans = AsyncNiutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url)
+    translator = Translator(cache_dir, niutrans)
+    sessions = []
+
+    async def run(text):
+        target_text = await translator.translate_async(text, 'en', 'zh')
+        sessions.append(niutrans._aio[asyncio.get_running_loop()][0])
+        return target_text
+
+    assert [asyncio.run(run(text)) for text in ('测试', '你好')] == ['en:测试', 'en:你好']  # without aclose()
+    assert sessions[0] is not sessions[1] and all(session.closed for session in sessions)
+
+    loop = asyncio.new_event_loop()
+    assert loop.run_until_complete(run('标题')) == 'en:标题'
+    assert not sessions[2].closed
+    loop.run_until_complete(loop.shutdown_asyncgens())
+    loop.close()
+    assert sessions[2].closed and niutrans._aio == {}
+
+
+def test_translate_async_with_a_blocking_backend(cache_dir, server):
+    translator = Translator(cache_dir, Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url))
+    assert asyncio.run(translator.translate_async('测试', 'en', 'zh')) == 'en:测试'
+
+
+@pytest.mark.parametrize('cache_mode', ['eager', 'lazy'])
+def test_translate_async_looks_up_off_the_loop(cache_dir, server, monkeypatch, cache_mode):
+    translator = Translator(cache_dir, Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url),
+                            cache_mode)
+    threads = []
+    for name in ('_plan', '_lookup'):
+        method = getattr(translator, name)
+        monkeypatch.setattr(translator, name, lambda *args, method=method: threads.append(
+            threading.current_thread() is threading.main_thread()) or method(*args))
+
+    on_loop = cache_mode == 'eager'  # once the cache of the pair is loaded, by the first lookup
+    assert asyncio.run(translator.translate_async('<p>测试</p>', 'en', 'zh')) == '<p>en:测试</p>'
+    assert asyncio.run(translator.translate_async('<p>测试</p>', 'en', 'zh')) == '<p>en:测试</p>'
+    assert asyncio.run(translator.translate_async('<p>你好</p>', 'en')) == '<p>en:你好</p>'
+    assert threads == [False, on_loop, on_loop, on_loop, True, False]  # the language is detected off the loop
+
+
+def test_concurrent_misses_make_a_single_call(cache_dir, server):
+    translator = Translator(cache_dir, Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url))
+    server._server.latency = 0.2
+    barrier, results, errors = threading.Barrier(8), [], []
+
+    def translate(text):
+        barrier.wait()
+        try:
+            results.append(translator.translate(text, 'en', 'zh'))
+        except Exception as e:
+            errors.append(e)
+
+    def burst(text):
+        threads = [threading.Thread(target=translate, args=(text,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    burst('<header>网站标题</header>')
+    assert results == ['<header>en:网站标题</header>'] * 8 and not errors
+    assert server.stats['requests'] == 1
+
+    server.fail_next('20001')  # a fatal error, shared by the callers waiting for it
+    results.clear()
+    burst('页脚')
+    assert not results and len(errors) == 8 and len(set(map(str, errors))) == 1
+    assert server.stats['requests'] == 2
+    assert translator.translate('页脚', 'en', 'zh') == 'en:页脚'
+
+
+@requires_aiohttp
+def test_concurrent_async_misses_make_a_single_call(cache_dir, server):
+    niutrans = AsyncNiutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url)
+    translator = Translator(cache_dir, niutrans)
+    server._server.latency = 0.1
+
+    async def run():
+        try:
+            return await asyncio.gather(*(translator.translate_async('网站标题', 'en', 'zh') for _ in range(8)))
+        finally:
+            await niutrans.aclose()
+
+    assert asyncio.run(run()) == ['en:网站标题'] * 8
+    assert server.stats['requests'] == 1
+
+
+def test_fast_paths(cache_dir, server, monkeypatch):
+    translator = Translator(cache_dir, Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url))
+    assert translator.translate('测试', 'en', 'zh') == 'en:测试'
+
+    def make_soup(markup):
+        raise AssertionError(f'{markup!r} is parsed')
+
+    monkeypatch.setattr(client, 'make_soup', make_soup)
+    monkeypatch.setattr(utils, 'make_soup', make_soup)
+    assert translator.translate('测试', 'en', 'zh') == 'en:测试'  # looked up before parsing
+    assert translator.translate('新的 > 文本', 'en') == 'en:新的 > 文本'  # plain text
+    for text in (' 2020-08-04 ', '（— ※ —）', '3.14'):  # no letters, nothing to translate
+        assert translator.translate(text, 'en') == text
+        assert translator.translate(text, 'zh', 'en') == text
+    assert server.stats['requests'] == 2
+    monkeypatch.undo()
+    # the content of <script> isn't translated, and <p>2020</p> is left as it is
+    text = '<script>var a = "中文";</script><p>正文</p><p>2020</p>'
+    assert translator.translate(text, 'en') == '<p>en:正文</p><p>2020</p>'
+    assert server.stats['requests'] == 3
+
+
+def test_suggestions_of_texts_without_letters(cache_dir, server):
+    with open(f'{cache_dir}/translation/suggestion.txt', 'w') as f:
+        f.write('X "|"\nX "»"\n= "※"\n')
+    translator = Translator(cache_dir, Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url))
+    assert translator.translate('»', 'en') == ''
+    assert translator.translate(' ※ ', 'en') == '※'
+    assert translator.translate('<p>正文</p>|<p>标题</p>', 'en') == '<p>en:正文</p><p>en:标题</p>'
+    assert translator.translate('<p>正文</p>\n»\n<p>2020</p>', 'en') == '<p>en:正文</p><p>2020</p>'
+    assert translator.translate('»', 'en', 'zh') == '»'  # suggestions apply to detected languages only
+
+
+def test_translate_many(cache_dir, server):
+    translator = Translator(cache_dir, Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url))
+    texts = [f'项目 {i % 50}' for i in range(500)] + ['第一行\n第二行', '<p>段落<b>粗体</b></p>', '  项目 1  ', '123']
+    expected = ([f'en:项目 {i % 50}' for i in range(500)] +
+                ['en:第一行\nen:第二行', '<p>en:段落<b>en:粗体</b></p>', 'en:项目 1', '123'])
+    assert translator.translate_many(texts, 'en', 'zh') == expected
+    assert server.stats['requests'] == 2  # one for the plain texts, one for <b>
+    assert translator.translate(texts[0], 'en', 'zh') == expected[0]
+    assert server.stats['requests'] == 2
+
+
+def test_translate_many_retries_the_failed_block_only(cache_dir, server, monkeypatch):
+    monkeypatch.setattr(Niutrans, 'max_translation_block_size', staticmethod(lambda: 50))
+    translator = Translator(cache_dir, Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url))
+    texts = [f'文本 {i:02}' for i in range(20)]  # 6 characters per line: blocks of 8, 8 and 4 texts
+    server.fail_next('20001')
+    assert translator.translate_many(texts, 'en', 'zh') == [f'en:{text}' for text in texts]
+    assert server.stats['requests'] == 3 + 8  # the texts of the failed block are sent one by one
+    blocks = [texts[:8], texts[8:16], texts[16:]]
+    assert server.stats['chars'] == sum(len('\n'.join(block)) for block in blocks) + sum(map(len, texts[:8]))
+
+
+def test_translate_many_leaves_undetected_texts_alone(cache_dir, server, monkeypatch):
+    get_lang = utils.get_lang
+    monkeypatch.setattr(utils, 'get_lang', lambda s: (False, 'en') if 'xyzzy' in s else get_lang(s))
+    translator = Translator(cache_dir, Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url))
+    texts = ['测试', 'xyzzy plugh', '<p>你好</p><p>xyzzy</p>', '<p>标题</p>']
+    assert translator.translate_many(texts, 'en') == ['en:测试', 'xyzzy plugh', '<p>你好</p><p>xyzzy</p>',
+                                                      '<p>en:标题</p>']
+    assert server.stats['requests'] == 1
+    with pytest.raises(ValueError):
+        translator.translate(texts[1], 'en')
+
+
+def test_language_detection_is_cached(cache_dir, server, monkeypatch):
+    from niutranspy import utils
+    with open(f'{cache_dir}/translation/suggestion.txt', 'w') as f:
+        f.write('ja "<b>東京</b>"\n')
+    calls = []
+    get_lang = utils.get_lang
+    monkeypatch.setattr(utils, 'get_lang', lambda s: calls.append(s) or get_lang(s))
+    translator = Translator(cache_dir, Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url))
+    assert translator.detect_many(['测试', 'Hello  World', '<p>测试</p>', 'hello world', '东京', '  東京 ', '12']) == \
+        ['zh', 'en', 'zh', 'en', 'zh', 'ja', None]
+    assert translator.translate('<p>测试</p>', 'en') == '<p>en:测试</p>'
+    assert calls == ['测试', 'hello world', '东京', '12']
+    assert translator.detection_stats()['hits'] == 4
+
+    translator.flush()
+    utils._detectors.clear()
+    translator = Translator(cache_dir, Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url))
+    assert translator.detect_many(['测试', '12']) == ['zh', None]
+    assert len(calls) == 4
+    assert translator.detection_stats()['hit_rate'] == 1.0
+
+
+def test_sentences():
+    from niutranspy.client import _sentences
+    assert _sentences(' Hello  world. 3.14 is pi!你好。“好。”再见') == ['Hello world.', '3.14 is pi!你好。', '“好。”', '再见']
+    assert _sentences('  ') == []
+
+
+def test_segments_mode(cache_dir, server):
+    translator = Translator(cache_dir, Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url),
+                            segments=True)
+    assert translator.translate('第一句。第二句。\n\n第三句！', 'en', 'zh') == 'en:第一句。 en:第二句。\n\nen:第三句！'
+    assert server.stats['requests'] == 1
+    chars = server.stats['chars']
+
+    # only the edited sentence is sent
+    assert translator.translate('第一句。第二句改了。\n第三句！', 'en', 'zh') == 'en:第一句。 en:第二句改了。\nen:第三句！'
+    assert (server.stats['requests'], server.stats['chars']) == (2, chars + len('第二句改了。'))
+    assert translator.translate('<div><p>第三句！第一句。</p>第二句。</div>', 'en', 'zh') == \
+        '<div><p>en:第三句！ en:第一句。</p>en:第二句。</div>'
+    assert translator.translate_many(['第一句。新句子。', '新句子。第三句！'], 'en', 'zh') == \
+        ['en:第一句。 en:新句子。', 'en:新句子。 en:第三句！']
+    assert server.stats['requests'] == 3
+
+    # sentences without anything to translate aren't sent, and traditional Chinese is cached as simplified
+    chars = server.stats['chars']
+    assert translator.translate('第一句。2020。OK then. 第五句。', 'en', 'zh') == 'en:第一句。 2020。 OK then. en:第五句。'
+    assert translator.translate('<p>第一句。這個。</p>', 'en', 'zh') == '<p>en:第一句。 en:这个。</p>'
+    assert (server.stats['requests'], server.stats['chars']) == (5, chars + len('第五句。这个。'))
+    assert translator.translate('这个。第五句。', 'en', 'zh') == 'en:这个。 en:第五句。'
+    assert server.stats['requests'] == 5
+
+
+@requires_aiohttp
+def test_segments_mode_async(cache_dir, server):
+    niutrans = AsyncNiutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url)
+    translator = Translator(cache_dir, niutrans, segments=True)
+    assert translator.translate('第一句。', 'en', 'zh') == 'en:第一句。'
+
+    async def run():
+        try:
+            return await translator.translate_async('<div><p>第四句 &amp; 第一句。</p></div>', 'en', 'zh')
+        finally:
+            await niutrans.aclose()
+
+    assert asyncio.run(run()) == '<div><p>en:第四句 &amp; 第一句。</p></div>'
+    assert server.stats['requests'] == 2  # only the new sentence is sent
+
+
+def test_warm_up_cli(cache_dir, server, tmp_path, capsys):
+    from niutranspy.__main__ import main
+    corpus = tmp_path / 'corpus.jsonl'
+    corpus.write_text('\n'.join(['{"text": "测试"}', '"你好"', '{"text": "测试"}', '{"id": 1}', '"2020"',
+                                 '"<p>你好 <b>世界</b></p>"']), encoding='utf-8')
+    (tmp_path / 'titles.csv').write_text('id,text\n1,世界\n2,标题\n', encoding='utf-8')
+    translator = Translator(cache_dir, Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url))
+    translator.translate('测试', 'en', 'zh')
+    assert translator.uncached('<p>测试 <b>世界</b></p>', 'en', 'zh') == ['<b>世界</b>']
+
+    checkpoint = tmp_path / 'checkpoint.json'
+    argv = ['--to', 'en', '--from', 'zh', '--api-key', 'key', '--api-url', server.api_url, '--xml-api-url',
+            server.xml_api_url, '--checkpoint', str(checkpoint), cache_dir, str(corpus), str(tmp_path / 'titles.csv')]
+    assert main(argv + ['--dry-run', '--price', '10']) == 0
+    assert '7 texts read: 1 duplicates, 2 cached, 0 of unknown language, 0/4 translated' in capsys.readouterr().err
+    assert server.stats['requests'] == 1
+
+    assert main(argv) == 0
+    assert '7 texts read: 1 duplicates, 2 cached, 0 of unknown language, 4/4 translated (0 failed)' in \
+        capsys.readouterr().err
+    assert not checkpoint.exists()
+    requests = server.stats['requests']
+    assert translator.translate_many(['你好', '<p>你好 <b>世界</b></p>', '标题'], 'en', 'zh') == \
+        ['en:你好', '<p>en:你好<b>en:世界</b></p>', 'en:标题']
+    assert server.stats['requests'] == requests
+
+    checkpoint.write_text('{"inputs": ["other.txt"], "to_lang": "en", "from_lang": "zh", "position": 1}')
+    with pytest.raises(SystemExit):
+        main(argv)
@@ -0,0 +1,73 @@
+import logging
+
+import pytest
+
+from niutranspy import Niutrans, Translator, metrics
+from stub_server import StubServer
+
+
+@pytest.fixture
+def sink():
+    sink = metrics.add_sink(metrics.PrometheusSink())
+    yield sink
+    metrics.remove_sink(sink)
+
+
+def test_disabled_by_default():
+    assert not metrics.enabled
+    assert metrics.timer('html_parse_seconds') is metrics._NULL_TIMER
+
+
+def test_translation_stages_are_recorded(cache_dir, sink):
+    with StubServer() as server:
+        translator = Translator(cache_dir, Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url))
+        translator.translate('<p>測試</p>', 'en')
+        translator.translate('<p>測試</p>', 'en')
+    counters, histograms = sink.snapshot()
+    assert counters[('cache_lookups_total', (('result', 'miss'),))] == 1
+    assert counters[('cache_lookups_total', (('result', 'hit'),))] == 1
+    assert counters[('lang_detection_total', (('result', 'hit'),))] == 1
+    assert counters[('translations_total', (('kind', 'plain'),))] == 1
+    for name in ('html_parse_seconds', 'lang_detection_seconds', 'opencc_seconds'):
+        assert sum(histograms[(name, ())][0]) >= 1
+    assert sum(histograms[('api_request_seconds', (('api', 'plain'),))][0]) == 1
+
+    text = sink.render()
+    assert '# TYPE niutranspy_cache_lookups_total counter\n' in text
+    assert 'niutranspy_cache_lookups_total{result="hit"} 1\n' in text
+    assert 'niutranspy_api_request_seconds_bucket{api="plain",le="+Inf"} 1\n' in text
+    assert 'niutranspy_api_request_seconds_count{api="plain"} 1\n' in text
+
+
+def test_cache_lookups_of_cached_html(cache_dir, sink):
+    translator = Translator(cache_dir, Niutrans('key'))  # not called: the translations are cached
+    translator.suggest('zh', 'en', '测试', 'test')
+    translator.suggest('zh', 'en', '<b>你好</b>', '<b>hello</b>')
+    for _ in range(10):
+        assert translator.translate('<p>测试<b>你好</b></p>', 'en', 'zh') == '<p>test<b>hello</b></p>'
+    counters = sink.snapshot()[0]
+    assert counters[('cache_lookups_total', (('result', 'hit'),))] == 20
+    assert ('cache_lookups_total', (('result', 'miss'),)) not in counters
+
+
+def test_api_errors_are_counted():
+    records = []
+    sink = metrics.add_sink(metrics.CallbackSink(lambda *args: records.append(args)))
+    try:
+        with pytest.raises(ValueError):
+            Niutrans._target_text('测试', {'error_code': '13001', 'error_msg': 'limit'}, 'plain')
+    finally:
+        metrics.remove_sink(sink)
+    assert records == [('counter', 'api_errors_total', 1, (('api', 'plain'), ('error', '13001')))]
+
+
+def test_logging_sink(caplog):
+    sink = metrics.add_sink(metrics.LoggingSink(interval=0))
+    try:
+        with caplog.at_level(logging.INFO, logger='niutranspy.metrics'):
+            metrics.count('cache_lookups_total', result='hit')
+            metrics.observe('html_parse_seconds', 0.002)
+    finally:
+        metrics.remove_sink(sink)
+    assert 'cache_lookups_total{result="hit"}=1' in caplog.text
+    assert 'html_parse_seconds: 1 in 0.002 s' in caplog.text
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from niutranspy import Niutrans, Scheduler
+from stub_server import StubServer
+
+
+@pytest.fixture
+def server():
+    with StubServer() as server:
+        yield server
+
+
+def _niutrans(server, **kwargs):
+    return Niutrans('key', api_url=server.api_url, xml_api_url=server.xml_api_url, **kwargs)
+
+
+def test_translate(server):
+    niutrans = _niutrans(server)
+    assert niutrans('测试\n你好', 'zh', 'en', {}, True) == ('en:测试\nen:你好', None)
+    assert niutrans('<p>测试</p>', 'zh', 'en', {}, False) == ('<p>en:测试</p>', None)
+
+
+def test_connections_are_reused(server):
+    niutrans = _niutrans(server)
+    for i in range(20):
+        assert niutrans(f'测试 {i}', 'zh', 'en', {}, True)[0] == f'en:测试 {i}'
+    assert server.stats['requests'] == 20
+    assert server.stats['connections'] == 1
+
+
+def test_session_is_shared_between_threads(server):
+    niutrans = _niutrans(server, pool_size=4)
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda i: niutrans(f'测试 {i}', 'zh', 'en', {}, True)[0], range(100)))
+    assert results == [f'en:测试 {i}' for i in range(100)]
+    assert server.stats['connections'] <= 4
+
+
+def test_stub_server_limits_and_errors():
+    with StubServer(error_rate=0.5, seed=1) as server:
+        niutrans = _niutrans(server, scheduler=Scheduler(max_attempts=1, failure_threshold=0))
+        errors = sum(1 for i in range(100) if niutrans(f'测试 {i}', 'zh', 'en', {}, True)[1])
+        assert 30 < errors < 70 and server.stats['errors'] == errors
+    with StubServer(chars_per_second=20) as server:
+        niutrans = _niutrans(server, scheduler=Scheduler(max_attempts=1, failure_threshold=0))
+        results = [niutrans('测试' * 5, 'zh', 'en', {}, True) for _ in range(3)]
+        assert [err is None for _, err in results] == [True, True, False]
@@ -0,0 +1,126 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+
+import pytest
+
+from niutranspy import AsyncNiutrans, Niutrans
+from niutranspy.niutrans import aiohttp
+from niutranspy.scheduler import CircuitOpenError, Scheduler
+from stub_server import StubServer
+
+requires_aiohttp = pytest.mark.skipif(aiohttp is None, reason='AsyncNiutrans requires aiohttp')
+
+
+@pytest.fixture
+def server():
+    with StubServer() as server:
+        yield server
+
+
+def _niutrans(server, cls=Niutrans, **kwargs):
+    return cls('key', api_url=server.api_url, xml_api_url=server.xml_api_url, scheduler=Scheduler(**kwargs))
+
+
+def _translate_all(niutrans, n, threads=8):
+    with ThreadPoolExecutor(threads) as executor:
+        return list(executor.map(lambda i: niutrans(f'测试 {i}', 'zh', 'en', {}, True), range(n)))
+
+
+def test_retryable_errors_are_retried(server):
+    niutrans = _niutrans(server, base_delay=0.01)
+    server.fail_next('10001', '13008')
+    assert niutrans('测试', 'zh', 'en', {}, True) == ('en:测试', None)
+    assert server.stats['requests'] == 3
+
+
+def test_fatal_errors_are_not_retried(server):
+    niutrans = _niutrans(server, base_delay=0.01)
+    server.fail_next('13001')
+    text, err = niutrans('测试', 'zh', 'en', {}, True)
+    assert text == '' and '13001' in str(err)
+    assert server.stats['requests'] == 1
+
+
+def test_attempts_are_limited(server):
+    niutrans = _niutrans(server, base_delay=0.01, max_attempts=3)
+    server.fail_next(*['10001'] * 5)
+    text, err = niutrans('测试', 'zh', 'en', {}, True)
+    assert text == '' and '10001' in str(err)
+    assert server.stats['requests'] == 3
+
+
+def test_token_bucket_keeps_under_the_qps_limit():
+    with StubServer(qps_limit=50) as server:
+        results = _translate_all(_niutrans(server, qps=40, burst_seconds=0.1), 40)
+        assert all(err is None for _, err in results)
+        assert server.stats['errors'] == 0
+
+
+def test_rate_adapts_to_throttling():
+    with StubServer(qps_limit=20) as server:
+        niutrans = _niutrans(server, qps=80, base_delay=0.05, max_attempts=10)
+        results = _translate_all(niutrans, 30)
+        assert all(err is None for _, err in results)
+        assert server.stats['errors'] > 0
+        assert niutrans._scheduler._buckets[0][0].rate < 80
+
+
+def test_callers_are_queued(server):
+    server._server.latency = 0.02
+    results = _translate_all(_niutrans(server, max_in_flight=2), 16)
+    assert all(err is None for _, err in results)
+    assert server.stats['max_in_flight'] == 2
+
+
+def test_circuit_breaker():
+    scheduler = Scheduler(max_attempts=1, failure_threshold=2, reset_timeout=0.1)
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise ConnectionError()
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            scheduler.call(fail, 1, (ConnectionError,))
+    with pytest.raises(CircuitOpenError):
+        scheduler.call(fail, 1, (ConnectionError,))
+    assert len(calls) == 2
+
+    sleep(0.1)
+    assert scheduler.call(lambda: {'tgt_text': 'ok'}, 1, (ConnectionError,)) == {'tgt_text': 'ok'}
+    assert scheduler.call(lambda: {'tgt_text': 'ok'}, 1, (ConnectionError,)) == {'tgt_text': 'ok'}
+
+
+def test_circuit_breaker_trial_raising_an_unexpected_exception():
+    scheduler = Scheduler(max_attempts=1, failure_threshold=1, reset_timeout=0.05)
+
+    def fail():
+        raise ConnectionError()
+
+    def invalid_response():  # e.g. the HTML page of a 502 error
+        return json.loads('<html>Bad Gateway</html>')
+
+    with pytest.raises(ConnectionError):
+        scheduler.call(fail, 1, (ConnectionError,))
+    sleep(0.05)
+    with pytest.raises(json.JSONDecodeError):
+        scheduler.call(invalid_response, 1, (ConnectionError,))
+    assert scheduler.call(lambda: {'tgt_text': 'ok'}, 1, (ConnectionError,)) == {'tgt_text': 'ok'}
+
+
+@requires_aiohttp
+def test_async_retries(server):
+    niutrans = _niutrans(server, AsyncNiutrans, base_delay=0.01)
+    server.fail_next('10001')
+
+    async def run():
+        try:
+            return await niutrans.call_async('测试', 'zh', 'en', {}, True)
+        finally:
+            await niutrans.aclose()
+
+    assert asyncio.run(run()) == ('en:测试', None)
+    assert server.stats['requests'] == 2
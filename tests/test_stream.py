@@ -0,0 +1,71 @@
+import pytest
+
+from niutranspy import Niutrans, Translator
+from niutranspy.stream import RAW, TEXT, html_chunks, plain_chunks
+from stub_server import LocalNiutrans
+
+_DOC = ('<!DOCTYPE html>\n<html><head><title>标题</title><script>if (a<b) x="</div>";</script></head><body>\n'
+        + ''.join(f'<p class="x">段落 {i} <b>粗体</b></p>\n' for i in range(50))
+        + '<div>' + ''.join(f'<li>项目 {i}</li>' for i in range(30)) + '</div><!-- 注释 -->尾部</body></html>\n')
+
+
+def _split(text, n):
+    return [text[i:i + n] for i in range(0, len(text), n)]
+
+
+@pytest.mark.parametrize('size', [50, 300, 100000])
+@pytest.mark.parametrize('piece_len', [1, 7, 100000])
+def test_html_chunks(size, piece_len):
+    chunks = list(html_chunks(_split(_DOC, piece_len), size))
+    assert ''.join(chunk for _, chunk in chunks) == _DOC
+    assert all(len(chunk) <= 2 * size for kind, chunk in chunks if kind == TEXT)
+    assert (RAW, '<script>') not in chunks or (RAW, 'if (a<b) x="</div>";') in chunks
+    if size < len(_DOC):
+        assert (RAW, '<!-- 注释 -->') in chunks
+
+
+def test_long_raw_text_is_chunked():
+    lines = (['<div><script>\n'] + [f'x{i} = "<b>{i}</b>";\n' for i in range(5000)] + ['</SCRIPT><!--\n']
+             + [f'comment {i}\n' for i in range(5000)] + ['--><p>后</p></div>'])
+    chunks = list(html_chunks(iter(lines), 1000))
+    assert ''.join(chunk for _, chunk in chunks) == ''.join(lines)
+    assert all(len(chunk) < 1100 for _, chunk in chunks)
+    assert chunks[-3:] == [(RAW, chunks[-3][1]), (TEXT, '<p>后</p>'), (RAW, '</div>')] and chunks[-3][1].endswith('-->')
+
+
+@pytest.mark.parametrize('piece_len', [1, 13, 100000])
+def test_plain_chunks(piece_len):
+    text = ''.join(f'line {i}\n' for i in range(1000))
+    chunks = list(plain_chunks(_split(text, piece_len), 100))
+    assert ''.join(chunk for _, chunk in chunks) == text
+    assert all(kind == TEXT and len(chunk) <= 100 for kind, chunk in chunks)
+    assert list(plain_chunks(['a\nb', 'c\n\nd'], 3)) == [(TEXT, 'a\n'), (TEXT, 'bc\n'), (TEXT, '\nd')]
+
+
+def test_long_lines_are_cut():
+    pieces = ['句子。' * 100] * 30 + ['Some words. ' * 500, 'x' * 12000]  # without any newline
+    chunks = [chunk for _, chunk in plain_chunks(iter(pieces), 5000)]
+    assert ''.join(chunks) == ''.join(pieces)
+    assert all(len(chunk) <= 5000 for chunk in chunks)
+    assert chunks[0].endswith('。') and all(chunk.endswith('. ') for chunk in chunks[1:4])  # at sentence ends
+    assert [len(chunk) for chunk in chunks[4:]] == [5000, 5000, 2000]
+
+
+def test_translate_stream(cache_dir):
+    translator = Translator(cache_dir, LocalNiutrans())
+    plain = (f'第 {i} 行\n' for i in range(3000))
+    assert ''.join(translator.translate_stream(plain, 'en', 'zh', html=False)) == \
+        ''.join(f'en:第 {i} 行\n' for i in range(3000))
+
+    html = ['<html><body>\n'] + [f'<p class="x">段落 {i} <b>粗体</b></p>\n' for i in range(300)] + ['</body></html>']
+    translated = ''.join(translator.translate_stream(iter(html), 'en', 'zh', lookahead=2, max_workers=2))
+    assert translated.startswith('<html><body>\n<p class="x">en:段落 0 <b>en:粗体</b></p><p class="x">en:段落 1 ')
+    assert translated.endswith('<b>en:粗体</b></p>\n</body></html>')
+    assert translated.count('en:') == 600
+
+
+def test_translate_stream_disabled(cache_dir):
+    translator = Translator(cache_dir, Niutrans(''))
+    text = ''.join(f'第 {i} 行\n' for i in range(3000))
+    assert ''.join(translator.translate_stream(_split(text, 100), 'en', 'zh', html=False)) == text
+    assert ''.join(translator.translate_stream(_split(_DOC, 100), 'en', 'zh')) == _DOC
@@ -0,0 +1,75 @@
+import pytest
+
+from niutranspy import Translator, utils
+from stub_server import LocalNiutrans
+
+# Translated the same way whatever the parser
+_CORPUS = [
+    '纯文本，没有标签',
+    '纯文本 &amp; 实体 &lt;b&gt; &nbsp;空格',
+    '   前后空格   ',
+    '<p class="a b" id="x">你好 <b>世界</b> 再见</p>',
+    '<div><p>第一段</p>\n<p>第二段 <a href="/x?a=1&amp;b=2">链接</a></p><img src="a.png"><br></div>',
+    '<ul>\n  <li>一</li>\n  <li>二 <span> 三 </span> 四</li>\n</ul>',
+    '<table><tr><td>单元格</td><td> <i>斜体</i> </td></tr></table>',
+    '<!-- 注释 --><p>后面</p>',
+    '<script>if (a < b) { x = "中文"; }</script><p>正文</p>',
+    '<pre>  预格式  \n  文本 </pre>',
+    '<p>  <b>粗</b>  <i>斜</i>  </p>\n',
+    ' <b>开头的空格</b>尾巴',
+    '<title>标题</title><meta charset="utf-8"><h1>头</h1>',
+    '<div><h1>标题</h1>\n' + ''.join(f'<p>第 {i} 段<em>强调</em>。</p>\n' for i in range(200)) + '</div>',
+    '<span>内联<div>块</div>内联</span>',
+    '<p>未闭合',
+    '<label>标签<input type="text" value="值"></label><button>按钮</button>',
+    '<body><p>正文</p></body>',
+    '<html lang="zh"><head><title>标题</title></head><body><p>正文</p></body></html>',
+    '<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>标题</title></head>\n<body class="x">\n<p>正文</p>\n'
+    '<script>document.write("<body>");</script>\n</body>\n</html>\n',
+    '<script>var s = "<html><body>";</script><p>正文</p>',
+]
+# Malformed HTML, which lxml repairs the way browsers do
+_DIVERGENT = [
+    '<p>一<p>二',
+    '<p><div>块</div></p>',
+    '<ul><li>一<li>二</ul>',
+    '第一行\r\n第二行',
+]
+
+
+@pytest.fixture
+def parser():
+    pytest.importorskip('lxml')
+    yield
+    utils.set_parser('html.parser')
+
+
+def _translate_all(cache_dir, corpus, parser_name):
+    utils.set_parser(parser_name)
+    utils._caches.clear()
+    translator = Translator(cache_dir, LocalNiutrans())
+    return [translator.translate(text, 'en', 'zh') for text in corpus]
+
+
+@pytest.mark.parametrize('text', _CORPUS)
+def test_parsers_build_the_same_tree(parser, text):
+    utils.set_parser('lxml')
+    assert utils.make_soup(text).decode() == utils.BeautifulSoup(text, 'html.parser').decode()
+
+
+def test_parsers_translate_the_same_way(parser, cache_dir):
+    assert _translate_all(cache_dir, _CORPUS, 'lxml') == _translate_all(cache_dir, _CORPUS, 'html.parser')
+
+
+@pytest.mark.parametrize('text', _DIVERGENT)
+def test_parsers_repair_malformed_html_differently(parser, text):
+    utils.set_parser('lxml')
+    assert utils.make_soup(text).decode() != utils.BeautifulSoup(text, 'html.parser').decode()
+
+
+def test_serialized_len():
+    for text in _CORPUS + _DIVERGENT:
+        soup = utils.make_soup(text)
+        lengths = {}
+        for node in soup.find_all(True):
+            assert utils.serialized_len(node, lengths) == len(str(node))